@@ -4,32 +4,144 @@ from langchain_core.prompts import ChatPromptTemplate
 import pandas as pd
 import io
 import json
+import threading
+import time
+from agents.prompt_builder import count_tokens
+from utils.llm_scheduler import get_scheduler, PRIORITY_ANSWER
+from utils.services import add_shutdown_hook
+from utils.telemetry import UsageCallbackHandler, record_llm_call
+from utils.tracing import start_span
+from utils.query_engine import describe_tables, needs_table_summary, out_of_core_info
 
-def get_llm(api_key: str):
-    """Retorna uma instância do LLM Gemini Flash com timeout."""
+# Fábrica alternativa de LLM (os benchmarks usam um modelo falso no lugar do Gemini)
+_llm_factory = None
+
+# Clientes do Gemini por (chave, esquema de resposta): criados uma vez e compartilhados pelas sessões
+_llm_clients = {}
+_llm_clients_lock = threading.Lock()
+
+def set_llm_factory(factory):
+    """Substitui a criação do LLM por `factory(api_key)`; None restaura o Gemini."""
+    global _llm_factory
+    _llm_factory = factory
+    clear_llm_clients()
+
+def clear_llm_clients():
+    """Descarta os clientes do Gemini em cache (recriados na próxima chamada)."""
+    with _llm_clients_lock:
+        _llm_clients.clear()
+
+add_shutdown_hook(clear_llm_clients)
+
+def get_llm(api_key: str, response_schema: dict | None = None):
+    """
+    Retorna uma instância do LLM Gemini Flash com timeout.
+
+    Com `response_schema`, usa o modo JSON do provedor: a resposta é restrita
+    a um objeto que segue o esquema informado. A instância (e suas conexões
+    HTTP) é reaproveitada entre chamadas, sessões e execuções do script.
+    """
+    if _llm_factory is not None:
+        return _llm_factory(api_key)
+    key = (api_key, json.dumps(response_schema, sort_keys=True) if response_schema is not None else None)
+    structured = {}
+    if response_schema is not None:
+        structured = {"response_mime_type": "application/json", "response_schema": response_schema}
     try:
-        return ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=api_key,
-            temperature=0.0,
-            request_timeout=30  # Timeout de 30 segundos
-        )
+        with _llm_clients_lock:
+            llm = _llm_clients.get(key)
+            if llm is None:
+                llm = _llm_clients[key] = ChatGoogleGenerativeAI(
+                    model="gemini-2.0-flash",
+                    google_api_key=api_key,
+                    temperature=0.0,
+                    request_timeout=30,  # Timeout de 30 segundos
+                    max_retries=0,  # Retentativas ficam a cargo do agendador global (utils/llm_scheduler.py)
+                    **structured
+                )
+        return llm
     except Exception as e:
         print(f"Erro ao criar LLM: {e}")
         raise e
 
-def get_dataset_preview(df: pd.DataFrame) -> str:
-    """Preview compacto para reduzir tokens."""
+async def ainvoke_chain(chain, inputs: dict, agent: str, priority: int = PRIORITY_ANSWER):
+    """Invoca a chain passando pelo agendador global de requisições ao LLM."""
+    with start_span(f"llm {agent}", agent=agent, priority=priority) as span:
+        return await get_scheduler().run(lambda: _instrumented_invoke(chain, inputs, agent, span), priority=priority)
+
+async def _instrumented_invoke(chain, inputs: dict, agent: str, span=None) -> str:
+    """Executa a chain em streaming medindo latência, tempo até o primeiro token e tokens."""
+    handler = UsageCallbackHandler()
+    started_at = time.perf_counter()
+    if span is not None:
+        # Tempo aguardando na fila do agendador (inclui backoff de retentativas)
+        span.set_attribute("queue_wait_ms", round(span.duration_ms, 1))
+    first_chunk_at = None
+    chunks = []
+    try:
+        async for chunk in chain.astream(inputs, config={"callbacks": [handler]}):
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+            chunks.append(chunk)
+    except Exception:
+        record_llm_call(agent, prompt_tokens=0, completion_tokens=0,
+                        latency_s=time.perf_counter() - started_at, success=False)
+        raise
+
+    output = "".join(chunks)
+    latency = time.perf_counter() - started_at
+    ttft = first_chunk_at - started_at if first_chunk_at is not None else None
+
+    usage = handler.usage
+    if span is not None:
+        span.set_attributes(
+            ttft_ms=round(ttft * 1000, 1) if ttft is not None else -1.0,
+            prompt_tokens=(usage or {}).get("input_tokens", handler.prompt_chars // 4),
+            completion_tokens=(usage or {}).get("output_tokens", count_tokens(output)),
+            output_chars=len(output)
+        )
+    if usage:
+        record_llm_call(
+            agent,
+            prompt_tokens=usage.get("input_tokens", 0),
+            completion_tokens=usage.get("output_tokens", 0),
+            cached_tokens=(usage.get("input_token_details") or {}).get("cache_read", 0),
+            latency_s=latency,
+            ttft_s=ttft
+        )
+    else:
+        # Modelo não informou o uso: estima pelo tamanho dos textos
+        record_llm_call(
+            agent,
+            prompt_tokens=handler.prompt_chars // 4,
+            completion_tokens=count_tokens(output),
+            latency_s=latency,
+            ttft_s=ttft,
+            estimated=True
+        )
+    return output
+
+def get_dataset_preview(df: pd.DataFrame, tables: dict | None = None) -> str:
+    """Preview compacto para reduzir tokens (com o resumo das tabelas, se houver várias ou dados fora da memória)."""
     MAX_COLS = 30
     MAX_ROWS_SAMPLE = 3
     cols = df.columns.tolist()[:MAX_COLS]
     dtypes = {c: str(df.dtypes[c]) for c in cols}
     sample = df[cols].head(MAX_ROWS_SAMPLE).to_dict(orient="records")
 
+    source = out_of_core_info(df)
+    shape = (source["rows"], df.shape[1]) if source else df.shape
+
     preview = (
-        f"Shape: {df.shape}\n"
+        f"Shape: {shape}\n"
         f"Columns (limited to {MAX_COLS}): {cols}\n"
         f"Dtypes: {dtypes}\n"
         f"Sample first {MAX_ROWS_SAMPLE} rows (dict): {sample}\n"
     )
+    if source:
+        preview += (f"Dataset fora da memória: `df` é uma amostra aleatória de {source['sample_rows']} linhas; "
+                    "para contagens e agregações exatas consulte a tabela completa com sql().\n")
+    if needs_table_summary(tables):
+        primary = next((name for name, table in tables.items() if table is df), None)
+        preview += describe_tables(tables, primary=primary)
     return preview
\ No newline at end of file
@@ -1,20 +1,22 @@
 # Arquivo: agents/code_generator.py
 
-from agents.agent_setup import get_llm, get_dataset_preview
-from langchain_core.prompts import ChatPromptTemplate
+from agents.agent_setup import get_llm, get_dataset_preview, ainvoke_chain
+from utils.async_runtime import run_sync
+from agents.prompt_builder import PromptSpec, PromptSection, FewShotExample, PROMPT_MODE_FULL
 from langchain_core.output_parsers import StrOutputParser
 
-PROMPT_TEMPLATE = """
+PROMPT_SPEC = PromptSpec(
+    "CodeGeneratorAgent",
+    sections=[
+        PromptSection("role", """
 # IDENTIDADE & EXPERTISE
 Você é o **CodeGeneratorAgent**, um engenheiro de software especializado em data science com certificação Python.
 Especializações: código limpo, PEP 8, documentação, otimização de performance, boas práticas de engenharia.
-
-# INFORMAÇÕES DO DATASET
-{dataset_info}
-
-# ANÁLISE A SER CONVERTIDA EM CÓDIGO
-{analysis_to_convert}
-
+""", compact="""
+# IDENTIDADE
+Você é o **CodeGeneratorAgent**, engenheiro de software especializado em data science (código limpo, PEP 8, documentado).
+"""),
+        PromptSection("process", """
 # PROCESSO DE GERAÇÃO (Chain-of-Thought)
 Siga este processo estruturado:
 
@@ -37,9 +39,48 @@ Siga este processo estruturado:
 - Verifique se todas as variáveis estão definidas
 - Confirme que imports estão completos
 - Garanta que o código é executável
-
-# EXEMPLOS DE CÓDIGO (Few-Shot Learning)
-
+""", compact="""
+# PROCESSO
+Identifique os objetivos e operações da análise, organize o código em seções (imports, preparação, análise, visualização) e confirme que todas as variáveis e imports estão definidos.
+"""),
+        PromptSection("restrictions", """
+# RESTRIÇÕES CRÍTICAS
+1. **DataFrame Pré-carregado**: NUNCA inclua `df = pd.read_csv(...)` - o DataFrame `df` já existe
+2. **Variável fig**: Para visualizações, SEMPRE atribua à variável `fig`
+3. **Sem fig.show()**: NUNCA inclua `fig.show()` - o Streamlit exibe automaticamente
+4. **Imports Completos**: Inclua TODOS os imports necessários no topo
+5. **Apenas Código**: Retorne SOMENTE o bloco Python, sem explicações ou markdown
+6. **Tratamento de Erros**: Verifique existência de colunas e trate casos extremos
+7. **Comentários Informativos**: Use comentários para explicar lógica complexa
+8. **PEP 8**: Siga convenções de estilo Python (snake_case, espaçamento, etc.)
+"""),
+        PromptSection("practices", """
+# BOAS PRÁTICAS
+- **Nomes Descritivos**: Use nomes de variáveis claros (evite `x`, `y`, `temp`)
+- **Modularidade**: Organize código em seções lógicas com comentários de seção
+- **Eficiência**: Use métodos vetorizados do pandas/numpy quando possível
+- **Robustez**: Trate valores NaN, colunas inexistentes, datasets vazios
+- **Legibilidade**: Priorize clareza sobre brevidade
+""", compact="""
+# BOAS PRÁTICAS
+Nomes descritivos, operações vetorizadas do pandas/numpy e tratamento de NaN, colunas inexistentes e datasets vazios.
+"""),
+        PromptSection("dataset", """
+# INFORMAÇÕES DO DATASET
+{dataset_info}
+""", static=False),
+        PromptSection("analysis", """
+# ANÁLISE A SER CONVERTIDA EM CÓDIGO
+{analysis_to_convert}
+""", static=False),
+        PromptSection("answer", """
+# SEU CÓDIGO PYTHON
+""", static=False),
+    ],
+    examples=[
+        FewShotExample(
+            "Calcule estatísticas descritivas da coluna price",
+            """
 **Exemplo 1 - Análise Estatística Simples:**
 Solicitação: "Calcule estatísticas descritivas da coluna 'price'"
 
@@ -64,13 +105,18 @@ iqr = q3 - q1
 
 # Exibir resultados
 print(f"=== Estatísticas de 'price' ===")
-print(f"Média: R$ {media_price:.2f}")
-print(f"Mediana: R$ {mediana_price:.2f}")
-print(f"Desvio Padrão: R$ {std_price:.2f}")
-print(f"Range: R$ {min_price:.2f} - R$ {max_price:.2f}")
-print(f"IQR: R$ {iqr:.2f}")
+print(f"Média: R$ {{media_price:.2f}}")
+print(f"Mediana: R$ {{mediana_price:.2f}}")
+print(f"Desvio Padrão: R$ {{std_price:.2f}}")
+print(f"Range: R$ {{min_price:.2f}} - R$ {{max_price:.2f}}")
+print(f"IQR: R$ {{iqr:.2f}}")
 ```
-
+""",
+            keywords=("estatísticas", "descritivas", "média", "mediana", "quartis", "desvio"),
+        ),
+        FewShotExample(
+            "Crie um histograma da distribuição de idade",
+            """
 **Exemplo 2 - Visualização com Plotly:**
 Solicitação: "Crie um histograma da distribuição de idade"
 
@@ -108,13 +154,18 @@ fig.add_vline(
     x=media_idade,
     line_dash='dash',
     line_color='red',
-    annotation_text=f'Média: {media_idade:.1f}',
+    annotation_text=f'Média: {{media_idade:.1f}}',
     annotation_position='top'
 )
 
 # Nota: fig.show() não é necessário no Streamlit
 ```
-
+""",
+            keywords=("histograma", "distribuição", "gráfico", "visualização", "plotly"),
+        ),
+        FewShotExample(
+            "Analise correlações entre variáveis numéricas",
+            """
 **Exemplo 3 - Análise de Correlação com Heatmap:**
 Solicitação: "Analise correlações entre variáveis numéricas"
 
@@ -157,12 +208,17 @@ if len(numeric_cols) >= 2:
         for j in range(i+1, len(corr_matrix.columns)):
             corr_value = corr_matrix.iloc[i, j]
             if abs(corr_value) > 0.7:
-                print(f"{corr_matrix.columns[i]} ↔ {corr_matrix.columns[j]}: {corr_value:.3f}")
+                print(f"{{corr_matrix.columns[i]}} ↔ {{corr_matrix.columns[j]}}: {{corr_value:.3f}}")
 else:
     print("Erro: São necessárias pelo menos 2 colunas numéricas para análise de correlação.")
     fig = None
 ```
-
+""",
+            keywords=("correlação", "heatmap", "matriz", "numéricas"),
+        ),
+        FewShotExample(
+            "Crie visualização de densidade KNN gaussiana",
+            """
 **Exemplo 4 - KNN Gaussiano (Avançado):**
 Solicitação: "Crie visualização de densidade KNN gaussiana"
 
@@ -226,53 +282,44 @@ if len(numeric_cols) >= 2:
     ))
     
     fig.update_layout(
-        title=f'KNN Gaussiano - Densidade: {col1} vs {col2}',
+        title=f'KNN Gaussiano - Densidade: {{col1}} vs {{col2}}',
         xaxis_title=col1,
         yaxis_title=col2,
         width=800,
         height=600
     )
     
-    print(f"Gráfico KNN Gaussiano criado para {col1} vs {col2}")
-    print(f"Bandwidth utilizado: {bandwidth}")
-    print(f"Número de pontos: {len(X)}")
+    print(f"Gráfico KNN Gaussiano criado para {{col1}} vs {{col2}}")
+    print(f"Bandwidth utilizado: {{bandwidth}}")
+    print(f"Número de pontos: {{len(X)}}")
 else:
     print("Erro: São necessárias pelo menos 2 colunas numéricas para KNN Gaussiano.")
     fig = None
 ```
+""",
+            keywords=("knn", "densidade", "kernel", "gaussiano", "kde", "cluster"),
+        ),
+    ],
+    examples_header="# EXEMPLOS DE CÓDIGO (Few-Shot Learning)",
+)
 
-# RESTRIÇÕES CRÍTICAS
-1. **DataFrame Pré-carregado**: NUNCA inclua `df = pd.read_csv(...)` - o DataFrame `df` já existe
-2. **Variável fig**: Para visualizações, SEMPRE atribua à variável `fig`
-3. **Sem fig.show()**: NUNCA inclua `fig.show()` - o Streamlit exibe automaticamente
-4. **Imports Completos**: Inclua TODOS os imports necessários no topo
-5. **Apenas Código**: Retorne SOMENTE o bloco Python, sem explicações ou markdown
-6. **Tratamento de Erros**: Verifique existência de colunas e trate casos extremos
-7. **Comentários Informativos**: Use comentários para explicar lógica complexa
-8. **PEP 8**: Siga convenções de estilo Python (snake_case, espaçamento, etc.)
-
-# BOAS PRÁTICAS
-- **Nomes Descritivos**: Use nomes de variáveis claros (evite `x`, `y`, `temp`)
-- **Modularidade**: Organize código em seções lógicas com comentários de seção
-- **Eficiência**: Use métodos vetorizados do pandas/numpy quando possível
-- **Robustez**: Trate valores NaN, colunas inexistentes, datasets vazios
-- **Legibilidade**: Priorize clareza sobre brevidade
+# Prompt completo (modo "full"), mantido para referência e compatibilidade
+PROMPT_TEMPLATE = PROMPT_SPEC.template_text(PROMPT_MODE_FULL)
 
-# SEU CÓDIGO PYTHON
-"""
 
-def get_code_generator_agent(api_key: str):
+def get_code_generator_agent(api_key: str, question: str = ""):
     llm = get_llm(api_key)
-    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+    # Prompt compacto com os exemplos few-shot mais parecidos com a pergunta
+    prompt = PROMPT_SPEC.get_prompt(question)
     chain = prompt | llm | StrOutputParser()
     return chain
 
-def run_code_generator(api_key: str, dataset_info: str, analysis_to_convert: str):
-    agent = get_code_generator_agent(api_key)
-    raw_code = agent.invoke({
+async def arun_code_generator(api_key: str, dataset_info: str, analysis_to_convert: str):
+    agent = get_code_generator_agent(api_key, analysis_to_convert)
+    raw_code = await ainvoke_chain(agent, {
     "dataset_info": dataset_info,
     "analysis_to_convert": analysis_to_convert
-    })
+    }, agent="CodeGeneratorAgent")
 
     # Melhorar a extração do código para evitar duplicatas
     if "```python" in raw_code:
@@ -323,3 +370,7 @@ def run_code_generator(api_key: str, dataset_info: str, analysis_to_convert: str
             print("✅ Duplicata detectada após parsing - removida!")
 
     return clean_code
+
+
+def run_code_generator(api_key: str, dataset_info: str, analysis_to_convert: str):
+    return run_sync(arun_code_generator(api_key, dataset_info, analysis_to_convert))
@@ -1,22 +1,21 @@
 import pandas as pd
-from agents.agent_setup import get_llm, get_dataset_preview
-from langchain_core.prompts import ChatPromptTemplate
+from agents.agent_setup import get_llm, get_dataset_preview, ainvoke_chain
+from utils.async_runtime import run_sync
+from agents.prompt_builder import PromptSpec, PromptSection, FewShotExample, PROMPT_MODE_FULL
 from langchain_core.output_parsers import StrOutputParser
 
-PROMPT_TEMPLATE = """
+PROMPT_SPEC = PromptSpec(
+    "ConsultantAgent",
+    sections=[
+        PromptSection("role", """
 # IDENTIDADE & EXPERTISE
 Você é o **ConsultantAgent**, um consultor estratégico de dados sênior com MBA e 15+ anos de experiência.
 Especializações: business intelligence, estratégia data-driven, ROI de analytics, gestão de riscos.
-
-# CONTEXTO DO DATASET
-{dataset_preview}
-
-# HISTÓRICO DE ANÁLISES REALIZADAS
-{all_analyses}
-
-# PERGUNTA DO USUÁRIO
-"{user_question}"
-
+""", compact="""
+# IDENTIDADE
+Você é o **ConsultantAgent**, consultor estratégico de dados sênior (business intelligence, estratégia data-driven, gestão de riscos).
+"""),
+        PromptSection("process", """
 # PROCESSO DE CONSULTORIA (Chain-of-Thought)
 Siga este framework estruturado:
 
@@ -43,7 +42,12 @@ Siga este framework estruturado:
 - Sugira ações concretas baseadas em evidências
 - Priorize por impacto e viabilidade
 - Considere próximos passos de análise
-
+""", compact="""
+# PROCESSO
+1. Valide se os dados e colunas mencionados existem e se há análises prévias suficientes; se não houver, comunique a limitação e pare.
+2. Sintetize as evidências das análises, traduza-as em implicações de negócio e recomende ações priorizadas por impacto e viabilidade.
+"""),
+        PromptSection("structure", """
 # ESTRUTURA DA RESPOSTA
 Organize sua consultoria em Markdown seguindo este template:
 
@@ -78,9 +82,43 @@ Organize sua consultoria em Markdown seguindo este template:
 
 **Riscos Potenciais:**
 - [Risco 1 com severidade estimada]
-
-# EXEMPLOS DE CONSULTORIA (Few-Shot Learning)
-
+"""),
+        PromptSection("restrictions", """
+# RESTRIÇÕES CRÍTICAS
+1. **Evidência Obrigatória**: NUNCA faça afirmações sem dados que as sustentem
+2. **Admita Limitações**: Se dados faltarem, diga claramente "não é possível responder"
+3. **Sem Especulação**: Não invente hipóteses sobre dados inexistentes
+4. **Quantifique Impacto**: Use termos como "alto/médio/baixo impacto" com justificativa
+5. **Concisão**: Máximo 500 palavras, foque em valor acionável
+6. **Tom Profissional**: Equilibre confiança com humildade sobre limitações
+"""),
+        PromptSection("principles", """
+# PRINCÍPIOS DE CONSULTORIA
+- **Orientado a Ação**: Toda conclusão deve levar a uma recomendação
+- **Baseado em ROI**: Priorize insights com maior potencial de impacto
+- **Gestão de Risco**: Sempre identifique riscos potenciais
+- **Próximos Passos**: Sugira análises complementares quando relevante
+""", compact=""),
+        PromptSection("dataset", """
+# CONTEXTO DO DATASET
+{dataset_preview}
+""", static=False),
+        PromptSection("history", """
+# HISTÓRICO DE ANÁLISES REALIZADAS
+{all_analyses}
+""", static=False),
+        PromptSection("question", """
+# PERGUNTA DO USUÁRIO
+"{user_question}"
+""", static=False),
+        PromptSection("answer", """
+# SUA CONSULTORIA
+""", static=False),
+    ],
+    examples=[
+        FewShotExample(
+            "O que a correlação entre experiência e salário significa para RH?",
+            """
 **Exemplo 1 - Interpretação de Correlação:**
 Pergunta: "O que a correlação entre experiência e salário significa para RH?"
 Análise Prévia: "Correlação de Pearson r=0.78, p<0.001"
@@ -117,7 +155,12 @@ A política salarial demonstra maturidade e consistência, valorizando experiên
 
 **Riscos:**
 - Rigidez excessiva pode desincentivar talentos júniors de alto potencial
-
+""",
+            keywords=("significa", "correlação", "insight", "recomendação", "estratégia", "impacto"),
+        ),
+        FewShotExample(
+            "Como estão as vendas por região?",
+            """
 **Exemplo 2 - Pergunta Inválida:**
 Pergunta: "Como estão as vendas por região?"
 Dataset: Contém apenas dados de RH (salário, cargo, experiência)
@@ -129,36 +172,37 @@ Resposta:
 **Motivo**: O dataset atual contém apenas dados de Recursos Humanos (salário, cargo, experiência). Não há informações sobre vendas ou regiões geográficas.
 
 **Sugestão**: Para analisar vendas por região, será necessário carregar um dataset de vendas que contenha as colunas 'vendas' e 'regiao'.
+""",
+            keywords=("existe", "disponível", "dados", "coluna", "não"),
+        ),
+    ],
+    examples_header="# EXEMPLOS DE CONSULTORIA (Few-Shot Learning)",
+)
 
-# RESTRIÇÕES CRÍTICAS
-1. **Evidência Obrigatória**: NUNCA faça afirmações sem dados que as sustentem
-2. **Admita Limitações**: Se dados faltarem, diga claramente "não é possível responder"
-3. **Sem Especulação**: Não invente hipóteses sobre dados inexistentes
-4. **Quantifique Impacto**: Use termos como "alto/médio/baixo impacto" com justificativa
-5. **Concisão**: Máximo 500 palavras, foque em valor acionável
-6. **Tom Profissional**: Equilibre confiança com humildade sobre limitações
-
-# PRINCÍPIOS DE CONSULTORIA
-- **Orientado a Ação**: Toda conclusão deve levar a uma recomendação
-- **Baseado em ROI**: Priorize insights com maior potencial de impacto
-- **Gestão de Risco**: Sempre identifique riscos potenciais
-- **Próximos Passos**: Sugira análises complementares quando relevante
+# Prompt completo (modo "full"), mantido para referência e compatibilidade
+PROMPT_TEMPLATE = PROMPT_SPEC.template_text(PROMPT_MODE_FULL)
 
-# SUA CONSULTORIA
-"""
 
-def get_consultant_agent(api_key: str):
+def get_consultant_agent(api_key: str, question: str = ""):
     llm = get_llm(api_key)
-    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+    # Prompt compacto com os exemplos few-shot mais parecidos com a pergunta
+    prompt = PROMPT_SPEC.get_prompt(question)
     chain = prompt | llm | StrOutputParser()
     return chain
 
-def run_consultant(api_key: str, df: pd.DataFrame, all_analyses: str, user_question: str):
-    agent = get_consultant_agent(api_key)
-    dataset_preview = get_dataset_preview(df)
-    response = agent.invoke({
+async def arun_consultant(api_key: str, df: pd.DataFrame, all_analyses: str, user_question: str, tables: dict | None = None,
+                          precomputed: str = ""):
+    agent = get_consultant_agent(api_key, user_question)
+    dataset_preview = get_dataset_preview(df, tables)
+    # Perfil, correlações e outliers do pré-cálculo (dataset completo), quando já prontos
+    if precomputed:
+        dataset_preview += precomputed + "\n"
+    response = await ainvoke_chain(agent, {
         "dataset_preview": dataset_preview,
         "all_analyses": all_analyses,
         "user_question": user_question
-    })
-    return response
\ No newline at end of file
+    }, agent="ConsultantAgent")
+    return response
+
+def run_consultant(api_key: str, df: pd.DataFrame, all_analyses: str, user_question: str, tables: dict | None = None):
+    return run_sync(arun_consultant(api_key, df, all_analyses, user_question, tables=tables))
@@ -1,16 +1,65 @@
 # Arquivo: agents/coordinator.py
 
-from agents.agent_setup import get_llm, get_dataset_preview
-from langchain_core.prompts import ChatPromptTemplate
+from agents.agent_setup import get_llm, get_dataset_preview, ainvoke_chain
+from utils.async_runtime import run_sync
+from utils.json_output import JSONOutputError, parse_json_object
+from utils.llm_scheduler import PRIORITY_ROUTING
+from agents.prompt_builder import PromptSpec, PromptSection, FewShotExample, PROMPT_MODE_FULL
 from langchain_core.output_parsers import StrOutputParser
-import json
+import re
 import pandas as pd
 
-PROMPT_TEMPLATE = """
+# Agentes especialistas que o coordenador pode escolher
+AGENTS = ("DataAnalystAgent", "VisualizationAgent", "ConsultantAgent", "CodeGeneratorAgent")
+# Nomes aceitos (sem diferenciar maiúsculas, com ou sem o sufixo "Agent")
+_AGENT_ALIASES = {**{name.lower(): name for name in AGENTS},
+                  **{name[:-len("Agent")].lower(): name for name in AGENTS}}
+
+# Esquema da decisão, usado no modo JSON do provedor
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "agent_to_call": {"type": "string", "enum": list(AGENTS)},
+        "question_for_agent": {"type": "string"},
+        "rationale": {"type": "string"},
+        "plan": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "agent": {"type": "string", "enum": list(AGENTS)},
+                    "question": {"type": "string"},
+                    "depends_on": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["id", "agent", "question"],
+            },
+        },
+    },
+    "required": ["agent_to_call", "question_for_agent"],
+}
+
+# Roteamento local (em ordem de prioridade) quando a resposta do coordenador não pode ser lida
+_KEYWORD_ROUTES = (
+    ("CodeGeneratorAgent", re.compile(r"\b(c[óo]digo|script|notebook|python)\b", re.IGNORECASE)),
+    ("VisualizationAgent", re.compile(r"\b(gr[áa]fico\w*|plot\w*|mostre|visualiz\w*|histograma|scatter|heatmap|"
+                                      r"boxplot|dispers[ãa]o)\b", re.IGNORECASE)),
+    ("ConsultantAgent", re.compile(r"\b(significa\w*|porqu[êe]|por que|insights?|recomenda\w*|conclus\w*|"
+                                   r"impacto|interpret\w*|estrat[ée]gi\w*)\b", re.IGNORECASE)),
+)
+
+PROMPT_SPEC = PromptSpec(
+    "CoordinatorAgent",
+    sections=[
+        PromptSection("role", """
 # ROLE & EXPERTISE
 Você é o **CoordinatorAgent**, um orquestrador especializado em sistemas multi-agente para análise de dados.
 Sua expertise: arquitetura de sistemas, roteamento inteligente, e compreensão profunda de intenções do usuário.
-
+""", compact="""
+# ROLE
+Você é o **CoordinatorAgent**: roteia cada pergunta de análise de dados para o agente especialista mais adequado.
+"""),
+        PromptSection("agents", """
 # AGENTES DISPONÍVEIS
 1. **DataAnalystAgent** → Análises estatísticas, métricas quantitativas, padrões, outliers, correlações
    - Palavras-chave: "quantos", "média", "correlação", "distribuição", "estatística", "padrão"
@@ -23,16 +72,8 @@ Sua expertise: arquitetura de sistemas, roteamento inteligente, e compreensão p
    
 4. **CodeGeneratorAgent** → Geração de código Python reproduzível
    - Palavras-chave: "código", "script", "notebook", "gere o código", "python"
-
-# CONTEXTO DO DATASET
-{dataset_preview}
-
-# HISTÓRICO DA CONVERSA
-{conversation_history}
-
-# PERGUNTA DO USUÁRIO
-"{user_question}"
-
+"""),
+        PromptSection("process", """
 # PROCESSO DE RACIOCÍNIO (Chain-of-Thought)
 Siga este processo mental passo a passo:
 
@@ -51,91 +92,171 @@ Siga este processo mental passo a passo:
 **Passo 4 - Decisão Final:**
 - Qual agente é o MAIS adequado?
 - Como reformular a pergunta para maximizar a eficácia do agente escolhido?
-
-# EXEMPLOS DE RACIOCÍNIO (Few-Shot Learning)
-
+""", compact="""
+# PROCESSO
+Identifique a intenção (números, gráfico, insight ou código), as palavras-chave e a dependência do histórico; escolha o agente MAIS adequado e reformule a pergunta de forma específica e acionável para ele.
+"""),
+        PromptSection("restrictions", """
+# RESTRIÇÕES CRÍTICAS
+1. Retorne APENAS JSON válido, sem markdown, sem explicações
+2. Use formato compacto (sem espaços desnecessários)
+3. A chave "question_for_agent" deve ser específica e acionável
+4. A chave "rationale" deve ser concisa (máx 15 palavras)
+"""),
+        PromptSection("plan", """
+# PEDIDOS COMPOSTOS (plano de etapas)
+Se a pergunta pedir mais de uma coisa (ex.: calcular, plotar E interpretar), inclua também a chave "plan":
+uma lista de etapas {{"id":"s1","agent":"...","question":"...","depends_on":[]}}.
+- Agentes permitidos nas etapas: DataAnalystAgent, VisualizationAgent, ConsultantAgent (no máximo 4 etapas e um único VisualizationAgent)
+- Etapas sem dependência entre si rodam em paralelo: só use "depends_on" quando a etapa precisar do resultado de outra
+- Interpretações (ConsultantAgent) devem depender das etapas que produzem os números ou gráficos interpretados
+- "agent_to_call" continua obrigatório: use o agente da etapa principal
+- Para perguntas simples, NÃO inclua "plan"
+""", compact="""
+# PEDIDOS COMPOSTOS
+Se a pergunta pedir mais de uma coisa (ex.: calcular, plotar E interpretar), inclua "plan": lista de etapas {{"id":"s1","agent":"...","question":"...","depends_on":[]}} com DataAnalystAgent, VisualizationAgent ou ConsultantAgent (máx. 4 etapas, um único VisualizationAgent). Etapas independentes rodam em paralelo; o ConsultantAgent depende das etapas que interpreta. Mantenha "agent_to_call" (agente principal). Perguntas simples não têm "plan".
+"""),
+        PromptSection("dataset", """
+# CONTEXTO DO DATASET
+{dataset_preview}
+""", static=False),
+        PromptSection("history", """
+# HISTÓRICO DA CONVERSA
+{conversation_history}
+""", static=False),
+        PromptSection("question", """
+# PERGUNTA DO USUÁRIO
+"{user_question}"
+""", static=False),
+        PromptSection("answer", """
+# SUA RESPOSTA (JSON APENAS)
+""", static=False),
+    ],
+    examples=[
+        FewShotExample(
+            "Qual a correlação entre vendas e lucro?",
+            """
 **Exemplo 1:**
 Pergunta: "Qual a correlação entre vendas e lucro?"
 Raciocínio: Passo 1→Busca métrica quantitativa. Passo 2→"correlação" indica análise estatística. Passo 3→Sem dependências. Passo 4→DataAnalystAgent.
 Saída: {{"agent_to_call":"DataAnalystAgent","question_for_agent":"Calcule a correlação de Pearson entre as colunas 'vendas' e 'lucro' e interprete a força da relação.","rationale":"Pergunta solicita métrica estatística específica (correlação)."}}
-
+""",
+            keywords=("correlação", "média", "quantos", "estatística", "distribuição"),
+        ),
+        FewShotExample(
+            "Mostre um gráfico de dispersão da idade vs salário",
+            """
 **Exemplo 2:**
 Pergunta: "Mostre um gráfico de dispersão da idade vs salário"
 Raciocínio: Passo 1→Solicita visualização. Passo 2→"mostre", "gráfico", "dispersão" indicam VisualizationAgent. Passo 3→Sem dependências. Passo 4→VisualizationAgent.
 Saída: {{"agent_to_call":"VisualizationAgent","question_for_agent":"Crie um scatter plot interativo com 'idade' no eixo X e 'salário' no eixo Y, incluindo linha de tendência.","rationale":"Solicitação explícita de visualização tipo scatter plot."}}
-
+""",
+            keywords=("gráfico", "mostre", "plot", "histograma", "heatmap", "visualize"),
+        ),
+        FewShotExample(
+            "O que esses números significam para minha estratégia de marketing?",
+            """
 **Exemplo 3:**
 Pergunta: "O que esses números significam para minha estratégia de marketing?"
 Raciocínio: Passo 1→Busca interpretação de negócio. Passo 2→"significam", "estratégia" indicam ConsultantAgent. Passo 3→Pode depender de análises anteriores. Passo 4→ConsultantAgent.
 Saída: {{"agent_to_call":"ConsultantAgent","question_for_agent":"Com base nas análises realizadas, forneça insights estratégicos para otimização de marketing, identificando oportunidades e riscos.","rationale":"Pergunta busca interpretação estratégica e recomendações de negócio."}}
-
+""",
+            keywords=("significa", "insight", "recomendação", "conclusão", "impacto", "estratégia"),
+        ),
+        FewShotExample(
+            "Me dê o código Python para essa análise",
+            """
 **Exemplo 4:**
 Pergunta: "Me dê o código Python para essa análise"
 Raciocínio: Passo 1→Solicita código. Passo 2→"código", "Python" indicam CodeGeneratorAgent. Passo 3→Depende do contexto. Passo 4→CodeGeneratorAgent.
 Saída: {{"agent_to_call":"CodeGeneratorAgent","question_for_agent":"Gere código Python completo e documentado para reproduzir a análise discutida, incluindo imports e comentários.","rationale":"Solicitação explícita de geração de código."}}
+""",
+            keywords=("código", "script", "notebook", "python"),
+        ),
+        FewShotExample(
+            "Calcule as correlações, plote-as e me diga o que significam",
+            """
+**Exemplo 5:**
+Pergunta: "Calcule as correlações, plote-as e me diga o que significam"
+Raciocínio: Passo 1→Três pedidos: métrica, gráfico e interpretação. Passo 2→"calcule", "plote", "significam". Passo 3→A interpretação depende do cálculo e do gráfico; cálculo e gráfico são independentes. Passo 4→Plano com três etapas.
+Saída: {{"agent_to_call":"DataAnalystAgent","question_for_agent":"Calcule a matriz de correlação de Pearson entre as variáveis numéricas e destaque os pares mais fortes.","rationale":"Pedido composto: cálculo, gráfico e interpretação.","plan":[{{"id":"s1","agent":"DataAnalystAgent","question":"Calcule a matriz de correlação de Pearson entre as variáveis numéricas e destaque os pares mais fortes.","depends_on":[]}},{{"id":"s2","agent":"VisualizationAgent","question":"Crie um heatmap da matriz de correlação das variáveis numéricas.","depends_on":[]}},{{"id":"s3","agent":"ConsultantAgent","question":"Interprete as correlações encontradas e o que significam para o negócio.","depends_on":["s1","s2"]}}]}}
+""",
+            keywords=("depois", "também", "plote", "calcule", "significam", "explique", "interprete"),
+        ),
+    ],
+    examples_header="# EXEMPLOS DE RACIOCÍNIO (Few-Shot Learning)",
+)
 
-# RESTRIÇÕES CRÍTICAS
-1. Retorne APENAS JSON válido, sem markdown, sem explicações
-2. Use formato compacto (sem espaços desnecessários)
-3. A chave "question_for_agent" deve ser específica e acionável
-4. A chave "rationale" deve ser concisa (máx 15 palavras)
+# Prompt completo (modo "full"), mantido para referência e compatibilidade
+PROMPT_TEMPLATE = PROMPT_SPEC.template_text(PROMPT_MODE_FULL)
 
-# SUA RESPOSTA (JSON APENAS)
-"""
 
-def _clean_json_output(raw_output: str) -> str:
+def validate_decision(decision: dict, user_question: str) -> dict:
     """
-    Limpa a saída do LLM para extrair apenas o JSON, removendo o wrapper de markdown.
+    Valida a decisão do coordenador contra o esquema da resposta.
+
+    Normaliza o nome do agente (ex.: "visualizationagent", "DataAnalyst") e usa
+    a pergunta original quando `question_for_agent` estiver vazio; agente
+    desconhecido levanta JSONOutputError. O plano é validado pelo orquestrador.
     """
-    # Verifica se a saída contém o wrapper de código JSON
-    if "```json" in raw_output:
-        # Extrai o conteúdo entre ```json e ```
-        clean_output = raw_output.split("```json")[1].split("```")[0].strip()
-        return clean_output
-    
-    # Se não tiver o wrapper, mas tiver os ```, remove-os também
-    if "```" in raw_output:
-        clean_output = raw_output.replace("```", "").strip()
-        return clean_output
+    agent = _AGENT_ALIASES.get(str(decision.get("agent_to_call") or "").strip().lower())
+    if agent is None:
+        raise JSONOutputError(f"Agente desconhecido na decisão do coordenador: {decision.get('agent_to_call')!r}")
+    question = decision.get("question_for_agent")
+    if not isinstance(question, str) or not question.strip():
+        question = user_question
+    return {**decision, "agent_to_call": agent, "question_for_agent": question}
+
 
-    return raw_output.strip()
+def route_by_keywords(user_question: str) -> dict:
+    """Roteamento local pelas palavras-chave da pergunta, usado quando a resposta do coordenador é ilegível."""
+    for agent, pattern in _KEYWORD_ROUTES:
+        if pattern.search(user_question or ""):
+            break
+    else:
+        agent = "DataAnalystAgent"
+    return {
+        "agent_to_call": agent,
+        "question_for_agent": user_question,
+        "rationale": "Roteamento local por palavras-chave (resposta do coordenador ilegível).",
+    }
 
 
-def get_coordinator_agent(api_key: str):
-    llm = get_llm(api_key)
-    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+def get_coordinator_agent(api_key: str, question: str = ""):
+    # Modo JSON do provedor: a resposta segue RESPONSE_SCHEMA
+    llm = get_llm(api_key, response_schema=RESPONSE_SCHEMA)
+    # Prompt compacto com os exemplos few-shot mais parecidos com a pergunta
+    prompt = PROMPT_SPEC.get_prompt(question)
     # Alteração: Agora usamos StrOutputParser para obter a string bruta do LLM
     chain = prompt | llm | StrOutputParser()
     return chain
 
-def run_coordinator(api_key: str, df: pd.DataFrame, conversation_history: str, user_question: str) -> dict:
+async def arun_coordinator(api_key: str, df: pd.DataFrame, conversation_history: str, user_question: str, tables: dict | None = None) -> dict:
     """
-    Executa o agente coordenador e garante que a saída seja um JSON válido.
+    Executa o agente coordenador de forma assíncrona e garante que a saída seja um JSON válido.
     """
-    agent = get_coordinator_agent(api_key)
-    dataset_preview = get_dataset_preview(df)
+    agent = get_coordinator_agent(api_key, user_question)
+    dataset_preview = get_dataset_preview(df, tables)
     
     # 1. Invoca o agente para obter a resposta como string
-    raw_response = agent.invoke({
+    raw_response = await ainvoke_chain(agent, {
         "dataset_preview": dataset_preview,
         "conversation_history": conversation_history,
         "user_question": user_question
-    })
+    }, agent="CoordinatorAgent", priority=PRIORITY_ROUTING)
     
-    # 2. Limpa a string de resposta para remover o markdown
-    cleaned_response = _clean_json_output(raw_response)
-    
-    # 3. Tenta carregar a string limpa como um objeto JSON
+    # 2. Lê o JSON (com reparo local se preciso) e valida contra o esquema;
+    #    se nada resolver, roteia pelas palavras-chave em vez de pedir ao usuário que repita a pergunta
     try:
-        json_response = json.loads(cleaned_response)
-        return json_response
-    except json.JSONDecodeError as e:
-        # Se falhar, isso indica um problema mais sério com a saída do LLM
-        print(f"Erro ao decodificar JSON do Coordenador: {e}")
+        return validate_decision(parse_json_object(raw_response, "CoordinatorAgent"), user_question)
+    except JSONOutputError as e:
+        print(f"Erro ao ler a decisão do Coordenador: {e}")
         print(f"Resposta bruta recebida: {raw_response}")
-        # Retorna um dicionário de erro para evitar que a aplicação quebre
-        return {
-            "agent_to_call": "ErrorAgent",
-            "question_for_agent": "A resposta do coordenador não foi um JSON válido.",
-            "rationale": f"Erro de parsing. Resposta recebida:\n{raw_response}"
-        }
\ No newline at end of file
+        return route_by_keywords(user_question)
+
+
+def run_coordinator(api_key: str, df: pd.DataFrame, conversation_history: str, user_question: str, tables: dict | None = None) -> dict:
+    """
+    Executa o agente coordenador no loop compartilhado e aguarda a decisão.
+    """
+    return run_sync(arun_coordinator(api_key, df, conversation_history, user_question, tables=tables))
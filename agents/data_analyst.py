@@ -1,22 +1,21 @@
 import pandas as pd
-from agents.agent_setup import get_llm, get_dataset_preview
-from langchain_core.prompts import ChatPromptTemplate
+from agents.agent_setup import get_llm, get_dataset_preview, ainvoke_chain
+from utils.async_runtime import run_sync
+from agents.prompt_builder import PromptSpec, PromptSection, FewShotExample, PROMPT_MODE_FULL
 from langchain_core.output_parsers import StrOutputParser
 
-PROMPT_TEMPLATE = """
+PROMPT_SPEC = PromptSpec(
+    "DataAnalystAgent",
+    sections=[
+        PromptSection("role", """
 # IDENTIDADE & EXPERTISE
 Você é o **DataAnalystAgent**, um cientista de dados sênior com PhD em Estatística Aplicada e 10+ anos de experiência.
 Especializações: análise exploratória, inferência estatística, detecção de anomalias, modelagem estatística.
-
-# CONTEXTO DO DATASET
-{dataset_preview}
-
-# HISTÓRICO DE ANÁLISES
-{analysis_context}
-
-# PERGUNTA ESPECÍFICA
-"{specific_question}"
-
+""", compact="""
+# IDENTIDADE
+Você é o **DataAnalystAgent**, cientista de dados sênior especializado em estatística aplicada.
+"""),
+        PromptSection("method", """
 # METODOLOGIA DE ANÁLISE (Chain-of-Thought)
 Siga este processo estruturado:
 
@@ -39,7 +38,11 @@ Siga este processo estruturado:
 - Traduza números em observações estatísticas claras
 - Identifique padrões, tendências e anomalias
 - Avalie a qualidade e confiabilidade dos dados
-
+""", compact="""
+# METODOLOGIA
+Identifique as variáveis e o tipo de análise, escolha os métodos estatísticos adequados (descritivas, IQR/Z-score para outliers, correlação com significância) e traduza os números em observações técnicas claras.
+"""),
+        PromptSection("structure", """
 # ESTRUTURA DA RESPOSTA
 Organize sua resposta em Markdown seguindo este template:
 
@@ -58,9 +61,35 @@ Organize sua resposta em Markdown seguindo este template:
 
 ### ⚠️ Considerações sobre Qualidade dos Dados
 [Limitações, valores faltantes, ou premissas importantes]
-
-# EXEMPLOS DE ANÁLISE (Few-Shot Learning)
-
+"""),
+        PromptSection("restrictions", """
+# RESTRIÇÕES CRÍTICAS
+1. **Foco em Dados**: Não forneça recomendações de negócio ou insights estratégicos
+2. **Precisão Numérica**: Use 2-3 casas decimais para métricas
+3. **Rigor Estatístico**: Cite métodos e testes utilizados
+4. **Transparência**: Mencione limitações e premissas
+5. **Concisão**: Máximo 400 palavras, foque no essencial
+"""),
+        PromptSection("dataset", """
+# CONTEXTO DO DATASET
+{dataset_preview}
+""", static=False),
+        PromptSection("history", """
+# HISTÓRICO DE ANÁLISES
+{analysis_context}
+""", static=False),
+        PromptSection("question", """
+# PERGUNTA ESPECÍFICA
+"{specific_question}"
+""", static=False),
+        PromptSection("answer", """
+# SUA ANÁLISE
+""", static=False),
+    ],
+    examples=[
+        FewShotExample(
+            "Qual a distribuição da idade dos clientes?",
+            """
 **Exemplo 1 - Análise Descritiva:**
 Pergunta: "Qual a distribuição da idade dos clientes?"
 
@@ -79,7 +108,12 @@ A distribuição da idade apresenta características de uma distribuição norma
 - Distribuição concentrada entre 25-42 anos (68% dos dados, 1 desvio padrão)
 - Outliers identificados: 3 registros acima de 60 anos (método IQR, Q3 + 1.5*IQR)
 - Skewness = 0.23 (assimetria positiva leve, dentro da normalidade)
-
+""",
+            keywords=("distribuição", "média", "mediana", "desvio", "outliers", "descritiva", "quartis"),
+        ),
+        FewShotExample(
+            "Há correlação entre experiência e salário?",
+            """
 **Exemplo 2 - Análise Correlacional:**
 Pergunta: "Há correlação entre experiência e salário?"
 
@@ -97,24 +131,26 @@ Existe uma correlação positiva forte e estatisticamente significativa entre an
 - Relação aproximadamente linear no range 0-15 anos
 - Plateau observado após 15 anos (efeito teto salarial)
 - Heterocedasticidade detectada: maior variância em salários altos
+""",
+            keywords=("correlação", "relação", "pearson", "regressão", "significância", "associação"),
+        ),
+    ],
+    examples_header="# EXEMPLOS DE ANÁLISE (Few-Shot Learning)",
+)
 
-# RESTRIÇÕES CRÍTICAS
-1. **Foco em Dados**: Não forneça recomendações de negócio ou insights estratégicos
-2. **Precisão Numérica**: Use 2-3 casas decimais para métricas
-3. **Rigor Estatístico**: Cite métodos e testes utilizados
-4. **Transparência**: Mencione limitações e premissas
-5. **Concisão**: Máximo 400 palavras, foque no essencial
+# Prompt completo (modo "full"), mantido para referência e compatibilidade
+PROMPT_TEMPLATE = PROMPT_SPEC.template_text(PROMPT_MODE_FULL)
 
-# SUA ANÁLISE
-"""
 
-def get_data_analyst_agent(api_key: str):
+def get_data_analyst_agent(api_key: str, question: str = ""):
     llm = get_llm(api_key)
-    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+    # Prompt compacto com os exemplos few-shot mais parecidos com a pergunta
+    prompt = PROMPT_SPEC.get_prompt(question)
     chain = prompt | llm | StrOutputParser()
     return chain
 
-def run_data_analyst(api_key: str, df: pd.DataFrame, analysis_context: str, specific_question: str):
+async def arun_data_analyst(api_key: str, df: pd.DataFrame, analysis_context: str, specific_question: str, tables: dict | None = None,
+                            precomputed: str = ""):
     try:
         # Verifica se o DataFrame está vazio
         if df.empty:
@@ -125,19 +161,22 @@ def run_data_analyst(api_key: str, df: pd.DataFrame, analysis_context: str, spec
             return "Erro: Nenhuma pergunta específica foi fornecida para análise."
             
         # Obtém o agente e os dados
-        agent = get_data_analyst_agent(api_key)
-        dataset_preview = get_dataset_preview(df)
+        agent = get_data_analyst_agent(api_key, specific_question)
+        dataset_preview = get_dataset_preview(df, tables)
         
         # Verifica se o preview do dataset foi gerado corretamente
         if not dataset_preview:
             return "Erro: Não foi possível gerar o preview do dataset."
+        # Perfil, correlações e outliers do pré-cálculo (dataset completo), quando já prontos
+        if precomputed:
+            dataset_preview += precomputed + "\n"
             
         # Executa a análise
-        response = agent.invoke({
+        response = await ainvoke_chain(agent, {
             "dataset_preview": dataset_preview,
             "analysis_context": analysis_context or "Nenhum contexto de análise anterior fornecido.",
             "specific_question": specific_question
-        })
+        }, agent="DataAnalystAgent")
         
         # Verifica se a resposta é válida
         if not response or response.strip() == "undefined":
@@ -148,4 +187,7 @@ def run_data_analyst(api_key: str, df: pd.DataFrame, analysis_context: str, spec
     except Exception as e:
         # Log do erro para depuração
         print(f"Erro no DataAnalystAgent: {str(e)}")
-        return f"Ocorreu um erro ao processar sua solicitação: {str(e)}"
\ No newline at end of file
+        return f"Ocorreu um erro ao processar sua solicitação: {str(e)}"
+
+def run_data_analyst(api_key: str, df: pd.DataFrame, analysis_context: str, specific_question: str, tables: dict | None = None):
+    return run_sync(arun_data_analyst(api_key, df, analysis_context, specific_question, tables=tables))
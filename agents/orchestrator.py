@@ -0,0 +1,454 @@
+# Arquivo: agents/orchestrator.py
+
+import asyncio
+import time
+import pandas as pd
+from agents.coordinator import arun_coordinator
+from agents.data_analyst import arun_data_analyst
+from agents.visualization import arepair_visualization, arun_visualization
+from agents.consultant import arun_consultant
+from agents.code_generator import arun_code_generator
+from agents.sql_generator import arun_sql_generator, render_sql_code, use_sql_mode
+from utils.aggregate_cube import get_cube, is_cube_question, match_cube_question
+from utils.async_runtime import run_blocking
+from utils.chart_cache import exec_with_cache
+from utils.chart_templates import match_template
+from utils.code_reuse import get_code_reuse_index
+from utils.config import get_config
+from utils.dataset_registry import dataset_hash
+from utils.llm_scheduler import PRIORITY_PREFETCH, set_priority_floor
+from utils.precompute import get_precomputer
+from utils.query_engine import describe_tables, needs_table_summary, out_of_core_info
+from utils.telemetry import record_cache, record_repair, record_route
+from utils.tracing import start_span
+
+# Rótulo do turno quando o coordenador devolve um plano com várias etapas
+PLAN_AGENT = "MultiAgentPlan"
+# Agentes aceitos nas etapas de um plano (código Python continua restrito a turnos de agente único)
+PLAN_AGENTS = ("DataAnalystAgent", "VisualizationAgent", "ConsultantAgent")
+MAX_PLAN_STEPS = 4
+# Títulos das seções da resposta combinada
+STEP_TITLES = {
+    "DataAnalystAgent": "📊 Análise",
+    "VisualizationAgent": "📈 Visualização",
+    "ConsultantAgent": "💡 Interpretação",
+}
+
+
+async def arun_turn(api_key: str, df: pd.DataFrame, df_info: dict, conversation_history: str,
+                    all_analyses_history: str, user_question: str, memory=None, session_id: str | None = None,
+                    tables: dict | None = None) -> dict:
+    """
+    Executa um turno completo do chat (roteamento + agente especialista) no loop compartilhado.
+
+    O registro da pergunta no banco roda em paralelo com o coordenador, e a
+    resposta é devolvida como dicionário para a camada do Streamlit renderizar.
+    """
+    # Registra a pergunta no banco enquanto o coordenador decide o roteamento
+    log_task = None
+    if memory is not None and session_id:
+        log_task = asyncio.ensure_future(run_blocking(
+            memory.log_conversation,
+            session_id=session_id,
+            question=user_question,
+            answer=""  # A resposta será atualizada quando estiver pronta
+        ))
+
+    turn = {
+        "agent_to_call": None,
+        "question_for_agent": None,
+        "content": "",
+        "generated_code": "",
+        "conversation_id": None,
+        "query_mode": "python",
+        "sql": None,
+        "steps": [],
+        "errors": []
+    }
+
+    try:
+        # 1. CoordinatorAgent decide o que fazer
+        with start_span("routing", history_chars=len(conversation_history or "")) as span:
+            coordinator_decision = await arun_coordinator(
+                api_key=api_key,
+                df=df,
+                conversation_history=conversation_history,
+                user_question=user_question,
+                tables=tables
+            )
+            agent_to_call = coordinator_decision.get("agent_to_call")
+            question_for_agent = coordinator_decision.get("question_for_agent")
+            span.set_attribute("agent", str(agent_to_call))
+        plan = parse_plan(coordinator_decision)
+        if plan:
+            agent_to_call = PLAN_AGENT
+        turn["agent_to_call"] = agent_to_call
+        turn["question_for_agent"] = question_for_agent
+        record_route(agent_to_call)
+
+        # 2. Pedido composto: executa as etapas do plano, em paralelo quando independentes
+        if plan:
+            with start_span("plan", steps=len(plan)) as span:
+                await _arun_plan(turn, plan, api_key, df, df_info, all_analyses_history, user_question, tables)
+                span.set_attributes(response_chars=len(turn["content"]), code_length=len(turn["generated_code"]))
+            return turn
+
+        # 2. Roteia para o agente apropriado
+        with start_span("specialist", agent=str(agent_to_call)) as span:
+            await _arun_specialist(turn, api_key, df, df_info, all_analyses_history, user_question, tables)
+            span.set_attributes(response_chars=len(turn["content"]), code_length=len(turn["generated_code"]),
+                                query_mode=turn["query_mode"])
+
+    finally:
+        # Aguarda o registro da conversa mesmo se o agente falhar
+        if log_task is not None:
+            try:
+                turn["conversation_id"] = await log_task
+            except Exception as e:
+                turn["errors"].append(f"Erro ao registrar conversa: {e}")
+
+    return turn
+
+
+async def aprefetch_turn(api_key: str, df: pd.DataFrame, df_info: dict, conversation_history: str,
+                         all_analyses_history: str, user_question: str, tables: dict | None = None) -> dict:
+    """
+    Turno especulativo de uma sugestão de pergunta, calculado em segundo plano.
+
+    Todas as chamadas ao LLM entram na fila com a prioridade de pré-busca, a
+    pergunta não é registrada no banco e o gráfico gerado é executado para
+    aquecer o cache de gráficos.
+    """
+    set_priority_floor(PRIORITY_PREFETCH)
+    with start_span("prefetch_turn", question_length=len(user_question)) as span:
+        turn = await arun_turn(api_key, df, df_info, f"{conversation_history}Usuário: {user_question}\n",
+                               all_analyses_history, user_question, tables=tables)
+        if turn["agent_to_call"] in ("VisualizationAgent", PLAN_AGENT) and turn["generated_code"]:
+            chart = await arender_chart(api_key, df, turn["generated_code"], chart_question(turn), tables=tables)
+            # O código corrigido é o que o turno em primeiro plano vai executar (e encontrar no cache)
+            turn["generated_code"] = chart["code"]
+        span.set_attribute("agent", str(turn["agent_to_call"]))
+    return turn
+
+
+def chart_question(turn: dict) -> str:
+    """Pedido que gerou o código do gráfico do turno (a etapa de visualização, em um plano)."""
+    step = next((step for step in turn.get("steps") or [] if step["generated_code"]), None)
+    return step["question"] if step is not None else turn["question_for_agent"] or ""
+
+
+async def arender_chart(api_key: str, df: pd.DataFrame, code: str, user_request: str,
+                        tables: dict | None = None) -> dict:
+    """
+    Executa o código do gráfico e, se falhar, pede a correção ao agente de visualização.
+
+    O erro (da análise estática ou da execução) e o código voltam ao agente,
+    com o esquema do dataset, até `chart_repair_attempts` vezes ou até esgotar
+    `chart_repair_seconds`. Retorna {"figure", "code", "error", "repairs"}:
+    `code` é o último código executado e `error`, o último erro (None se a
+    figura foi gerada).
+    """
+    config = get_config()
+    result = {"figure": None, "code": code, "error": None, "repairs": 0}
+    failed_at = None
+    with start_span("render_chart_code") as span:
+        while True:
+            try:
+                result["figure"] = await run_blocking(exec_with_cache, result["code"], df, tables=tables)
+                result["error"] = None if result["figure"] is not None else \
+                    "O código foi executado, mas não definiu a variável `fig` com uma figura."
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"[:1000]
+            if result["error"] is None:
+                break
+            failed_at = failed_at or time.monotonic()
+            remaining = config["chart_repair_seconds"] - (time.monotonic() - failed_at)
+            if result["repairs"] >= config["chart_repair_attempts"] or remaining <= 0:
+                break
+            result["repairs"] += 1
+            try:
+                result["code"] = await asyncio.wait_for(
+                    arepair_visualization(api_key, df, user_request, result["code"], result["error"], tables=tables),
+                    timeout=remaining)
+            except Exception as e:
+                print(f"Erro ao corrigir o código do gráfico: {e}")
+                break
+        if failed_at is not None:
+            record_repair("repaired" if result["error"] is None else "failed", result["repairs"],
+                          time.monotonic() - failed_at)
+        span.set_attributes(repairs=result["repairs"], figure_created=result["figure"] is not None)
+    return result
+
+
+def _precomputed_summary(df: pd.DataFrame) -> str:
+    """Resumo do pré-cálculo do dataset para os agentes de análise, ou vazio se ainda não estiver pronto."""
+    if not get_config()["precompute_enabled"]:
+        return ""
+    return get_precomputer().summary(dataset_hash(df))
+
+
+async def _arun_specialist(turn: dict, api_key: str, df: pd.DataFrame, df_info: dict,
+                           all_analyses_history: str, user_question: str, tables: dict | None = None):
+    """Executa o agente especialista escolhido pelo coordenador, preenchendo `turn`."""
+    agent_to_call = turn["agent_to_call"]
+    question_for_agent = turn["question_for_agent"]
+    if agent_to_call == "DataAnalystAgent":
+        turn["content"] = await arun_data_analyst(
+            api_key=api_key,
+            df=df,
+            analysis_context=all_analyses_history,
+            specific_question=question_for_agent,
+            tables=tables,
+            precomputed=_precomputed_summary(df)
+        )
+
+    elif agent_to_call == "VisualizationAgent":
+        if _use_cube(turn, df, question_for_agent or user_question):
+            return
+        if _use_chart_template(turn, df, question_for_agent or user_question):
+            return
+        if _use_reused_code(turn, df, question_for_agent or user_question):
+            return
+        if await _arun_sql_mode(turn, api_key, df, all_analyses_history, question_for_agent, tables):
+            return
+        try:
+            turn["generated_code"] = await arun_visualization(
+                api_key=api_key,
+                df=df,
+                analysis_results=all_analyses_history,
+                user_request=question_for_agent,
+                tables=tables
+            )
+        except Exception as e:
+            turn["content"] = f"Erro no agente de visualização: {e}\n\nTente reformular sua pergunta ou verifique se sua chave da API do Google está configurada corretamente."
+
+    elif agent_to_call == "ConsultantAgent":
+        turn["content"] = await arun_consultant(
+            api_key=api_key,
+            df=df,
+            all_analyses=all_analyses_history,
+            user_question=question_for_agent,
+            tables=tables,
+            precomputed=_precomputed_summary(df)
+        )
+
+    elif agent_to_call == "CodeGeneratorAgent":
+        if await _arun_sql_mode(turn, api_key, df, all_analyses_history, question_for_agent or user_question, tables):
+            turn["content"] = "💡 Código Gerado: Este código será executado automaticamente na própria interface!"
+            return
+        analysis_context = f"Pergunta do usuário: {user_question}\n\nContexto da conversa:\n{all_analyses_history}"
+        dataset_info = str(df_info)
+        if needs_table_summary(tables):
+            primary = next((name for name, table in tables.items() if table is df), None)
+            dataset_info += "\n" + describe_tables(tables, primary=primary)
+        turn["generated_code"] = await arun_code_generator(
+            api_key=api_key,
+            dataset_info=dataset_info,
+            analysis_to_convert=analysis_context
+        )
+        # Não incluir o código na resposta - ele será exibido automaticamente na interface
+        turn["content"] = "💡 Código Gerado: Este código será executado automaticamente na própria interface!"
+
+    else:
+        turn["content"] = "Desculpe, não entendi qual agente usar. Poderia reformular sua pergunta?"
+
+
+
+def _use_cube(turn: dict, df: pd.DataFrame, question: str) -> bool:
+    """
+    Responde pedidos de quebra por categoria (barras e box plots) com o cubo de agregações, sem LLM.
+
+    Retorna False para seguir com os modelos e o agente. Só o texto é
+    verificado antes de consultar o cubo, que não é montado aqui: a montagem
+    fica com o pré-cálculo do upload.
+    """
+    if not get_config()["cube_enabled"] or df is None or out_of_core_info(df) is not None:
+        return False
+    if not is_cube_question(question, df):
+        return False
+    with start_span("cube_lookup") as span:
+        cube = get_cube(df, build=False)
+        match = match_cube_question(question, df, cube) if cube is not None else None
+        span.set_attributes(cube_available=cube is not None, chart=match["chart"] if match else None)
+    if match is None:
+        return False
+    turn["query_mode"] = "cube"
+    turn["generated_code"] = match["code"]
+    return True
+
+
+def _use_chart_template(turn: dict, df: pd.DataFrame, question: str) -> bool:
+    """
+    Monta o gráfico com um modelo local, sem LLM; retorna False para seguir com o agente.
+
+    Datasets fora da memória ficam com o modo SQL: o DataFrame é só uma amostra.
+    """
+    if not get_config()["chart_templates_enabled"] or df is None or out_of_core_info(df) is not None:
+        return False
+    with start_span("chart_template") as span:
+        match = match_template(question, df)
+        record_cache("chart_template", hit=match is not None)
+        span.set_attribute("template", match["template"] if match else None)
+    if match is None:
+        return False
+    turn["query_mode"] = "template"
+    turn["generated_code"] = match["code"]
+    return True
+
+
+def _use_reused_code(turn: dict, df: pd.DataFrame, question: str) -> bool:
+    """
+    Adapta um código de gráfico já gerado para uma pergunta parecida; retorna False para seguir com o agente.
+
+    Como nos modelos, datasets fora da memória ficam com o modo SQL.
+    """
+    if not get_config()["code_reuse_enabled"] or df is None or out_of_core_info(df) is not None:
+        return False
+    with start_span("code_reuse", entries=len(get_code_reuse_index())) as span:
+        match = get_code_reuse_index().match(question, df)
+        record_cache("code_reuse", hit=match is not None)
+        span.set_attribute("similarity", match["similarity"] if match else None)
+    if match is None:
+        return False
+    turn["query_mode"] = "reuse"
+    turn["generated_code"] = match["code"]
+    return True
+
+
+async def _arun_sql_mode(turn: dict, api_key: str, df: pd.DataFrame, all_analyses_history: str,
+                         question: str, tables: dict | None = None) -> bool:
+    """
+    Tenta responder com uma consulta SQL + gráfico (modo SQL); retorna False para seguir no modo Python.
+
+    O código gerado é montado a partir do plano validado. Se a resposta do
+    agente não for utilizável ou a chamada falhar, o turno continua com o
+    agente Python.
+    """
+    if not use_sql_mode(question, df, tables):
+        return False
+    with start_span("sql_plan") as span:
+        try:
+            plan = await arun_sql_generator(
+                api_key=api_key,
+                df=df,
+                analysis_results=all_analyses_history,
+                user_request=question,
+                tables=tables
+            )
+        except Exception as e:
+            # Resposta inutilizável, fila cheia, timeout ou erro do provedor: segue com o agente Python
+            # (CancelledError não é Exception e continua propagando)
+            print(f"Modo SQL indisponível para o pedido, usando código Python: {type(e).__name__}: {e}")
+            span.set_attributes(fallback=True, error=f"{type(e).__name__}: {e}"[:200])
+            return False
+        span.set_attributes(fallback=False, chart_type=plan["chart"]["type"])
+    turn["query_mode"] = "sql"
+    turn["sql"] = plan["sql"]
+    turn["generated_code"] = render_sql_code(plan)
+    return True
+
+
+def parse_plan(decision: dict) -> list | None:
+    """
+    Etapas do plano do coordenador em ordem topológica.
+
+    Retorna None quando não há plano (pergunta simples) ou ele é inválido:
+    agente desconhecido, mais de um VisualizationAgent, dependência inexistente
+    ou ciclo. Nesses casos o turno segue com o agente único de `agent_to_call`.
+    """
+    raw_steps = decision.get("plan") if isinstance(decision, dict) else None
+    if not isinstance(raw_steps, list) or not 2 <= len(raw_steps) <= MAX_PLAN_STEPS:
+        return None
+
+    steps = {}
+    for index, item in enumerate(raw_steps, start=1):
+        if not isinstance(item, dict):
+            return None
+        step_id = str(item.get("id") or f"s{index}")
+        depends_on = item.get("depends_on") or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        if item.get("agent") not in PLAN_AGENTS or not item.get("question") or step_id in steps:
+            return None
+        steps[step_id] = {
+            "id": step_id,
+            "agent": item["agent"],
+            "question": str(item["question"]),
+            "depends_on": [str(d) for d in depends_on],
+        }
+
+    if sum(step["agent"] == "VisualizationAgent" for step in steps.values()) > 1:
+        return None
+    if any(d not in steps or d == step["id"] for step in steps.values() for d in step["depends_on"]):
+        return None
+
+    ordered, done = [], set()
+    while len(ordered) < len(steps):
+        ready = [step for step in steps.values()
+                 if step["id"] not in done and all(d in done for d in step["depends_on"])]
+        if not ready:
+            return None  # ciclo
+        ordered.extend(ready)
+        done.update(step["id"] for step in ready)
+    return ordered
+
+
+def _step_context(result: dict) -> str:
+    """Resumo de uma etapa concluída, repassado às etapas que dependem dela."""
+    if result["agent"] == "VisualizationAgent":
+        context = f"Gráfico gerado na etapa de visualização: {result['question']}\n"
+        if result["sql"]:
+            context += f"Consulta do gráfico: {result['sql']}\n"
+        return context
+    return f"Resultado da etapa {result['id']} ({result['agent']}):\n{result['content']}\n"
+
+
+async def _arun_plan(turn: dict, plan: list, api_key: str, df: pd.DataFrame, df_info: dict,
+                     all_analyses_history: str, user_question: str, tables: dict | None = None):
+    """
+    Executa as etapas do plano e combina os resultados em `turn`.
+
+    Cada etapa começa assim que suas dependências terminam, então etapas
+    independentes rodam em paralelo e o turno leva o tempo do caminho mais
+    longo do plano. As etapas dependentes recebem os resultados das anteriores
+    junto com o histórico de análises.
+    """
+    results = {}
+    tasks = {}
+
+    async def run_step(step: dict):
+        if step["depends_on"]:
+            await asyncio.gather(*(tasks[d] for d in step["depends_on"]))
+        context = all_analyses_history + "".join(_step_context(results[d]) for d in step["depends_on"])
+        step_turn = {
+            "agent_to_call": step["agent"],
+            "question_for_agent": step["question"],
+            "content": "",
+            "generated_code": "",
+            "query_mode": "python",
+            "sql": None,
+        }
+        with start_span(f"step {step['agent']}", step=step["id"], depends_on=len(step["depends_on"])) as span:
+            try:
+                await _arun_specialist(step_turn, api_key, df, df_info, context, user_question, tables)
+            except Exception as e:
+                step_turn["content"] = f"Erro na etapa {step['id']} ({step['agent']}): {e}"
+                turn["errors"].append(step_turn["content"])
+            span.set_attributes(response_chars=len(step_turn["content"]), code_length=len(step_turn["generated_code"]))
+        results[step["id"]] = {**step, **{k: step_turn[k] for k in ("content", "generated_code", "query_mode", "sql")}}
+
+    # Ordem topológica: as tarefas das dependências já existem quando cada etapa é criada
+    for step in plan:
+        tasks[step["id"]] = asyncio.ensure_future(run_step(step))
+    await asyncio.gather(*tasks.values())
+
+    turn["steps"] = [results[step["id"]] for step in plan]
+    sections = []
+    for result in turn["steps"]:
+        if result["generated_code"]:
+            turn["generated_code"] = result["generated_code"]
+            turn["query_mode"] = result["query_mode"]
+            turn["sql"] = result["sql"]
+        if result["content"]:
+            sections.append(f"**{STEP_TITLES.get(result['agent'], result['agent'])}**\n\n{result['content']}")
+    turn["content"] = "\n\n---\n\n".join(sections)
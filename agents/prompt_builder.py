@@ -0,0 +1,190 @@
+# Arquivo: agents/prompt_builder.py
+
+"""
+Montagem de prompts a partir de seções.
+
+Cada agente descreve seu prompt como uma lista de seções (estáticas ou com
+variáveis) e uma lista de exemplos few-shot. O modo `full` reproduz o prompt
+completo; o modo `compact` usa as variantes curtas das seções e inclui apenas
+o exemplo mais parecido com a pergunta. As seções estáticas vêm sempre antes
+das variáveis, formando um prefixo idêntico entre chamadas que o provedor pode
+reaproveitar no cache implícito de contexto.
+"""
+import math
+import re
+import threading
+import unicodedata
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from utils.config import get_config
+from utils.telemetry import record_cache
+
+PROMPT_MODE_FULL = "full"
+PROMPT_MODE_COMPACT = "compact"
+
+# Aproximação usada para contar tokens sem depender do tokenizer do provedor
+CHARS_PER_TOKEN = 4
+
+_STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas",
+    "um", "uma", "para", "por", "com", "que", "se", "me", "meu", "minha", "qual", "quais", "the",
+    "entre", "sobre", "esta", "este", "essa", "esse", "ao", "aos", "mais", "sua", "seu",
+}
+
+_specs = {}
+_stats = {}
+_stats_lock = threading.Lock()
+_prompt_mode = None
+
+
+def count_tokens(text: str) -> int:
+    """Estimativa do número de tokens de um texto (≈ 4 caracteres por token)."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _tokenize(text: str) -> set:
+    """Palavras normalizadas (minúsculas, sem acento, sem stopwords) de um texto."""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    normalized = "".join(c for c in normalized if not unicodedata.combining(c))
+    return {w for w in re.findall(r"[a-z0-9_]+", normalized) if len(w) > 1 and w not in _STOPWORDS}
+
+
+def _unescape(template_text: str) -> str:
+    """Remove o escape de chaves do template para contar o texto que de fato é enviado."""
+    return template_text.replace("{{", "{").replace("}}", "}")
+
+
+def get_prompt_mode() -> str:
+    """Modo de prompt configurado (`compact` por padrão)."""
+    global _prompt_mode
+    if _prompt_mode is None:
+        mode = get_config().get("prompt_mode") or PROMPT_MODE_COMPACT
+        _prompt_mode = mode if mode in (PROMPT_MODE_FULL, PROMPT_MODE_COMPACT) else PROMPT_MODE_COMPACT
+    return _prompt_mode
+
+
+class PromptSection:
+    """
+    Trecho de prompt em formato de template (chaves literais escapadas como `{{ }}`).
+
+    `compact` é a variante curta: None reaproveita o texto completo e "" omite a
+    seção no modo compacto. Seções não estáticas contêm variáveis e vão para o
+    final do prompt.
+    """
+
+    def __init__(self, name: str, text: str, compact: str | None = None, static: bool = True):
+        self.name = name
+        self.text = text.strip("\n")
+        self.compact = compact.strip("\n") if compact else compact
+        self.static = static
+
+    def render(self, mode: str) -> str:
+        if mode == PROMPT_MODE_COMPACT and self.compact is not None:
+            return self.compact
+        return self.text
+
+
+class FewShotExample:
+    """Exemplo few-shot com a pergunta usada para medir similaridade."""
+
+    def __init__(self, question: str, text: str, keywords: tuple = ()):
+        self.question = question
+        self.text = text.strip("\n")
+        self.terms = _tokenize(question) | _tokenize(" ".join(keywords))
+
+
+class PromptSpec:
+    """Prompt de um agente, montado por seções e com seleção dinâmica de exemplos."""
+
+    def __init__(self, agent_name: str, sections: list, examples: list | None = None,
+                 examples_header: str = "# EXEMPLOS (Few-Shot Learning)", compact_examples: int = 1):
+        self.agent_name = agent_name
+        self.sections = sections
+        self.examples = examples or []
+        self.examples_header = examples_header
+        self.compact_examples = compact_examples
+        self._templates = {}
+        self._lock = threading.Lock()
+        _specs[agent_name] = self
+
+    def select_examples(self, question: str, k: int) -> tuple:
+        """Índices dos `k` exemplos mais parecidos com a pergunta (similaridade de Jaccard)."""
+        if k >= len(self.examples):
+            return tuple(range(len(self.examples)))
+        terms = _tokenize(question or "")
+
+        def _score(index):
+            example_terms = self.examples[index].terms
+            union = terms | example_terms
+            return len(terms & example_terms) / len(union) if union else 0.0
+
+        # Empates mantêm a ordem original (o primeiro exemplo é o mais genérico)
+        ranked = sorted(range(len(self.examples)), key=lambda i: (-_score(i), i))
+        return tuple(sorted(ranked[:k]))
+
+    def template_text(self, mode: str = PROMPT_MODE_FULL, example_indices: tuple | None = None) -> str:
+        """Texto do template: seções estáticas, exemplos e, por fim, as seções com variáveis."""
+        if example_indices is None:
+            example_indices = tuple(range(len(self.examples)))
+        parts = [s.render(mode) for s in self.sections if s.static]
+        if self.examples and example_indices:
+            parts.append(self.examples_header + "\n\n" + "\n\n".join(self.examples[i].text for i in example_indices))
+        parts.extend(s.render(mode) for s in self.sections if not s.static)
+        return "\n" + "\n\n".join(p for p in parts if p) + "\n"
+
+    def get_prompt(self, question: str = "", mode: str | None = None) -> ChatPromptTemplate:
+        """Retorna o ChatPromptTemplate (em cache) para a pergunta e registra a economia de tokens."""
+        mode = mode or get_prompt_mode()
+        if mode == PROMPT_MODE_COMPACT:
+            example_indices = self.select_examples(question, self.compact_examples)
+        else:
+            example_indices = tuple(range(len(self.examples)))
+
+        key = (mode, example_indices)
+        with self._lock:
+            record_cache("prompt_template", hit=key in self._templates)
+            if key not in self._templates:
+                text = self.template_text(mode, example_indices)
+                self._templates[key] = (ChatPromptTemplate.from_template(text), count_tokens(_unescape(text)))
+            prompt, tokens_sent = self._templates[key]
+
+        tokens_full = self.template_tokens(PROMPT_MODE_FULL)
+        with _stats_lock:
+            stats = _stats.setdefault(self.agent_name, {"calls": 0, "template_tokens_sent": 0, "template_tokens_saved": 0})
+            stats["calls"] += 1
+            stats["template_tokens_sent"] += tokens_sent
+            stats["template_tokens_saved"] += max(0, tokens_full - tokens_sent)
+        return prompt
+
+    def template_tokens(self, mode: str = PROMPT_MODE_FULL) -> int:
+        """Tokens do template completo (todos os exemplos) no modo indicado."""
+        example_indices = None if mode == PROMPT_MODE_FULL else tuple(range(min(self.compact_examples, len(self.examples))))
+        return count_tokens(_unescape(self.template_text(mode, example_indices)))
+
+    def section_tokens(self, mode: str = PROMPT_MODE_FULL) -> dict:
+        """Tokens por seção (variáveis não incluídas) e por exemplo few-shot."""
+        report = {s.name: count_tokens(_unescape(s.render(mode))) for s in self.sections}
+        for i, example in enumerate(self.examples, start=1):
+            report[f"exemplo_{i}"] = count_tokens(_unescape(example.text))
+        return report
+
+
+def prompt_report() -> dict:
+    """Relatório por agente: tokens por seção, tamanho full vs compact e economia acumulada."""
+    report = {}
+    for name, spec in _specs.items():
+        with _stats_lock:
+            stats = dict(_stats.get(name, {"calls": 0, "template_tokens_sent": 0, "template_tokens_saved": 0}))
+        report[name] = {
+            "full_tokens": spec.template_tokens(PROMPT_MODE_FULL),
+            "compact_tokens": spec.template_tokens(PROMPT_MODE_COMPACT),
+            "static_prefix_tokens": count_tokens(_unescape("\n\n".join(
+                s.render(get_prompt_mode()) for s in spec.sections if s.static
+            ))),
+            "sections": spec.section_tokens(get_prompt_mode()),
+            **stats,
+        }
+    return report
@@ -0,0 +1,239 @@
+# Arquivo: agents/sql_generator.py
+
+"""
+Modo SQL dos agentes de visualização e de código.
+
+Em vez de código pandas/Plotly arbitrário, o agente devolve um JSON com uma
+consulta SQL e a especificação do gráfico. A consulta é validada (um único
+SELECT, tabelas e colunas existentes) e executada pelo DuckDB sobre as
+tabelas da sessão, que varre os dados em paralelo e devolve ao pandas apenas o
+resultado agregado. O código Python exibido e executado é montado pela
+aplicação a partir do plano, nunca escrito pelo LLM.
+"""
+import re
+
+import pandas as pd
+from langchain_core.output_parsers import StrOutputParser
+
+from agents.agent_setup import get_llm, ainvoke_chain
+from agents.prompt_builder import PromptSpec, PromptSection, FewShotExample, PROMPT_MODE_FULL
+from utils.async_runtime import run_sync
+from utils.config import get_config
+from utils.json_output import parse_json_object
+from utils.query_engine import (QueryEngine, describe_tables, is_available, out_of_core_info, sql_tables,
+                                validate_select)
+
+# Tipos de gráfico aceitos e a função do plotly.express usada para cada um
+CHART_TYPES = {
+    "bar": "bar",
+    "line": "line",
+    "scatter": "scatter",
+    "area": "area",
+    "pie": "pie",
+    "histogram": "histogram",
+    "box": "box",
+}
+
+# Perguntas de agregação, que no modo "auto" vão para o SQL mesmo em datasets pequenos
+_AGGREGATION_PATTERN = re.compile(
+    r"\b(total|totais|soma|somat[óo]rio|contagem|quantos|quantas|quantidade|agrup\w*|ranking|top|"
+    r"m[ée]dias?\s+(de\s+\w+\s+)?por|maiores|menores|por\s+(m[êe]s|ano|dia|semana|trimestre))\b",
+    re.IGNORECASE,
+)
+
+# Esquema da resposta, usado no modo JSON do provedor
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sql": {"type": "string"},
+        "chart": {
+            "type": "object",
+            "properties": {
+                "type": {"type": "string", "enum": list(CHART_TYPES)},
+                "x": {"type": "string"},
+                # Opcionais: o prompt pede `null` quando não se aplicam (anyOf com null, como no JSON Schema)
+                "y": {"anyOf": [{"type": "string"}, {"type": "null"}]},
+                "color": {"anyOf": [{"type": "string"}, {"type": "null"}]},
+                "title": {"type": "string"},
+            },
+            "required": ["type", "x"],
+        },
+    },
+    "required": ["sql", "chart"],
+}
+
+PROMPT_SPEC = PromptSpec(
+    "SQLGeneratorAgent",
+    sections=[
+        PromptSection("role", """
+# IDENTIDADE
+Você é o **SQLGeneratorAgent**: responde pedidos de gráficos e análises com UMA consulta SQL (dialeto DuckDB) e a especificação do gráfico do resultado.
+"""),
+        PromptSection("restrictions", """
+# RESTRIÇÕES CRÍTICAS
+1. **Apenas SELECT**: uma única consulta (WITH é permitido), sem ponto e vírgula, sem ler arquivos
+2. **Agregue no SQL**: GROUP BY, COUNT, SUM, AVG, date_trunc, histogram com FLOOR — o resultado deve ser pequeno (no máximo alguns milhares de linhas; use LIMIT)
+3. **Nomes exatos**: use apenas as tabelas e colunas listadas; colunas com espaços ou acentos entre aspas duplas
+4. **Aliases claros**: dê nomes às colunas calculadas (ex.: `COUNT(*) AS total`) e use esses nomes no gráfico
+5. **Tipos de gráfico**: bar, line, scatter, area, pie, histogram, box
+6. **Apenas JSON**: responda SOMENTE com o JSON, sem explicações ou markdown
+"""),
+        PromptSection("format", """
+# FORMATO DA RESPOSTA
+{{"sql": "SELECT ...", "chart": {{"type": "bar", "x": "coluna_do_resultado", "y": "coluna_do_resultado", "color": null, "title": "Título descritivo"}}}}
+"""),
+        PromptSection("dataset", """
+# TABELAS (a tabela principal também pode ser consultada como `df`)
+{tables_summary}
+""", static=False),
+        PromptSection("history", """
+# RESULTADOS DE ANÁLISES PRÉVIAS
+{analysis_results}
+""", static=False),
+        PromptSection("question", """
+# SOLICITAÇÃO DO USUÁRIO
+"{user_request}"
+""", static=False),
+        PromptSection("answer", """
+# SEU JSON
+""", static=False),
+    ],
+    examples=[
+        FewShotExample(
+            "Qual o faturamento total por região?",
+            """
+Solicitação: "Qual o faturamento total por região?"
+{{"sql": "SELECT regiao, SUM(valor) AS faturamento FROM vendas GROUP BY regiao ORDER BY faturamento DESC", "chart": {{"type": "bar", "x": "regiao", "y": "faturamento", "color": null, "title": "Faturamento Total por Região"}}}}
+""",
+            keywords=("total", "soma", "por", "categoria", "ranking", "barras", "comparação"),
+        ),
+        FewShotExample(
+            "Mostre a evolução mensal de pedidos",
+            """
+Solicitação: "Mostre a evolução mensal de pedidos"
+{{"sql": "SELECT date_trunc('month', CAST(data_pedido AS TIMESTAMP)) AS mes, COUNT(*) AS pedidos FROM df GROUP BY mes ORDER BY mes", "chart": {{"type": "line", "x": "mes", "y": "pedidos", "color": null, "title": "Pedidos por Mês"}}}}
+""",
+            keywords=("evolução", "mensal", "tempo", "tendência", "linha", "série", "data"),
+        ),
+        FewShotExample(
+            "Mostre a distribuição da idade",
+            """
+Solicitação: "Mostre a distribuição da idade"
+{{"sql": "SELECT FLOOR(idade / 5) * 5 AS faixa_idade, COUNT(*) AS clientes FROM df WHERE idade IS NOT NULL GROUP BY faixa_idade ORDER BY faixa_idade", "chart": {{"type": "bar", "x": "faixa_idade", "y": "clientes", "color": null, "title": "Distribuição de Idade (faixas de 5 anos)"}}}}
+""",
+            keywords=("distribuição", "histograma", "frequência", "faixas"),
+        ),
+    ],
+    examples_header="# EXEMPLOS (Few-Shot Learning)",
+)
+
+# Prompt completo (modo "full"), mantido para referência e compatibilidade
+PROMPT_TEMPLATE = PROMPT_SPEC.template_text(PROMPT_MODE_FULL)
+
+
+def use_sql_mode(question: str, df: pd.DataFrame, tables: dict | None = None) -> bool:
+    """
+    Decide se o pedido usa o modo SQL.
+
+    `query_mode` = "python" ou "sql" força o modo; em "auto", usa SQL para
+    datasets fora da memória ou grandes e para perguntas de agregação.
+    """
+    mode = get_config().get("query_mode", "auto")
+    if mode == "python" or not is_available() or df is None:
+        return False
+    if mode == "sql":
+        return True
+    frames = list((tables or {}).values()) or [df]
+    if any(out_of_core_info(frame) is not None for frame in frames):
+        return True
+    if max(frame.shape[0] for frame in frames) >= get_config()["sql_mode_min_rows"]:
+        return True
+    return bool(_AGGREGATION_PATTERN.search(question or ""))
+
+
+def parse_sql_plan(raw_output: str, tables: dict) -> dict:
+    """
+    Valida a resposta do agente e retorna o plano {"sql", "chart", "columns"}.
+
+    A consulta é analisada pelo DuckDB sem ser executada: JSON ilegível mesmo
+    após o reparo local, tabelas ou colunas inexistentes e colunas do gráfico
+    fora do resultado geram ValueError.
+    """
+    plan = parse_json_object(raw_output, "SQLGeneratorAgent")
+    query = validate_select(plan.get("sql"))
+    chart = plan.get("chart") or {}
+    chart_type = str(chart.get("type", "bar")).lower()
+    if chart_type not in CHART_TYPES:
+        raise ValueError(f"Tipo de gráfico não suportado: {chart_type}")
+
+    engine = QueryEngine(tables)
+    try:
+        columns = engine.result_columns(query)
+    except Exception as e:
+        raise ValueError(f"Consulta inválida para as tabelas da sessão: {e}") from e
+    finally:
+        engine.close()
+
+    chart = {
+        "type": chart_type,
+        "x": chart.get("x") or columns[0],
+        # Sem `nullable`, alguns provedores devolvem "" no lugar de null
+        "y": chart.get("y") or None,
+        "color": chart.get("color") or None,
+        "title": str(chart.get("title") or ""),
+    }
+    missing = [chart[k] for k in ("x", "y", "color") if chart[k] is not None and chart[k] not in columns]
+    if missing:
+        raise ValueError(f"Colunas do gráfico ausentes no resultado da consulta: {missing}")
+    return {"sql": query, "chart": chart, "columns": columns}
+
+
+def render_sql_code(plan: dict) -> str:
+    """Código Python equivalente ao plano (consulta + gráfico), com os valores escapados."""
+    query = plan["sql"]
+    chart = plan["chart"]
+    if '"""' in query or "\\" in query or query.endswith('"'):
+        query_literal = repr(query)
+    else:
+        query_literal = f'"""\n{query}\n"""'
+
+    if chart["type"] == "pie":
+        args = {"names": chart["x"], "values": chart["y"], "title": chart["title"]}
+    else:
+        args = {"x": chart["x"], "y": chart["y"], "color": chart["color"], "title": chart["title"]}
+    if not chart["color"]:
+        args["color_discrete_sequence"] = ["#6C5CE7"]
+    arguments = "".join(f", {name}={value!r}" for name, value in args.items() if value is not None)
+
+    return (
+        "import plotly.express as px\n"
+        "\n"
+        "# Consulta executada pelo DuckDB: apenas o resultado agregado é carregado no pandas\n"
+        f"result = sql({query_literal})\n"
+        f"fig = px.{CHART_TYPES[chart['type']]}(result{arguments})\n"
+        "fig.update_layout(template='plotly_white')"
+    )
+
+
+def get_sql_generator_agent(api_key: str, question: str = ""):
+    llm = get_llm(api_key, response_schema=RESPONSE_SCHEMA)
+    # Prompt compacto com os exemplos few-shot mais parecidos com a pergunta
+    prompt = PROMPT_SPEC.get_prompt(question)
+    chain = prompt | llm | StrOutputParser()
+    return chain
+
+async def arun_sql_generator(api_key: str, df: pd.DataFrame, analysis_results: str, user_request: str,
+                             tables: dict | None = None) -> dict:
+    """Gera e valida o plano SQL do pedido; levanta ValueError se a resposta não puder ser usada."""
+    agent = get_sql_generator_agent(api_key, user_request)
+    primary = next((name for name, table in (tables or {}).items() if table is df), None)
+    raw_output = await ainvoke_chain(agent, {
+        "tables_summary": describe_tables(tables or {"df": df}, primary=primary),
+        "analysis_results": analysis_results,
+        "user_request": user_request
+    }, agent="SQLGeneratorAgent")
+    return parse_sql_plan(raw_output, sql_tables(df, tables))
+
+def run_sql_generator(api_key: str, df: pd.DataFrame, analysis_results: str, user_request: str,
+                      tables: dict | None = None) -> dict:
+    return run_sync(arun_sql_generator(api_key, df, analysis_results, user_request, tables=tables))
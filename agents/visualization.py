@@ -1,24 +1,23 @@
 # Arquivo: agents/visualization.py
 
 import pandas as pd
-from agents.agent_setup import get_llm, get_dataset_preview
-from langchain_core.prompts import ChatPromptTemplate
+from agents.agent_setup import get_llm, get_dataset_preview, ainvoke_chain
+from utils.async_runtime import run_sync
+from agents.prompt_builder import PromptSpec, PromptSection, FewShotExample, PROMPT_MODE_FULL
 from langchain_core.output_parsers import StrOutputParser
 
-PROMPT_TEMPLATE = """
+PROMPT_SPEC = PromptSpec(
+    "VisualizationAgent",
+    sections=[
+        PromptSection("role", """
 # IDENTIDADE & EXPERTISE
 Você é o **VisualizationAgent**, um especialista em data visualization com mestrado em Design de Informação.
 Especializações: Plotly, storytelling visual, princípios de percepção visual, dashboards interativos.
-
-# CONTEXTO DO DATASET
-{dataset_preview}
-
-# RESULTADOS DE ANÁLISES PRÉVIAS
-{analysis_results}
-
-# SOLICITAÇÃO DO USUÁRIO
-"{user_request}"
-
+""", compact="""
+# IDENTIDADE
+Você é o **VisualizationAgent**, especialista em visualização de dados com Plotly.
+"""),
+        PromptSection("process", """
 # PROCESSO DE CRIAÇÃO (Chain-of-Thought)
 Siga este raciocínio estruturado:
 
@@ -42,9 +41,50 @@ Siga este raciocínio estruturado:
 - Código limpo e bem comentado
 - Uso eficiente da API do Plotly
 - Customizações que melhoram a legibilidade
-
-# EXEMPLOS DE CÓDIGO (Few-Shot Learning)
-
+""", compact="""
+# PROCESSO
+Escolha o tipo de gráfico adequado aos dados (numérico, categórico, temporal) e à relação pedida (uni, bi ou multivariada), com título descritivo, eixos rotulados e cores acessíveis.
+"""),
+        PromptSection("restrictions", """
+# RESTRIÇÕES CRÍTICAS
+1. **DataFrame Pré-carregado**: NUNCA inclua `df = pd.read_csv(...)` - o DataFrame `df` já existe
+2. **Variável fig**: SEMPRE atribua o gráfico à variável `fig`
+3. **Sem fig.show()**: NUNCA inclua `fig.show()` - a aplicação exibe automaticamente
+4. **Imports no topo**: Sempre inclua imports necessários (`import plotly.express as px`, etc.)
+5. **Apenas código**: Retorne SOMENTE o bloco de código Python, sem explicações ou markdown
+6. **Comentários concisos**: Use comentários para clarificar lógica, mas seja breve
+7. **Tratamento de erros**: Verifique existência de colunas antes de usar
+"""),
+        PromptSection("principles", """
+# PRINCÍPIOS DE DESIGN
+- **Clareza**: Títulos e labels devem ser autoexplicativos
+- **Consistência**: Use paleta de cores coerente (#6C5CE7 como cor primária)
+- **Acessibilidade**: Evite combinações de cores problemáticas para daltonismo
+- **Minimalismo**: Remova elementos desnecessários (chartjunk)
+""", compact="""
+# PRINCÍPIOS DE DESIGN
+Clareza, paleta coerente (#6C5CE7 como cor primária), cores acessíveis e sem elementos desnecessários.
+"""),
+        PromptSection("dataset", """
+# CONTEXTO DO DATASET
+{dataset_preview}
+""", static=False),
+        PromptSection("history", """
+# RESULTADOS DE ANÁLISES PRÉVIAS
+{analysis_results}
+""", static=False),
+        PromptSection("question", """
+# SOLICITAÇÃO DO USUÁRIO
+"{user_request}"
+""", static=False),
+        PromptSection("answer", """
+# SEU CÓDIGO PYTHON
+""", static=False),
+    ],
+    examples=[
+        FewShotExample(
+            "Mostre a distribuição da idade",
+            """
 **Exemplo 1 - Histograma:**
 Solicitação: "Mostre a distribuição da idade"
 
@@ -69,7 +109,12 @@ fig.update_layout(
     hovermode='x unified'
 )
 ```
-
+""",
+            keywords=("histograma", "distribuição", "frequência", "barras"),
+        ),
+        FewShotExample(
+            "Mostre a relação entre experiência e salário",
+            """
 **Exemplo 2 - Scatter Plot com Correlação:**
 Solicitação: "Mostre a relação entre experiência e salário"
 
@@ -97,7 +142,12 @@ fig.update_layout(
 
 fig.update_traces(marker={{"size": 8}})
 ```
-
+""",
+            keywords=("scatter", "dispersão", "relação", "tendência", "versus", "vs"),
+        ),
+        FewShotExample(
+            "Crie um heatmap de correlação",
+            """
 **Exemplo 3 - Heatmap de Correlação:**
 Solicitação: "Crie um heatmap de correlação"
 
@@ -126,7 +176,12 @@ fig.update_layout(
     yaxis_title='Variáveis'
 )
 ```
-
+""",
+            keywords=("heatmap", "correlação", "matriz", "mapa", "calor"),
+        ),
+        FewShotExample(
+            "Compare salários por departamento",
+            """
 **Exemplo 4 - Box Plot Comparativo:**
 Solicitação: "Compare salários por departamento"
 
@@ -150,43 +205,86 @@ fig.update_layout(
     showlegend=False
 )
 ```
+""",
+            keywords=("box", "boxplot", "compare", "comparação", "categoria", "por"),
+        ),
+    ],
+    examples_header="# EXEMPLOS DE CÓDIGO (Few-Shot Learning)",
+)
 
-# RESTRIÇÕES CRÍTICAS
-1. **DataFrame Pré-carregado**: NUNCA inclua `df = pd.read_csv(...)` - o DataFrame `df` já existe
-2. **Variável fig**: SEMPRE atribua o gráfico à variável `fig`
-3. **Sem fig.show()**: NUNCA inclua `fig.show()` - a aplicação exibe automaticamente
-4. **Imports no topo**: Sempre inclua imports necessários (`import plotly.express as px`, etc.)
-5. **Apenas código**: Retorne SOMENTE o bloco de código Python, sem explicações ou markdown
-6. **Comentários concisos**: Use comentários para clarificar lógica, mas seja breve
-7. **Tratamento de erros**: Verifique existência de colunas antes de usar
+# Prompt completo (modo "full"), mantido para referência e compatibilidade
+PROMPT_TEMPLATE = PROMPT_SPEC.template_text(PROMPT_MODE_FULL)
+
+
+# Correção do código que falhou: o erro e o código voltam ao agente, com o esquema do dataset
+REPAIR_PROMPT_SPEC = PromptSpec(
+    "VisualizationRepair",
+    sections=[
+        PromptSection("role", """
+# IDENTIDADE
+Você é o **VisualizationAgent**. O código que você gerou para o pedido abaixo falhou ao ser executado: corrija-o.
+Use apenas as colunas listadas no dataset e mantenha a visualização pedida.
+"""),
+        next(section for section in PROMPT_SPEC.sections if section.name == "restrictions"),
+        PromptSection("dataset", """
+# CONTEXTO DO DATASET
+{dataset_preview}
+""", static=False),
+        PromptSection("question", """
+# SOLICITAÇÃO DO USUÁRIO
+"{user_request}"
+""", static=False),
+        PromptSection("failure", """
+# CÓDIGO QUE FALHOU
+```python
+{failed_code}
+```
 
-# PRINCÍPIOS DE DESIGN
-- **Clareza**: Títulos e labels devem ser autoexplicativos
-- **Consistência**: Use paleta de cores coerente (#6C5CE7 como cor primária)
-- **Acessibilidade**: Evite combinações de cores problemáticas para daltonismo
-- **Minimalismo**: Remova elementos desnecessários (chartjunk)
+# ERRO
+{error}
+""", static=False),
+        PromptSection("answer", """
+# SEU CÓDIGO PYTHON CORRIGIDO
+""", static=False),
+    ],
+)
 
-# SEU CÓDIGO PYTHON
-"""
 
-def get_visualization_agent(api_key: str):
+def _extract_code(raw_code: str) -> str:
+    if "```python" in raw_code:
+        return raw_code.split("```python")[1].split("```")[0].strip()
+    return raw_code.strip()
+
+
+def get_visualization_agent(api_key: str, question: str = ""):
     llm = get_llm(api_key)
-    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+    # Prompt compacto com os exemplos few-shot mais parecidos com a pergunta
+    prompt = PROMPT_SPEC.get_prompt(question)
     chain = prompt | llm | StrOutputParser()
     return chain
 
-def run_visualization(api_key: str, df: pd.DataFrame, analysis_results: str, user_request: str):
-    agent = get_visualization_agent(api_key)
-    dataset_preview = get_dataset_preview(df)
-    raw_code = agent.invoke({
+async def arun_visualization(api_key: str, df: pd.DataFrame, analysis_results: str, user_request: str, tables: dict | None = None):
+    agent = get_visualization_agent(api_key, user_request)
+    dataset_preview = get_dataset_preview(df, tables)
+    raw_code = await ainvoke_chain(agent, {
         "dataset_preview": dataset_preview,
         "analysis_results": analysis_results,
         "user_request": user_request
-    })
-
-    if "```python" in raw_code:
-        clean_code = raw_code.split("```python")[1].split("```")[0].strip()
-    else:
-        clean_code = raw_code.strip()
-        
-    return clean_code
\ No newline at end of file
+    }, agent="VisualizationAgent")
+    return _extract_code(raw_code)
+
+
+async def arepair_visualization(api_key: str, df: pd.DataFrame, user_request: str, failed_code: str, error: str,
+                                tables: dict | None = None) -> str:
+    """Pede ao agente a correção de `failed_code` a partir do erro da execução."""
+    chain = REPAIR_PROMPT_SPEC.get_prompt(user_request) | get_llm(api_key) | StrOutputParser()
+    raw_code = await ainvoke_chain(chain, {
+        "dataset_preview": get_dataset_preview(df, tables),
+        "user_request": user_request,
+        "failed_code": failed_code,
+        "error": error,
+    }, agent="VisualizationRepair")
+    return _extract_code(raw_code)
+
+def run_visualization(api_key: str, df: pd.DataFrame, analysis_results: str, user_request: str, tables: dict | None = None):
+    return run_sync(arun_visualization(api_key, df, analysis_results, user_request, tables=tables))
@@ -8,20 +8,33 @@ from uuid import uuid4
 import time
 
 # Importações dos módulos do projeto
-from utils.config import get_config
-from utils.memory import SupabaseMemory
-from utils.data_loader import load_csv, get_dataset_info
-from utils.chart_cache import exec_with_cache  # Import do cache de gráficos
-from components.ui_components import build_sidebar, build_horizontal_menu, display_chat_message, display_code_with_streamlit_suggestion
+from utils.services import get_services
+from utils.data_loader import load_dataframe, compute_file_hash
+from utils.code_analysis import analyze_code
+from utils.code_reuse import get_code_reuse_index
+from components.ui_components import (build_sidebar, build_horizontal_menu, display_chat_history,
+                                      display_chat_message, display_code_with_streamlit_suggestion,
+                                      rerun_fragment)
 from components.notebook_generator import create_jupyter_notebook
-from components.suggestion_generator import generate_dynamic_suggestions, get_fallback_suggestions, extract_conversation_context
+from components.suggestion_generator import (generate_dynamic_suggestions, agenerate_dynamic_suggestions,
+                                              get_fallback_suggestions, extract_conversation_context)
 # Importação dos agentes
-from agents.coordinator import run_coordinator
-from agents.data_analyst import run_data_analyst
-from agents.visualization import run_visualization
-from agents.consultant import run_consultant
-from agents.code_generator import run_code_generator
+from agents.orchestrator import arun_turn, aprefetch_turn, arender_chart, chart_question, PLAN_AGENT
 from agents.agent_setup import get_dataset_preview
+from agents.prompt_builder import prompt_report
+from utils.async_runtime import run_sync
+from utils.llm_scheduler import get_scheduler
+from utils.telemetry import (set_current_session, session_snapshot, process_snapshot, to_prometheus,
+                             measure_render, record_render)
+from utils.tracing import start_span, recent_turns, export_metrics
+from utils.session_resources import get_session_resources, memory_status
+from utils.query_engine import make_sql_function, out_of_core_info, sql_tables
+from utils.prefetch import context_key, get_prefetcher
+from utils.precompute import dataset_steps, get_precomputer
+from utils.aggregate_cube import get_cube_registry, make_cube_function
+
+# Tempo de servidor da execução completa do script (as interações do chat reexecutam apenas o fragmento)
+script_started_at = time.perf_counter()
 
 # --- Configuração da Página e Estado da Sessão ---
 st.set_page_config(layout="wide", page_title="InsightAgent EDA")
@@ -475,10 +488,6 @@ if 'session_id' not in st.session_state:
     st.session_state.session_id = None
 if 'user_id' not in st.session_state:
     st.session_state.user_id = str(uuid4())
-if 'df' not in st.session_state:
-    st.session_state.df = None
-if 'df_info' not in st.session_state:
-    st.session_state.df_info = None
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 if 'conversation_history' not in st.session_state:
@@ -486,8 +495,16 @@ if 'conversation_history' not in st.session_state:
 if 'all_analyses_history' not in st.session_state:
     st.session_state.all_analyses_history = ""
 
+# Associa as chamadas aos agentes desta execução à sessão atual (métricas por sessão)
+set_current_session(st.session_state.user_id)
+
+# DataFrame, metadados e gráficos da sessão (descarregados para o disco quando a sessão fica ociosa)
+resources = get_session_resources(st.session_state)
+
 # --- Carregamento de Configurações e Serviços ---
-config = get_config()
+# Configuração e clientes são criados uma vez por processo e compartilhados entre sessões e reruns
+services = get_services()
+config = services.config
 
 # Verificar se a chave da API está configurada
 if not config["google_api_key"]:
@@ -498,24 +515,91 @@ if not config["google_api_key"]:
 if not config["supabase_url"] or not config["supabase_key"]:
     st.warning("⚠️ Configurações do Supabase não encontradas. Algumas funcionalidades podem não funcionar. Configure SUPABASE_URL e SUPABASE_KEY no arquivo .env")
 
-memory = SupabaseMemory(url=config["supabase_url"], key=config["supabase_key"])
+memory = services.memory
+if config["code_reuse_enabled"]:
+    # Códigos de gráficos salvos (de todas as sessões) alimentam o reaproveitamento; carregados uma vez por processo
+    get_code_reuse_index().ensure_loaded(memory)
 
 # --- Interface do Usuário (Sidebar) ---
-uploaded_file = build_sidebar(memory, st.session_state.user_id)
+uploaded_files = build_sidebar(memory, st.session_state.user_id)
+upload_ids = [getattr(f, "file_id", f.name) for f in uploaded_files]
+
+if DEBUG_MODE:
+    with st.sidebar.expander("📈 Tokens e latência dos agentes"):
+        st.markdown("**Sessão atual**")
+        st.json(session_snapshot(st.session_state.user_id), expanded=False)
+        st.markdown("**Processo**")
+        st.json(process_snapshot(), expanded=False)
+        st.download_button("Exportar métricas (Prometheus)", to_prometheus(),
+                           file_name="insightagent_metrics.prom", mime="text/plain")
+    with st.sidebar.expander("⏱️ Tempo por etapa (último turno)"):
+        # Turnos de pré-busca em segundo plano também geram traces; aqui interessa o último turno do usuário
+        turns = [t for t in recent_turns(st.session_state.user_id) if t["name"] == "chat_turn"]
+        if turns:
+            st.caption(f"Turno {turns[0]['trace_id'][:8]} — {turns[0]['duration_ms']:.0f} ms no total")
+            st.dataframe(pd.DataFrame(turns[0]["stages"]), hide_index=True, use_container_width=True)
+        else:
+            st.caption("Nenhum turno registrado nesta sessão.")
+        exports = export_metrics()
+        if exports["pending"] or exports["dropped"]:
+            st.caption(f"Envio de traces: {exports['pending']} na fila, {exports['dropped']} descartado(s)")
+    with st.sidebar.expander("🩺 Saúde dos serviços"):
+        st.json(services.health(), expanded=False)
+    with st.sidebar.expander("🚦 Fila de requisições ao LLM"):
+        st.json(get_scheduler().metrics())
+        if config["prefetch_enabled"]:
+            st.markdown("**Pré-busca das sugestões**")
+            st.json(get_prefetcher().metrics(), expanded=False)
+        if config["precompute_enabled"]:
+            st.markdown("**Pré-cálculo dos datasets**")
+            st.json(get_precomputer().metrics(), expanded=False)
+    with st.sidebar.expander("📝 Tokens de prompt por agente"):
+        st.json(prompt_report())
+    with st.sidebar.expander("🧠 Memória das sessões"):
+        status = memory_status()
+        st.caption(f"{status['sessions']} sessões — {status['memory_mb']} MB em memória "
+                   f"(orçamento {status['budget_mb']} MB)")
+        if status["largest"]:
+            st.dataframe(pd.DataFrame(status["largest"]), hide_index=True, use_container_width=True)
+        if status["datasets"]:
+            st.markdown("**Datasets compartilhados**")
+            st.dataframe(pd.DataFrame(status["datasets"]), hide_index=True, use_container_width=True)
+        if config["cube_enabled"]:
+            st.markdown("**Cubos de agregações**")
+            st.json(get_cube_registry().metrics(), expanded=False)
 
 # --- Lógica Principal de Processamento do CSV ---
-if uploaded_file is not None:
-    st.success("✅ Arquivo CSV carregado com sucesso!")
-    if st.session_state.df is None:
+if uploaded_files:
+    st.success(f"✅ {len(uploaded_files)} arquivo(s) CSV carregado(s) com sucesso!")
+    if not resources.has_dataset or st.session_state.get("uploaded_file_ids") != upload_ids:
+            dataset_name = ", ".join(f.name for f in uploaded_files)
             try:
-                df, file_hash = load_csv(uploaded_file)
-                st.session_state.df = df
-                st.session_state.df_info = get_dataset_info(df, uploaded_file.name)
+                # Sessões com o mesmo arquivo compartilham o DataFrame (o parse só ocorre na primeira);
+                # arquivos grandes viram Parquet no disco e só uma amostra fica em memória
+                file_hashes = [compute_file_hash(f) for f in uploaded_files]
+                resources.load_datasets([
+                    (file_hash, lambda f=f, file_hash=file_hash: load_dataframe(f, file_hash), f.name)
+                    for file_hash, f in zip(file_hashes, uploaded_files)
+                ])
+                st.session_state.uploaded_file_ids = upload_ids
+
+                # Pré-cálculo em segundo plano (perfil, correlações, outliers, visão geral e sugestões iniciais):
+                # os resultados são publicados à medida que ficam prontos, sem bloquear o carregamento
+                if config["precompute_enabled"]:
+                    precompute_df, precompute_tables = resources.df, resources.tables
+                    precompute_steps = dataset_steps(precompute_df, precompute_tables)
+                    precompute_steps["suggestions"] = lambda: agenerate_dynamic_suggestions(
+                        api_key=config["google_api_key"],
+                        dataset_preview=get_dataset_preview(precompute_df),
+                        conversation_history=""
+                    )
+                    get_precomputer().start(st.session_state.user_id, "|".join(file_hashes), precompute_steps,
+                                            owner=resources)
 
                 # Cria uma nova sessão no Supabase
                 session_id = memory.create_session(
-                    dataset_name=uploaded_file.name,
-                    dataset_hash=file_hash,
+                    dataset_name=dataset_name,
+                    dataset_hash=file_hashes[0],
                     user_id=st.session_state.user_id
                 )
                 
@@ -543,23 +627,28 @@ if uploaded_file is not None:
                 except Exception as e:
                     st.error(f"Erro ao carregar histórico da sessão: {e}")
                     st.session_state.conversation_history = ""
-                    st.session_state.all_analyses_history = f"Análise iniciada para o dataset: {uploaded_file.name}\n"
+                    st.session_state.all_analyses_history = f"Análise iniciada para o dataset: {dataset_name}\n"
                 st.rerun()  # Força recarregamento para mostrar o dataset
             except ValueError as e:
                 st.error(f"Erro ao carregar o arquivo: {e}")
-                st.session_state.df = None
+                resources.clear()
+                get_precomputer().cancel(st.session_state.user_id)
+                st.session_state.uploaded_file_ids = None
     else:
         # Dataset já carregado, não mostrar mensagem de debug
         pass
 
 # Verificação: se não há arquivo carregado mas há dados no estado, limpar automaticamente
-if uploaded_file is None and st.session_state.get('df') is not None:
+if not uploaded_files and resources.has_dataset:
     st.info("📤 Nenhum arquivo carregado. Os dados foram limpos automaticamente.")
-    # Limpar dados automaticamente
-    st.session_state.df = None
-    st.session_state.df_info = None
+    # Limpar dados automaticamente (dataset, metadados e gráficos da sessão)
+    resources.clear()
+    get_prefetcher().cancel(st.session_state.user_id)
+    get_precomputer().cancel(st.session_state.user_id)
+    st.session_state.uploaded_file_ids = None
     st.session_state.session_id = None
     st.session_state.messages = []
+    st.session_state.chat_history_extra = 0
     st.session_state.conversation_history = ""
     st.session_state.all_analyses_history = ""
 
@@ -585,456 +674,578 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-if st.session_state.df is not None:
-    st.header("Preview do Dataset")
-    st.dataframe(st.session_state.df.head())
-
-    st.header("Estatísticas Rápidas")
-    st.json(st.session_state.df_info, expanded=False)
+@st.fragment
+def dataset_preview_panel():
+    """Preview do dataset e estatísticas rápidas (fragmento: não é reenviado nas interações do chat)."""
+    with measure_render("preview"):
+        df = resources.df
+        tables = resources.tables
+
+        st.header("Preview do Dataset")
+        if len(tables) > 1:
+            # Uma aba por arquivo; o primeiro também fica disponível como `df`
+            for tab, (table_name, table_df) in zip(st.tabs(list(tables)), tables.items()):
+                with tab:
+                    source = out_of_core_info(table_df)
+                    rows = f"{source['rows']} linhas (fora da memória)" if source else f"{table_df.shape[0]} linhas"
+                    st.caption(f"Tabela `{table_name}` — {rows} x {table_df.shape[1]} colunas")
+                    st.dataframe(table_df.head())
+        else:
+            if out_of_core_info(df):
+                st.caption(f"Arquivo grande consultado fora da memória: {out_of_core_info(df)['rows']} linhas no disco, "
+                           f"amostra de {df.shape[0]} linhas em memória.")
+            st.dataframe(df.head())
+
+        st.header("Estatísticas Rápidas")
+        st.json(resources.df_info, expanded=False)
+        precomputed_results_panel()
+
+
+def precomputed_results_panel():
+    """Resultados do pré-cálculo já publicados: visão geral, correlações, outliers e perfil."""
+    job = get_precomputer().job(st.session_state.user_id) if config["precompute_enabled"] else None
+    if job is None or not job.results:
+        return
+    results = job.results
+    if results.get("overview_charts"):
+        st.header("Visão Geral")
+        charts = results["overview_charts"]
+        for i, (tab, chart) in enumerate(zip(st.tabs([chart["question"] for chart in charts]), charts)):
+            with tab:
+                st.plotly_chart(chart["figure"], use_container_width=True, key=f"overview_chart_{i}")
+    correlations = results.get("correlations")
+    if correlations and correlations["top_pairs"]:
+        with st.expander("🔗 Pares de variáveis mais correlacionados"):
+            st.dataframe(pd.DataFrame(correlations["top_pairs"]), hide_index=True, use_container_width=True)
+    if results.get("outliers"):
+        with st.expander("🎯 Outliers por coluna (IQR)"):
+            outliers = pd.DataFrame.from_dict(results["outliers"], orient="index")
+            st.dataframe(outliers.rename_axis("coluna").reset_index(), hide_index=True, use_container_width=True)
+    if results.get("profile"):
+        with st.expander("🧾 Perfil das colunas"):
+            st.json(results["profile"]["columns"], expanded=False)
+
+
+def precompute_progress():
+    """Progresso do pré-cálculo; ao terminar, a página é atualizada com os resultados e as sugestões."""
+    status = get_precomputer().status(st.session_state.user_id)
+    if status is None or status["done"]:
+        st.rerun()
+    st.progress(status["finished"] / max(status["total"], 1),
+                text=f"⏳ Pré-calculando perfil, correlações, gráficos e sugestões do dataset "
+                     f"({status['finished']}/{status['total']})...")
+
+
+@st.fragment
+def chat_panel():
+    """
+    Histórico do chat, sugestões e pergunta/resposta.
 
-    # --- Interface de Chat ---
-    st.header("Converse com seus Dados")
+    Perguntas e cliques nas sugestões reexecutam apenas este fragmento: o
+    preview do dataset, as estatísticas e a barra lateral não são recalculados
+    nem reenviados ao navegador.
+    """
+    # Execuções parciais não passam pelo início do script: reassocia a sessão e recarrega os dados se preciso
+    set_current_session(st.session_state.user_id)
+    with measure_render("chat"):
+        df = resources.df
+        tables = resources.tables
+
+        # --- Interface de Chat ---
+        st.header("Converse com seus Dados")
+
+        # Exibe as mensagens recentes do histórico; as anteriores são carregadas sob demanda
+        display_chat_history(st.session_state.messages, resources, config["chat_history_window"])
+
+        # Exibir gráfico preservado apenas se ainda não estiver nas mensagens
+        if 'last_chart_id' in st.session_state and st.session_state.last_chart_id:
+            assistant_has_chart = any(
+                message.get("role") == "assistant" and message.get("chart_id") is not None
+                for message in st.session_state.messages
+            )
 
-    # Exibe mensagens do histórico (preservar mensagens existentes)
-    for i, message in enumerate(st.session_state.messages):
-        display_chat_message(message["role"], message["content"], message.get("chart_fig"), generated_code=message.get("generated_code"))
+            if assistant_has_chart:
+                # Evitar duplicação removendo o gráfico preservado redundante
+                del st.session_state.last_chart_id
+                if 'last_chart_code' in st.session_state:
+                    del st.session_state.last_chart_code
+            else:
+                st.success("📊 Gráfico preservado da análise anterior:")
+                try:
+                    chart_key = f"preserved_chart_{len(st.session_state.messages)}"
+                    st.plotly_chart(resources.get_figure(st.session_state.last_chart_id), use_container_width=True, key=chart_key)
+                except Exception as e:
+                    st.warning(f"⚠️ Erro ao exibir gráfico preservado: {e}")
+                    # Limpar gráfico preservado se houver erro
+                    if 'last_chart_id' in st.session_state:
+                        del st.session_state.last_chart_id
+
+        # --- Sugestões Dinâmicas de Perguntas ---
+        st.subheader("Sugestões de Perguntas:")
+
+        # Sugestões só são geradas de novo quando o histórico muda (cliques e reruns do fragmento as reaproveitam)
+        # Sugestões do dataset pré-calculadas no upload (usadas enquanto não há histórico)
+        initial_suggestions = get_precomputer().result(st.session_state.user_id, "suggestions") \
+            if config["precompute_enabled"] else None
+        suggestions_context = context_key(st.session_state.conversation_history, bool(initial_suggestions))
+        if st.session_state.get("suggestions") and st.session_state.get("suggestions_context") == suggestions_context:
+            suggestions = st.session_state.suggestions
+        elif st.session_state.conversation_history.strip():
+            try:
+                dataset_preview = get_dataset_preview(df)
 
-    # Exibir gráfico preservado apenas se ainda não estiver nas mensagens
-    if 'last_chart' in st.session_state and st.session_state.last_chart:
-        assistant_has_chart = any(
-            message.get("role") == "assistant" and message.get("chart_fig") is not None
-            for message in st.session_state.messages
-        )
+                # Extrair contexto da conversa para melhorar as sugestões
+                conversation_context = extract_conversation_context(st.session_state.conversation_history)
 
-        if assistant_has_chart:
-            # Evitar duplicação removendo o gráfico preservado redundante
-            del st.session_state.last_chart
-            if 'last_chart_code' in st.session_state:
-                del st.session_state.last_chart_code
-        else:
-            st.success("📊 Gráfico preservado da análise anterior:")
-            try:
-                chart_key = f"preserved_chart_{len(st.session_state.messages)}"
-                st.plotly_chart(st.session_state.last_chart, use_container_width=True, key=chart_key)
-            except Exception as e:
-                st.warning(f"⚠️ Erro ao exibir gráfico preservado: {e}")
-                # Limpar gráfico preservado se houver erro
-                if 'last_chart' in st.session_state:
-                    del st.session_state.last_chart
-
-    # --- Sugestões Dinâmicas de Perguntas ---
-    st.subheader("Sugestões de Perguntas:")
-
-    # Sempre gerar sugestões baseadas no histórico atual
-    if st.session_state.conversation_history.strip():
-        try:
-            dataset_preview = get_dataset_preview(st.session_state.df)
-
-            # Extrair contexto da conversa para melhorar as sugestões
-            conversation_context = extract_conversation_context(st.session_state.conversation_history)
-
-            # Adicionar contexto ao histórico para o agente
-            enriched_history = st.session_state.conversation_history
-            if conversation_context["analysis_types"]:
-                enriched_history += f"\n\nTipos de análise realizados: {', '.join(conversation_context['analysis_types'])}"
-            if conversation_context["agents_used"]:
-                enriched_history += f"\nAgentes utilizados: {', '.join(conversation_context['agents_used'])}"
-
-            # Gerar novas sugestões sempre com o histórico atualizado
-            suggestions = generate_dynamic_suggestions(
-                api_key=config["google_api_key"],
-                dataset_preview=dataset_preview,
-                conversation_history=enriched_history
-            )
+                # Adicionar contexto ao histórico para o agente
+                enriched_history = st.session_state.conversation_history
+                if conversation_context["analysis_types"]:
+                    enriched_history += f"\n\nTipos de análise realizados: {', '.join(conversation_context['analysis_types'])}"
+                if conversation_context["agents_used"]:
+                    enriched_history += f"\nAgentes utilizados: {', '.join(conversation_context['agents_used'])}"
 
-        except Exception as e:
-            st.error(f"❌ **Erro ao gerar sugestões:** {e}")
-            suggestions = get_fallback_suggestions()
-            st.warning(f"📝 **Usando sugestões padrão:** {len(suggestions)} sugestões")
-    else:
-        # Se não há histórico, usar sugestões padrão
-        suggestions = get_fallback_suggestions()
-
-    # Garantir que sempre tenhamos sugestões
-    if not suggestions:
-        suggestions = get_fallback_suggestions()
-        st.error("⚠️ **Fallback ativado: usando sugestões padrão**")
-
-    # Exibir as sugestões
-    st.write(f"🔍 **Mostrando {len(suggestions[:3])} sugestões:**")
-    cols = st.columns(3)
-    for i, suggestion in enumerate(suggestions[:3]):
-        if cols[i].button(suggestion, use_container_width=True, key=f"suggestion_{i}"):
-            st.session_state.last_question = suggestion
-
-    if prompt := st.chat_input("Faça sua pergunta sobre os dados...") or st.session_state.get('last_question'):
-        st.session_state.last_question = None  # Limpa a sugestão imediatamente
-
-        # Adiciona a pergunta do usuário ao histórico e exibe
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        display_chat_message("user", prompt)
-
-        # Adiciona ao histórico de texto para os agentes
-        st.session_state.conversation_history += f"Usuário: {prompt}\n"
-        
-        # Inicializa conversation_id como None
-        conversation_id = None
-        
-        # Registrar a conversa no banco de dados
-        if st.session_state.session_id:
-            try:
-                conversation_id = memory.log_conversation(
-                    session_id=st.session_state.session_id,
-                    question=prompt,
-                    answer=""  # A resposta será atualizada quando estiver pronta
+                # Gerar novas sugestões sempre com o histórico atualizado
+                suggestions = generate_dynamic_suggestions(
+                    api_key=config["google_api_key"],
+                    dataset_preview=dataset_preview,
+                    conversation_history=enriched_history
                 )
+
             except Exception as e:
-                st.error(f"Erro ao registrar conversa: {e}")
+                st.error(f"❌ **Erro ao gerar sugestões:** {e}")
+                suggestions = get_fallback_suggestions()
+                st.warning(f"📝 **Usando sugestões padrão:** {len(suggestions)} sugestões")
+        else:
+            # Sem histórico: sugestões pré-calculadas para o dataset ou, enquanto não ficam prontas, as padrão
+            suggestions = initial_suggestions or get_fallback_suggestions()
 
-        with st.spinner("Analisando e gerando resposta..."):
-            try:
-                # 1. CoordinatorAgent decide o que fazer
-                coordinator_decision = run_coordinator(
+        # Garantir que sempre tenhamos sugestões
+        if not suggestions:
+            suggestions = get_fallback_suggestions()
+            st.error("⚠️ **Fallback ativado: usando sugestões padrão**")
+        st.session_state.suggestions = suggestions
+        st.session_state.suggestions_context = suggestions_context
+
+        # Exibir as sugestões
+        st.write(f"🔍 **Mostrando {len(suggestions[:3])} sugestões:**")
+        cols = st.columns(3)
+        for i, suggestion in enumerate(suggestions[:3]):
+            if cols[i].button(suggestion, use_container_width=True, key=f"suggestion_{i}"):
+                st.session_state.last_question = suggestion
+
+        # Pré-busca especulativa: as respostas das sugestões são calculadas em segundo plano enquanto o usuário lê
+        prefetch_context = context_key(st.session_state.conversation_history, st.session_state.all_analyses_history,
+                                       upload_ids)
+        if config["prefetch_enabled"]:
+            prefetch_history = st.session_state.conversation_history
+            prefetch_analyses = st.session_state.all_analyses_history
+            get_prefetcher().schedule(
+                st.session_state.user_id, prefetch_context, suggestions[:3],
+                lambda question: aprefetch_turn(
                     api_key=config["google_api_key"],
-                    df=st.session_state.df,
-                    conversation_history=st.session_state.conversation_history,
-                    user_question=prompt
+                    df=df,
+                    df_info=resources.df_info,
+                    conversation_history=prefetch_history,
+                    all_analyses_history=prefetch_analyses,
+                    user_question=question,
+                    tables=tables
                 )
+            )
 
-                agent_to_call = coordinator_decision.get("agent_to_call")
-                question_for_agent = coordinator_decision.get("question_for_agent")
-                
-                # Inicializa conversation_id como None
-                conversation_id = None
-
-                st.info(f"Roteando para: **{agent_to_call}**")
-                time.sleep(1)
+        if prompt := st.chat_input("Faça sua pergunta sobre os dados...") or st.session_state.get('last_question'):
+            st.session_state.last_question = None  # Limpa a sugestão imediatamente
 
-                bot_response_content = ""
-                chart_figure = None
-                generated_code = ""
+            # Adiciona a pergunta do usuário ao histórico e exibe
+            st.session_state.messages.append({"role": "user", "content": prompt})
+            display_chat_message("user", prompt)
 
-                # 2. Roteia para o agente apropriado
-                if agent_to_call == "DataAnalystAgent":
-                    bot_response_content = run_data_analyst(
-                        api_key=config["google_api_key"],
-                        df=st.session_state.df,
-                        analysis_context=st.session_state.all_analyses_history,
-                        specific_question=question_for_agent
-                    )
-                    st.session_state.all_analyses_history += f"Análise Estatística:\n{bot_response_content}\n"
-                    
-                    # Armazenar a análise no banco de dados
-                    if st.session_state.session_id:
-                        try:
-                            memory.store_analysis(
-                                session_id=st.session_state.session_id,
-                                conversation_id=conversation_id,
-                                analysis_type="data_analysis",
-                                results={"analysis": bot_response_content}
-                            )
-                        except Exception as e:
-                            st.error(f"Erro ao salvar análise: {e}")
-
-                elif agent_to_call == "VisualizationAgent":
+            # Adiciona ao histórico de texto para os agentes
+            st.session_state.conversation_history += f"Usuário: {prompt}\n"
+        
+            # Span raiz do turno: cada etapa (roteamento, LLM, execução, gráfico, banco) vira um span filho
+            with start_span("chat_turn", dataset_rows=int(df.shape[0]),
+                            dataset_cols=int(df.shape[1]), question_length=len(prompt)):
+                with st.spinner("Analisando e gerando resposta..."):
                     try:
-                        generated_code = run_visualization(
-                            api_key=config["google_api_key"],
-                            df=st.session_state.df,
-                            analysis_results=st.session_state.all_analyses_history,
-                            user_request=question_for_agent
-                        )
+                        # 1. Roteamento + agente especialista no loop assíncrono compartilhado
+                        #    (o registro da pergunta no banco roda em paralelo com o coordenador)
+                        #    Sugestões já pré-buscadas no mesmo contexto usam o turno pronto
+                        turn = get_prefetcher().take(st.session_state.user_id, prefetch_context, prompt)
+                        if turn is not None:
+                            st.caption("⚡ Resposta pré-calculada enquanto você lia a anterior.")
+                            if st.session_state.session_id:
+                                try:
+                                    turn["conversation_id"] = memory.log_conversation(
+                                        session_id=st.session_state.session_id,
+                                        question=prompt,
+                                        answer=""  # A resposta será atualizada quando estiver pronta
+                                    )
+                                except Exception as e:
+                                    turn["errors"].append(f"Erro ao registrar conversa: {e}")
+                        else:
+                            turn = run_sync(arun_turn(
+                                api_key=config["google_api_key"],
+                                df=df,
+                                df_info=resources.df_info,
+                                conversation_history=st.session_state.conversation_history,
+                                all_analyses_history=st.session_state.all_analyses_history,
+                                user_question=prompt,
+                                memory=memory,
+                                session_id=st.session_state.session_id,
+                                tables=tables
+                            ))
+                        for turn_error in turn["errors"]:
+                            st.error(turn_error)
 
-                        # Tenta executar o código para gerar o gráfico usando cache
-                        try:
-                            # Usar cache otimizado para gráficos
-                            chart_figure = exec_with_cache(generated_code, st.session_state.df)
+                        agent_to_call = turn["agent_to_call"]
+                        question_for_agent = turn["question_for_agent"]
+                        conversation_id = turn["conversation_id"]
 
-                            if chart_figure:
-                                bot_response_content = "Aqui está a visualização que você pediu."
-                                st.session_state.all_analyses_history += f"Visualização Gerada: {question_for_agent}\n"
-                            else:
-                                bot_response_content = "O código foi gerado, mas não criou uma figura válida. Verifique se o código define uma variável 'fig'."
-                        except SyntaxError as se:
-                            bot_response_content = f"Erro de sintaxe no código gerado: {se}\n\nCódigo com erro:\n```python\n{generated_code}\n```"
-                        except NameError as ne:
-                            bot_response_content = f"Erro: variável não definida no código: {ne}\n\nCódigo com erro:\n```python\n{generated_code}\n```"
-                        except Exception as e:
-                            bot_response_content = f"Erro ao executar código do gráfico: {e}\n\nCódigo que falhou:\n```python\n{generated_code}\n```"
+                        if agent_to_call == PLAN_AGENT:
+                            st.info("Plano em etapas: " + " → ".join(f"**{step['agent']}**" for step in turn["steps"]))
+                        else:
+                            st.info(f"Roteando para: **{agent_to_call}**")
 
-                    except Exception as e:
-                        bot_response_content = f"Erro no agente de visualização: {e}\n\nTente reformular sua pergunta ou verifique se sua chave da API do Google está configurada corretamente."
+                        bot_response_content = turn["content"]
+                        chart_figure = None
+                        generated_code = turn["generated_code"]
 
-                elif agent_to_call == "ConsultantAgent":
-                    bot_response_content = run_consultant(
-                        api_key=config["google_api_key"],
-                        df=st.session_state.df,
-                        all_analyses=st.session_state.all_analyses_history,
-                        user_question=question_for_agent
-                    )
+                        # 2. Pós-processamento específico de cada agente
+                        if agent_to_call == "DataAnalystAgent":
+                            st.session_state.all_analyses_history += f"Análise Estatística:\n{bot_response_content}\n"
                     
-                    # Armazenar a conclusão no banco de dados
-                    if st.session_state.session_id:
-                        try:
-                            memory.store_conclusion(
-                                session_id=st.session_state.session_id,
-                                conversation_id=conversation_id,
-                                conclusion_text=bot_response_content,
-                                confidence_score=0.9  # Pontuação de confiança padrão
-                            )
-                        except Exception as e:
-                            st.error(f"Erro ao salvar conclusão: {e}")
-
-                elif agent_to_call == "CodeGeneratorAgent":
-                    analysis_context = f"Pergunta do usuário: {prompt}\n\nContexto da conversa:\n{st.session_state.all_analyses_history}"
-                    generated_code = run_code_generator(
-                        api_key=config["google_api_key"],
-                        dataset_info=str(st.session_state.df_info),
-                        analysis_to_convert=analysis_context
-                    )
-                    # Não incluir o código na resposta - ele será exibido automaticamente na interface
-                    bot_response_content = "💡 Código Gerado: Este código será executado automaticamente na própria interface!"
-
-                else:
-                    bot_response_content = "Desculpe, não entendi qual agente usar. Poderia reformular sua pergunta?"
+                            # Armazenar a análise no banco de dados
+                            if st.session_state.session_id:
+                                try:
+                                    memory.store_analysis(
+                                        session_id=st.session_state.session_id,
+                                        conversation_id=conversation_id,
+                                        analysis_type="data_analysis",
+                                        results={"analysis": bot_response_content}
+                                    )
+                                except Exception as e:
+                                    st.error(f"Erro ao salvar análise: {e}")
+
+                        elif agent_to_call == "VisualizationAgent" and generated_code:
+                            # Executa o código do gráfico (com cache); se falhar, o agente corrige o código
+                            try:
+                                chart = run_sync(arender_chart(config["google_api_key"], df, generated_code,
+                                                               chart_question(turn), tables=tables))
+                                chart_figure = chart["figure"]
+                                generated_code = chart["code"]
+
+                                if chart_figure:
+                                    bot_response_content = "Aqui está a visualização que você pediu."
+                                    if chart["repairs"]:
+                                        bot_response_content += f"\n\n🔧 O código foi corrigido automaticamente ({chart['repairs']} tentativa(s))."
+                                    st.session_state.all_analyses_history += f"Visualização Gerada: {question_for_agent}\n"
+                                    if turn["query_mode"] == "python":
+                                        # Código escrito pelo agente (e que funcionou): disponível para perguntas parecidas
+                                        get_code_reuse_index().add(chart_question(turn), generated_code, df)
+                                    elif turn["query_mode"] == "reuse":
+                                        bot_response_content += "\n\n♻️ Código reaproveitado de um pedido parecido, sem chamar o LLM."
+                                else:
+                                    bot_response_content = f"Não foi possível gerar o gráfico: {chart['error']}\n\nCódigo que falhou:\n```python\n{generated_code}\n```"
+                            except Exception as e:
+                                bot_response_content = f"Erro ao executar código do gráfico: {e}\n\nCódigo que falhou:\n```python\n{generated_code}\n```"
+
+                        elif agent_to_call == PLAN_AGENT:
+                            # Pedido composto: registra o resultado de cada etapa como em um turno de agente único
+                            for step in turn["steps"]:
+                                if step["agent"] == "DataAnalystAgent":
+                                    st.session_state.all_analyses_history += f"Análise Estatística:\n{step['content']}\n"
+                                if not st.session_state.session_id or step["agent"] == "VisualizationAgent":
+                                    continue
+                                try:
+                                    if step["agent"] == "DataAnalystAgent":
+                                        memory.store_analysis(
+                                            session_id=st.session_state.session_id,
+                                            conversation_id=conversation_id,
+                                            analysis_type="data_analysis",
+                                            results={"analysis": step["content"]}
+                                        )
+                                    else:
+                                        memory.store_conclusion(
+                                            session_id=st.session_state.session_id,
+                                            conversation_id=conversation_id,
+                                            conclusion_text=step["content"],
+                                            confidence_score=0.9
+                                        )
+                                except Exception as e:
+                                    st.error(f"Erro ao salvar resultado da etapa {step['id']}: {e}")
+
+                            if generated_code:
+                                chart = run_sync(arender_chart(config["google_api_key"], df, generated_code,
+                                                               chart_question(turn), tables=tables))
+                                chart_figure = chart["figure"]
+                                generated_code = chart["code"]
+                                if chart_figure:
+                                    st.session_state.all_analyses_history += f"Visualização Gerada: {chart_question(turn)}\n"
+                                else:
+                                    bot_response_content += f"\n\n⚠️ Não foi possível gerar o gráfico: {chart['error']}"
+
+                        elif agent_to_call == "ConsultantAgent":
+                            # Armazenar a conclusão no banco de dados
+                            if st.session_state.session_id:
+                                try:
+                                    memory.store_conclusion(
+                                        session_id=st.session_state.session_id,
+                                        conversation_id=conversation_id,
+                                        conclusion_text=bot_response_content,
+                                        confidence_score=0.9  # Pontuação de confiança padrão
+                                    )
+                                except Exception as e:
+                                    st.error(f"Erro ao salvar conclusão: {e}")
+
+                        # 3. Exibe a resposta do bot
+                        execution_container = None
+                        results_container = None
+
+                        # Executar código automaticamente se foi gerado
+                        if generated_code:
+                            # Exibir código com containers para execução
+                            with st.chat_message("assistant"):
+                                st.markdown(bot_response_content)
+
+                                # Sempre exibir o código gerado PRIMEIRO
+                                execution_container, results_container = display_code_with_streamlit_suggestion(generated_code, auto_execute=True)
+
+                                # Exibir gráfico APENAS se foi gerado pelo VisualizationAgent (evita duplicação)
+                                # O id da figura (guardada uma única vez) também é a chave do gráfico
+                                chart_id = resources.add_figure(chart_figure)
+                                if chart_figure and agent_to_call in ("VisualizationAgent", PLAN_AGENT):
+                                    try:
+                                        chart_key = f"chart_{chart_id}"
+                                        with start_span("render_chart", traces=len(chart_figure.data)):
+                                            st.plotly_chart(chart_figure, use_container_width=True, key=chart_key)
+                                    except Exception as e:
+                                        st.warning(f"⚠️ Erro ao exibir gráfico na execução inicial: {str(e)}")
+
+                            # Atualizar a mensagem no histórico
+                            st.session_state.messages.append({
+                                "role": "assistant",
+                                "content": bot_response_content,
+                                "chart_id": chart_id,
+                                "generated_code": generated_code
+                            })
+
+                            if execution_container is None:
+                                st.error("❌ Erro: Containers não foram criados corretamente!")
+                                # Não usar return aqui, continuar a execução
+
+                            # Executar o código gerado (apenas para CodeGeneratorAgent)
+                            if agent_to_call == "CodeGeneratorAgent":
+                                try:
+                                    execution_container.markdown("**Status:** 🔄 Executando código Python gerado...")
+
+                                    # Criar ambiente seguro para execução
+                                    local_scope = {
+                                        "df": df,
+                                        "pd": pd,
+                                        "px": px,
+                                        "go": go,
+                                        "st": st,
+                                        "plt": plt,
+                                        "np": np,
+                                        "tables": tables,
+                                        "sql": make_sql_function(sql_tables(df, tables)),
+                                        "cube": make_cube_function(df)
+                                    }
+
+                                    # Verificar se o DataFrame está disponível
+                                    if df is None:
+                                        results_container.markdown("**Erro:** Nenhum arquivo CSV foi carregado.")
+                                        st.error("Erro: Nenhum DataFrame disponível para análise.")
+                                        # Não usar return, continuar com o fluxo
+
+                                    # Analisa o código antes de executar (sintaxe, colunas e chamadas proibidas).
+                                    # A execução é direta, sem o cache de gráficos: o código também pode
+                                    # exibir resultados com `st` e definir `result`, que precisam do escopo local
+                                    analysis = analyze_code(generated_code)
+                                    analysis.validate(df, tables)
+                                    exec(analysis.executable_code, local_scope)
+
+                                    # Verificar se foi gerada uma figura
+                                    if 'fig' in local_scope:
+                                        execution_container.markdown("**Status:** ✅ Código executado com sucesso!")
+                                        results_container.markdown("**Resultados:** Visualização gerada automaticamente:")
+
+                                        # Exibir a figura gerada APENAS UMA VEZ
+                                        fig = local_scope['fig']
+                                        # Atualizar a mensagem para incluir a figura (o id também é a chave do gráfico)
+                                        fig_id = resources.add_figure(fig)
+                                        st.session_state.messages[-1]["chart_id"] = fig_id
+                                        with start_span("render_chart", traces=len(fig.data)):
+                                            st.plotly_chart(fig, use_container_width=True, key=f"chart_{fig_id}")
+                                        chart_figure = fig
+
+                                    else:
+                                        execution_container.markdown("**Status:** ✅ Código executado com sucesso!")
+                                        results_container.markdown("**Resultados:** Código executado sem gerar visualização específica.")
+
+                                    # Capturar outras saídas importantes
+                                    if 'result' in local_scope:
+                                        results_container.markdown(f"**Valor de retorno:** {local_scope['result']}")
+                                except Exception as e:
+                                    execution_container.markdown(f"**Status:** ❌ Erro na execução: {str(e)}")
+                                    results_container.markdown(f"**Detalhes do erro:** {str(e)}")
+                                    st.error(f"Erro na execução do código: {e}")
+                            else:
+                                # Para VisualizationAgent, mostrar que o código já foi executado
+                                if execution_container and results_container:
+                                    execution_container.markdown("**Status:** ✅ Código executado com sucesso!")
+                                    results_container.markdown("**Resultados:** Gráfico gerado automaticamente acima.")
 
-                # 3. Exibe a resposta do bot
-                execution_container = None
-                results_container = None
+                        else:
+                            # Para agentes sem código, usar display_chat_message normalmente
+                            chart_id = resources.add_figure(chart_figure)
+                            display_chat_message("assistant", bot_response_content, chart_figure,
+                                                 key=f"chart_{chart_id}" if chart_id else None, generated_code=None,
+                                                 chart_valid=resources.figure_is_valid(chart_id) if chart_id else None)
+
+                            # Atualizar a mensagem no histórico
+                            st.session_state.messages.append({
+                                "role": "assistant",
+                                "content": bot_response_content,
+                                "chart_id": chart_id,
+                                "generated_code": None
+                            })
+
+                        # Atualiza o histórico de texto APÓS processar a resposta
+                        st.session_state.conversation_history += f"Assistente: {bot_response_content}\n"
+
+                        # Forçar atualização das sugestões na próxima renderização
+                        st.session_state.suggestions = []  # Forçar regeneração
+
+                        # 4. Salva no Supabase
+                        with start_span("persist") as persist_span:
+                            try:
+                                chart_json = None
+                                if chart_figure:
+                                    # JSON serializado uma única vez ao guardar a figura
+                                    chart_json = resources.figure_json(st.session_state.messages[-1].get("chart_id"))
+                                    if chart_json is not None:
+                                        persist_span.set_attribute("figure_bytes", len(chart_json))
+                                        # Se o JSON for muito grande, truncar para evitar timeout
+                                        if len(chart_json) > 10000:  # Reduzir limite para ~10KB
+                                            chart_json = chart_json[:10000] + "\n... (truncado para evitar timeout)"
+                                    else:
+                                        # Se não foi possível converter, salvar apenas metadados básicos
+                                        st.warning("⚠️ Não foi possível converter gráfico para JSON.")
+                                        chart_json = f"Gráfico gerado ({type(chart_figure).__name__})"
+
+                                # Inicializa a variável conv_id
+                                conv_id = None
+                                # Atualizar a conversa existente em vez de criar uma nova
+                                if 'conversation_id' in locals() and conversation_id:
+                                    try:
+                                        # Atualiza a conversa existente
+                                        memory.client.table("conversations").update({
+                                            "answer": bot_response_content,
+                                            "chart_json": chart_json
+                                        }).eq("id", conversation_id).execute()
+                                        conv_id = conversation_id
+                                    except Exception as e:
+                                        st.error(f"Erro ao atualizar conversa: {e}")
+                                else:
+                                    # Se não tiver um ID de conversa, cria uma nova
+                                    try:
+                                        # Cria uma nova conversa e pega o ID retornado
+                                        conv_response = memory.log_conversation(
+                                            session_id=st.session_state.session_id,
+                                            question=prompt,
+                                            answer=bot_response_content,
+                                            chart_json=chart_json
+                                        )
+                                        conv_id = conv_response  # Atribui o ID retornado
+                                    except Exception as e:
+                                        st.error(f"Erro ao salvar conversa: {e}")
+                            except Exception as db_error:
+                                st.warning(f"⚠️ Erro ao salvar conversa no banco: {str(db_error)}")
+                                conv_id = None
+
+                            if generated_code:
+                                # Tentar salvar o código gerado, mas com proteção contra timeout
+                                try:
+                                    # Verificar se o código é muito longo (limite de 5000 caracteres)
+                                    if len(generated_code) > 5000:
+                                        # Truncar o código para evitar timeout
+                                        truncated_code = generated_code[:5000] + "\n\n# ... (código truncado para evitar timeout no banco de dados)"
+                                        code_to_save = truncated_code
+                                    else:
+                                        code_to_save = generated_code
+
+                                    memory.store_generated_code(
+                                        session_id=st.session_state.session_id,
+                                        conversation_id=conv_id,
+                                        code_type='visualization' if agent_to_call == "VisualizationAgent" else 'analysis',
+                                        python_code=code_to_save,
+                                        description=question_for_agent
+                                    )
+                                except Exception as db_error:
+                                    # Se houver erro no banco, apenas logar e continuar
+                                    st.warning(f"⚠️ Código executado com sucesso, mas houve problema ao salvar: {str(db_error)}")
+                                    # Não interromper o fluxo principal
+
+                        # Recarregar a página para atualizar as sugestões com o novo histórico
+                        # Mas apenas se estivermos em modo debug OU se não houver gráfico para evitar problemas
+                        should_rerun = False  # Otimização: reduzir reruns desnecessários
+
+                        if chart_figure:
+                            # Se há gráfico, só fazer rerun em modo debug para evitar problemas de renderização
+                            if DEBUG_MODE:
+                                st.success("✅ Resposta processada com sucesso! (Gráfico preservado - rerun em modo debug)")
+                                should_rerun = True
+                            else:
+                                st.success("✅ Resposta processada com sucesso!")
+                                should_rerun = False
+                        else:
+                            # Se não há gráfico, rerun é seguro
+                            if DEBUG_MODE:
+                                st.success("✅ Resposta processada com sucesso! (Sem gráfico - rerun em modo debug)")
+                            else:
+                                st.success("✅ Resposta processada com sucesso!")
+                            should_rerun = False  # Otimização: evitar rerun desnecessário
 
-                # Executar código automaticamente se foi gerado
-                if generated_code:
-                    # Exibir código com containers para execução
-                    with st.chat_message("assistant"):
-                        st.markdown(bot_response_content)
+                        if should_rerun and DEBUG_MODE:
+                            rerun_fragment()
 
-                        # Sempre exibir o código gerado PRIMEIRO
-                        execution_container, results_container = display_code_with_streamlit_suggestion(generated_code, auto_execute=True)
+                        # FORÇAR ATUALIZAÇÃO DAS SUGESTÕES APÓS CADA RESPOSTA
+                        st.info("🔄 Atualizando sugestões com o novo contexto...")
 
-                        # Exibir gráfico APENAS se foi gerado pelo VisualizationAgent (evita duplicação)
-                        if chart_figure and agent_to_call == "VisualizationAgent":
-                            try:
-                                # Usar chave única para evitar re-renderização
-                                chart_key = f"chart_{len(st.session_state.messages)}_{hash(str(chart_figure))}"
-                                st.plotly_chart(chart_figure, use_container_width=True, key=chart_key)
-                            except Exception as e:
-                                st.warning(f"⚠️ Erro ao exibir gráfico na execução inicial: {str(e)}")
-
-                    # Atualizar a mensagem no histórico com verificação robusta
-                    chart_to_save = chart_figure
-                    if chart_figure:
-                        try:
-                            # Verificar se o gráfico é serializável
-                            chart_figure.to_json()
-                        except Exception as e:
-                            # Manter o gráfico mesmo se não for serializável
-                            pass
-
-                    # Remover deep copy para melhorar performance
-                    # chart_to_save = copy.deepcopy(chart_to_save) se necessário
-
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": bot_response_content,
-                        "chart_fig": chart_to_save,
-                        "generated_code": generated_code
-                    })
-
-                    if execution_container is None:
-                        st.error("❌ Erro: Containers não foram criados corretamente!")
-                        # Não usar return aqui, continuar a execução
-
-                    # Executar o código gerado (apenas para CodeGeneratorAgent)
-                    if agent_to_call == "CodeGeneratorAgent":
-                        try:
-                            execution_container.markdown("**Status:** 🔄 Executando código Python gerado...")
-
-                            # Criar ambiente seguro para execução
-                            local_scope = {
-                                "df": st.session_state.df,
-                                "pd": pd,
-                                "px": px,
-                                "go": go,
-                                "st": st,
-                                "plt": plt,
-                                "np": np
-                            }
-
-                            # Verificar se o DataFrame está disponível
-                            if st.session_state.df is None:
-                                results_container.markdown("**Erro:** Nenhum arquivo CSV foi carregado.")
-                                st.error("Erro: Nenhum DataFrame disponível para análise.")
-                                # Não usar return, continuar com o fluxo
-
-                            # Executar o código usando cache otimizado
-                            exec_with_cache(generated_code, local_scope)
-
-                            # Verificar se foi gerada uma figura
-                            if 'fig' in local_scope:
-                                execution_container.markdown("**Status:** ✅ Código executado com sucesso!")
-                                results_container.markdown("**Resultados:** Visualização gerada automaticamente:")
-
-                                # Exibir a figura gerada APENAS UMA VEZ
-                                fig = local_scope['fig']
-                                # Usar chave única para evitar re-renderização
-                                fig_key = f"code_chart_{len(st.session_state.messages)}_{id(fig)}"
-                                st.plotly_chart(fig, use_container_width=True, key=fig_key)
-
-                                # Atualizar a mensagem para incluir a figura
-                                st.session_state.messages[-1]["chart_fig"] = fig
-                                chart_figure = fig
+                        # Preservar gráficos antes do re-run apenas se necessário
+                        if chart_figure:
+                            st.session_state.last_chart_id = st.session_state.messages[-1].get("chart_id")
+                            st.session_state.last_chart_code = generated_code
 
-                            else:
-                                execution_container.markdown("**Status:** ✅ Código executado com sucesso!")
-                                results_container.markdown("**Resultados:** Código executado sem gerar visualização específica.")
-
-                            # Capturar outras saídas importantes
-                            if 'result' in local_scope:
-                                results_container.markdown(f"**Valor de retorno:** {local_scope['result']}")
-                        except Exception as e:
-                            execution_container.markdown(f"**Status:** ❌ Erro na execução: {str(e)}")
-                            results_container.markdown(f"**Detalhes do erro:** {str(e)}")
-                            st.error(f"Erro na execução do código: {e}")
-                    else:
-                        # Para VisualizationAgent, mostrar que o código já foi executado
-                        if execution_container and results_container:
-                            execution_container.markdown("**Status:** ✅ Código executado com sucesso!")
-                            results_container.markdown("**Resultados:** Gráfico gerado automaticamente acima.")
-
-                else:
-                    # Para agentes sem código, usar display_chat_message normalmente
-                    display_chat_message("assistant", bot_response_content, chart_figure, generated_code=None)
-
-                    # Atualizar a mensagem no histórico
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": bot_response_content,
-                        "chart_fig": chart_figure,
-                        "generated_code": None
-                    })
-
-                # Atualiza o histórico de texto APÓS processar a resposta
-                st.session_state.conversation_history += f"Assistente: {bot_response_content}\n"
-
-                # Forçar atualização das sugestões na próxima renderização
-                st.session_state.suggestions = []  # Forçar regeneração
-
-                # 4. Salva no Supabase
-                try:
-                    chart_json = None
-                    if chart_figure:
-                        try:
-                            # Converter gráfico para JSON com timeout protection
-                            chart_json = chart_figure.to_json()
-                            # Se o JSON for muito grande, truncar para evitar timeout
-                            if len(chart_json) > 10000:  # Reduzir limite para ~10KB
-                                chart_json = chart_json[:10000] + "\n... (truncado para evitar timeout)"
-                        except Exception as json_error:
-                            # Se não conseguir converter, salvar apenas metadados básicos
-                            st.warning(f"⚠️ Não foi possível converter gráfico para JSON: {str(json_error)}")
-                            chart_json = f"Gráfico gerado ({type(chart_figure).__name__})"
-
-                    # Inicializa a variável conv_id
-                    conv_id = None
-                    # Atualizar a conversa existente em vez de criar uma nova
-                    if 'conversation_id' in locals() and conversation_id:
-                        try:
-                            # Atualiza a conversa existente
-                            memory.client.table("conversations").update({
-                                "answer": bot_response_content,
-                                "chart_json": chart_json
-                            }).eq("id", conversation_id).execute()
-                            conv_id = conversation_id
-                        except Exception as e:
-                            st.error(f"Erro ao atualizar conversa: {e}")
-                    else:
-                        # Se não tiver um ID de conversa, cria uma nova
-                        try:
-                            # Cria uma nova conversa e pega o ID retornado
-                            conv_response = memory.log_conversation(
-                                session_id=st.session_state.session_id,
-                                question=prompt,
-                                answer=bot_response_content,
-                                chart_json=chart_json
-                            )
-                            conv_id = conv_response  # Atribui o ID retornado
-                        except Exception as e:
-                            st.error(f"Erro ao salvar conversa: {e}")
-                except Exception as db_error:
-                    st.warning(f"⚠️ Erro ao salvar conversa no banco: {str(db_error)}")
-                    conv_id = None
-
-                if generated_code:
-                    # Tentar salvar o código gerado, mas com proteção contra timeout
-                    try:
-                        # Verificar se o código é muito longo (limite de 5000 caracteres)
-                        if len(generated_code) > 5000:
-                            # Truncar o código para evitar timeout
-                            truncated_code = generated_code[:5000] + "\n\n# ... (código truncado para evitar timeout no banco de dados)"
-                            code_to_save = truncated_code
+                        # Forçar re-run para atualizar sugestões com o novo contexto
+                        # Mas apenas se não estivermos em modo debug para evitar problemas
+                        if not DEBUG_MODE:
+                            time.sleep(0.5)  # Pequena pausa para mostrar a mensagem
+                            rerun_fragment()
                         else:
-                            code_to_save = generated_code
-
-                        memory.store_generated_code(
-                            session_id=st.session_state.session_id,
-                            conversation_id=conv_id,
-                            code_type='visualization' if agent_to_call == "VisualizationAgent" else 'analysis',
-                            python_code=code_to_save,
-                            description=question_for_agent
-                        )
-                    except Exception as db_error:
-                        # Se houver erro no banco, apenas logar e continuar
-                        st.warning(f"⚠️ Código executado com sucesso, mas houve problema ao salvar: {str(db_error)}")
-                        # Não interromper o fluxo principal
-
-                # Recarregar a página para atualizar as sugestões com o novo histórico
-                # Mas apenas se estivermos em modo debug OU se não houver gráfico para evitar problemas
-                should_rerun = False  # Otimização: reduzir reruns desnecessários
-
-                if chart_figure:
-                    # Se há gráfico, só fazer rerun em modo debug para evitar problemas de renderização
-                    if DEBUG_MODE:
-                        st.success("✅ Resposta processada com sucesso! (Gráfico preservado - rerun em modo debug)")
-                        should_rerun = True
-                    else:
-                        st.success("✅ Resposta processada com sucesso!")
-                        should_rerun = False
-                else:
-                    # Se não há gráfico, rerun é seguro
-                    if DEBUG_MODE:
-                        st.success("✅ Resposta processada com sucesso! (Sem gráfico - rerun em modo debug)")
-                    else:
-                        st.success("✅ Resposta processada com sucesso!")
-                    should_rerun = False  # Otimização: evitar rerun desnecessário
-
-                if should_rerun and DEBUG_MODE:
-                    st.rerun()
-
-                # FORÇAR ATUALIZAÇÃO DAS SUGESTÕES APÓS CADA RESPOSTA
-                st.info("🔄 Atualizando sugestões com o novo contexto...")
-
-                # Preservar gráficos antes do re-run apenas se necessário
-                if chart_figure:
-                    st.session_state.last_chart = chart_figure
-                    st.session_state.last_chart_code = generated_code
-
-                # Forçar re-run para atualizar sugestões com o novo contexto
-                # Mas apenas se não estivermos em modo debug para evitar problemas
-                if not DEBUG_MODE:
-                    time.sleep(0.5)  # Pequena pausa para mostrar a mensagem
-                    st.rerun()
-                else:
-                    st.success("✅ Sugestões atualizadas (modo debug - sem re-run)")
-
-                # Limpar gráficos preservados após o re-run bem-sucedido
-                if 'last_chart' in st.session_state:
-                    del st.session_state.last_chart
-                if 'last_chart_code' in st.session_state:
-                    del st.session_state.last_chart_code
+                            st.success("✅ Sugestões atualizadas (modo debug - sem re-run)")
 
-            except Exception as e:
-                st.error(f"Ocorreu um erro inesperado: {e}")
+                        # Limpar gráficos preservados após o re-run bem-sucedido
+                        if 'last_chart_id' in st.session_state:
+                            del st.session_state.last_chart_id
+                        if 'last_chart_code' in st.session_state:
+                            del st.session_state.last_chart_code
+
+                    except Exception as e:
+                        st.error(f"Ocorreu um erro inesperado: {e}")
+
+
+if resources.has_dataset:
+    precompute_status = get_precomputer().status(st.session_state.user_id) if config["precompute_enabled"] else None
+    if precompute_status is not None and not precompute_status["done"]:
+        # Fragmento atualizado a cada segundo até o pré-cálculo terminar
+        st.fragment(precompute_progress, run_every=1)()
+    dataset_preview_panel()
+    chat_panel()
 
 # Adiciona um footer
 st.markdown("---")
-st.markdown("Sistema de Análise Exploratória de Dados com IA - Projeto Acadêmico")
\ No newline at end of file
+st.markdown("Sistema de Análise Exploratória de Dados com IA - Projeto Acadêmico")
+
+record_render("app", time.perf_counter() - script_started_at)
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""
+Datasets sintéticos para os benchmarks.
+
+As colunas alternam entre numéricas contínuas, inteiras, categóricas e datas,
+com uma pequena fração de valores ausentes, para exercitar os mesmos caminhos
+de código que um CSV real percorre (dtypes mistos, `isnull`, `duplicated`).
+"""
+import numpy as np
+import pandas as pd
+
+# Categorias usadas nas colunas de texto
+CATEGORIES = np.array([f"categoria_{i:02d}" for i in range(20)])
+# Fração de valores ausentes nas colunas contínuas
+MISSING_FRACTION = 0.01
+
+
+def _column_kind(index: int) -> str:
+    # A primeira coluna é sempre numérica (os gráficos gravados dependem disso)
+    pattern = ("num", "num", "int", "cat", "num", "date", "num", "cat", "int", "num")
+    return pattern[index % len(pattern)]
+
+
+def make_dataset(rows: int, cols: int, seed: int = 42) -> pd.DataFrame:
+    """Gera um DataFrame determinístico com `rows` linhas e `cols` colunas de tipos mistos."""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        kind = _column_kind(i)
+        if kind == "num":
+            values = rng.standard_normal(rows)
+            if rows >= 100:
+                values[rng.random(rows) < MISSING_FRACTION] = np.nan
+            data[f"num_{i}"] = values
+        elif kind == "int":
+            data[f"int_{i}"] = rng.integers(0, 1_000, rows)
+        elif kind == "cat":
+            data[f"cat_{i}"] = CATEGORIES[rng.integers(0, len(CATEGORIES), rows)]
+        else:
+            data[f"date_{i}"] = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1_460, rows), unit="D")
+    return pd.DataFrame(data)
+
+
+def estimate_csv_bytes(df: pd.DataFrame, sample_rows: int = 1_000) -> int:
+    """Estimativa do tamanho do CSV a partir de uma amostra das primeiras linhas."""
+    sample = df.head(sample_rows)
+    if sample.empty:
+        return 0
+    return int(len(sample.to_csv(index=False).encode("utf-8")) * len(df) / len(sample))
+
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """Serializa o DataFrame como CSV (o formato que o usuário envia pelo upload)."""
+    return df.to_csv(index=False).encode("utf-8")
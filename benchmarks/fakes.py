@@ -0,0 +1,219 @@
+"""
+Substitutos determinísticos das dependências externas usados nos benchmarks.
+
+- `ReplayChatModel`: modelo de chat que reproduz respostas gravadas por agente,
+  com latência até o primeiro token e atraso por token configuráveis.
+- `FakeSupabaseClient`: cliente em memória com o subconjunto da API do Supabase
+  usado por `SupabaseMemory`.
+- `FakeUploadedFile`: imita o arquivo entregue pelo `st.file_uploader`.
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Iterator
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+RECORDINGS_PATH = os.path.join(os.path.dirname(__file__), "recordings.json")
+
+# Trecho do prompt que identifica cada agente
+AGENT_MARKERS = {
+    "CoordinatorAgent": "Você é o **CoordinatorAgent**",
+    "DataAnalystAgent": "Você é o **DataAnalystAgent**",
+    "VisualizationAgent": "Você é o **VisualizationAgent**",
+    "ConsultantAgent": "Você é o **ConsultantAgent**",
+    "CodeGeneratorAgent": "Você é o **CodeGeneratorAgent**",
+    "SQLGeneratorAgent": "Você é o **SQLGeneratorAgent**",
+    "SuggestionGenerator": "gera sugestões de perguntas",
+}
+
+# Caracteres por "token" ao fatiar a resposta em streaming
+CHARS_PER_CHUNK = 4
+
+
+def load_recordings(path: str = RECORDINGS_PATH) -> dict:
+    """Carrega as respostas gravadas: {agente: [resposta, ...]}."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ReplayChatModel(BaseChatModel):
+    """Reproduz respostas gravadas, escolhendo o agente pelo conteúdo do prompt."""
+
+    recordings: dict
+    latency_s: float = 0.0
+    token_delay_s: float = 0.0
+    counters: dict = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _pick(self, messages) -> tuple:
+        prompt = "\n".join(str(m.content) for m in messages)
+        for agent, marker in AGENT_MARKERS.items():
+            if marker in prompt and agent in self.recordings:
+                # Respostas do mesmo agente são usadas em rodízio
+                index = self.counters.get(agent, 0)
+                self.counters[agent] = index + 1
+                responses = self.recordings[agent]
+                return responses[index % len(responses)], prompt
+        raise KeyError("Nenhuma resposta gravada corresponde ao prompt recebido.")
+
+    @staticmethod
+    def _usage(prompt: str, text: str) -> dict:
+        input_tokens = len(prompt) // CHARS_PER_CHUNK
+        output_tokens = max(1, len(text) // CHARS_PER_CHUNK)
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _chunks(self, text: str) -> list:
+        return [text[i:i + CHARS_PER_CHUNK] for i in range(0, len(text), CHARS_PER_CHUNK)] or [""]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text, prompt = self._pick(messages)
+        time.sleep(self.latency_s + self.token_delay_s * len(self._chunks(text)))
+        message = AIMessage(content=text, usage_metadata=self._usage(prompt, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text, prompt = self._pick(messages)
+        await asyncio.sleep(self.latency_s + self.token_delay_s * len(self._chunks(text)))
+        message = AIMessage(content=text, usage_metadata=self._usage(prompt, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text, prompt = self._pick(messages)
+        time.sleep(self.latency_s)
+        for piece in self._chunks(text):
+            time.sleep(self.token_delay_s)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(prompt, text)))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        text, prompt = self._pick(messages)
+        await asyncio.sleep(self.latency_s)
+        for piece in self._chunks(text):
+            if self.token_delay_s:
+                await asyncio.sleep(self.token_delay_s)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(prompt, text)))
+
+
+class FakeSupabaseClient:
+    """Cliente Supabase em memória com latência opcional por requisição."""
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.tables = defaultdict(list)
+        self.requests = 0
+        self._clock = itertools.count()
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> "_FakeQuery":
+        return _FakeQuery(self, name)
+
+    def _timestamp(self) -> str:
+        # Timestamps estritamente crescentes para que `order("created_at")` seja determinístico
+        base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        return (base + timedelta(microseconds=next(self._clock))).isoformat()
+
+
+class _FakeQuery:
+    """Construtor de consultas encadeável (select/insert/update/delete, eq, order, limit)."""
+
+    def __init__(self, client: FakeSupabaseClient, table: str):
+        self._client = client
+        self._table = table
+        self._operation = "select"
+        self._columns = "*"
+        self._payload = None
+        self._filters = []
+        self._order = None
+        self._limit = None
+
+    def select(self, columns: str = "*"):
+        self._operation, self._columns = "select", columns
+        return self
+
+    def insert(self, payload):
+        self._operation, self._payload = "insert", payload
+        return self
+
+    def update(self, payload: dict):
+        self._operation, self._payload = "update", payload
+        return self
+
+    def delete(self):
+        self._operation = "delete"
+        return self
+
+    def eq(self, column: str, value):
+        self._filters.append((column, value))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _matches(self, row: dict) -> bool:
+        return all(row.get(column) == value for column, value in self._filters)
+
+    def execute(self):
+        if self._client.latency_s:
+            time.sleep(self._client.latency_s)
+        with self._client._lock:
+            self._client.requests += 1
+            rows = self._client.tables[self._table]
+            if self._operation == "insert":
+                payloads = self._payload if isinstance(self._payload, list) else [self._payload]
+                data = []
+                for payload in payloads:
+                    row = {"id": str(uuid.uuid4()), "created_at": self._client._timestamp(), **payload}
+                    rows.append(row)
+                    data.append(dict(row))
+                return SimpleNamespace(data=data)
+
+            matched = [row for row in rows if self._matches(row)]
+            if self._operation == "update":
+                for row in matched:
+                    row.update(self._payload)
+                return SimpleNamespace(data=[dict(row) for row in matched])
+            if self._operation == "delete":
+                self._client.tables[self._table] = [row for row in rows if not self._matches(row)]
+                return SimpleNamespace(data=[dict(row) for row in matched])
+
+            if self._order is not None:
+                column, desc = self._order
+                matched = sorted(matched, key=lambda row: row.get(column) or "", reverse=desc)
+            if self._limit is not None:
+                matched = matched[:self._limit]
+            if self._columns.strip() == "*":
+                return SimpleNamespace(data=[dict(row) for row in matched])
+            columns = [c.strip() for c in self._columns.split(",")]
+            return SimpleNamespace(data=[{c: row.get(c) for c in columns} for row in matched])
+
+
+class FakeUploadedFile:
+    """Arquivo em memória com a interface usada por `load_csv` (name, size, getvalue)."""
+
+    def __init__(self, name: str, content: bytes):
+        self.name = name
+        self._content = content
+        self.size = len(content)
+
+    def getvalue(self) -> bytes:
+        return self._content
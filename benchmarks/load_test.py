@@ -0,0 +1,305 @@
+"""
+Teste de carga do app com várias sessões simultâneas do Streamlit.
+
+Cada sessão é um `AppTest` rodando `app.py` em uma thread própria: faz o upload
+de um dataset sintético e envia perguntas roteirizadas. O LLM é o modelo falso
+de `benchmarks.fakes` (com latência configurável) e o Supabase é o cliente em
+memória, de modo que o teste roda sem rede. São medidos a latência de cada
+turno, o RSS e o número de threads do processo e a vazão em turnos por segundo.
+
+Uso:
+    python -m benchmarks.load_test --sessions 20 --questions 3
+    python -m benchmarks.load_test --sessions 50 --ramp-up 10 --latency-ms 800 --rows 100000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "load-test")
+os.environ.setdefault("SUPABASE_URL", "http://supabase.local")
+os.environ.setdefault("SUPABASE_KEY", "load-test")
+# Limites altos para que o agendador não limite a vazão do LLM falso
+os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+os.environ.setdefault("LLM_MAX_CONCURRENCY", "64")
+os.environ.setdefault("LLM_MAX_QUEUE", "10000")
+
+from unittest.mock import MagicMock
+
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+
+import utils.memory
+from agents.agent_setup import set_llm_factory
+from benchmarks.datasets import make_dataset, to_csv_bytes
+from benchmarks.fakes import FakeSupabaseClient, ReplayChatModel, load_recordings
+from utils.dataset_registry import get_registry
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+DEFAULT_QUESTIONS = (
+    "Quais são as estatísticas descritivas das variáveis numéricas?",
+    "Mostre a distribuição da primeira variável numérica em um histograma.",
+    "Quais recomendações você faria com base nos dados?",
+    "Gere o código Python da análise descritiva.",
+)
+
+
+def _percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _process_stats() -> tuple:
+    """RSS (MB) e número de threads do processo atual."""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmRSS"].split()[0]) / 1024, int(status["Threads"])
+    except (OSError, KeyError, ValueError):
+        # Fora do Linux: pico de RSS reportado pelo sistema e threads Python
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, threading.active_count()
+
+
+def _share_runtime():
+    """
+    Permite várias instâncias do AppTest em paralelo.
+
+    Cada `AppTest.run()` instala um Runtime falso global e o remove ao terminar,
+    o que quebraria as outras sessões ainda em execução. Quando não houver
+    Runtime instalado, as sessões passam a usar um Runtime falso compartilhado.
+    O bytecode do script também é compartilhado, como no servidor real: cada
+    AppTest recompilaria o `app.py` a cada execução, e `ast.parse` concorrente
+    em várias threads falha no Python 3.11.
+    """
+    shared = MagicMock(spec=Runtime)
+    shared.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance if cls._instance is not None else shared)
+
+    script_cache = ScriptCache()
+    compile_lock = threading.Lock()
+    get_bytecode = ScriptCache.get_bytecode
+
+    def _shared_bytecode(self, script_path):
+        with compile_lock:
+            return get_bytecode(script_cache, script_path)
+
+    ScriptCache.get_bytecode = _shared_bytecode
+
+
+class ResourceSampler(threading.Thread):
+    """Amostra RSS e threads do processo em intervalos fixos."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="load-test-sampler", daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        started_at = time.perf_counter()
+        while not self._stop_event.is_set():
+            rss_mb, threads = _process_stats()
+            self.samples.append({"t_s": round(time.perf_counter() - started_at, 2),
+                                 "rss_mb": round(rss_mb, 1), "threads": threads})
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class SimulatedSession:
+    """Uma sessão do navegador: upload do dataset e perguntas em sequência."""
+
+    def __init__(self, index: int, csv_bytes: bytes, questions: list, timeout: float):
+        self.index = index
+        self.csv_bytes = csv_bytes
+        self.questions = questions
+        self.timeout = timeout
+        self.app = None
+        self.upload_ms = None
+        self.turn_ms = []
+        self.errors = []
+
+    def _run(self, action) -> float:
+        started_at = time.perf_counter()
+        action().run(timeout=self.timeout)
+        elapsed = (time.perf_counter() - started_at) * 1000
+        self.errors.extend(str(e.value) for e in self.app.exception)
+        return elapsed
+
+    def run(self):
+        try:
+            self.app = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+            self.app.run()
+            self.upload_ms = self._run(lambda: self.app.file_uploader[0].set_value(
+                (f"dataset_{self.index}.csv", self.csv_bytes, "text/csv")
+            ))
+            for question in self.questions:
+                self.turn_ms.append(self._run(lambda: self.app.chat_input[0].set_value(question)))
+        except Exception as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+
+    def footprint(self) -> dict:
+        """Tamanho aproximado do estado da sessão (DataFrame, mensagens e históricos)."""
+        if self.app is None:
+            return {"df_mb": 0.0, "messages": 0, "history_chars": 0}
+        state = self.app.session_state
+        resources = state["resources"] if "resources" in state else None
+        df_bytes = resources.footprint()["df_bytes"] if resources is not None else 0
+        return {
+            "df_mb": round(df_bytes / 1024 / 1024, 2),
+            "messages": len(state["messages"]) if "messages" in state else 0,
+            "history_chars": sum(len(state[k]) for k in ("conversation_history", "all_analyses_history") if k in state),
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga com sessões simultâneas do Streamlit.")
+    parser.add_argument("--sessions", type=int, default=10, help="Número de sessões simultâneas.")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Segundos para iniciar todas as sessões.")
+    parser.add_argument("--questions", type=int, default=len(DEFAULT_QUESTIONS), help="Perguntas por sessão.")
+    parser.add_argument("--questions-file", help="Arquivo com uma pergunta por linha (substitui as padrão).")
+    parser.add_argument("--rows", type=int, default=10_000, help="Linhas do dataset enviado por sessão.")
+    parser.add_argument("--cols", type=int, default=10, help="Colunas do dataset enviado por sessão.")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latência simulada do LLM até o primeiro token.")
+    parser.add_argument("--token-delay-ms", type=float, default=0.0, help="Atraso simulado por token da resposta.")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="Latência simulada por requisição ao Supabase.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Tempo máximo de cada execução do script (s).")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Intervalo de amostragem de RSS/threads (s).")
+    parser.add_argument("--output", help="Grava o relatório completo (com as amostras) em JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Mostra a saída do app durante o teste.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.questions_file:
+        with open(args.questions_file, encoding="utf-8") as f:
+            script = [line.strip() for line in f if line.strip()]
+    else:
+        script = list(DEFAULT_QUESTIONS)
+    questions = [script[i % len(script)] for i in range(args.questions)]
+
+    # Dependências externas substituídas pelos falsos dos benchmarks
+    model = ReplayChatModel(
+        recordings=load_recordings(),
+        latency_s=args.latency_ms / 1000,
+        token_delay_s=args.token_delay_ms / 1000,
+    )
+    set_llm_factory(lambda api_key: model)
+    supabase = FakeSupabaseClient(latency_s=args.db_latency_ms / 1000)
+    utils.memory.create_client = lambda url, key: supabase
+    _share_runtime()
+
+    csv_bytes = to_csv_bytes(make_dataset(args.rows, args.cols))
+    sessions = [SimulatedSession(i, csv_bytes, questions, args.timeout) for i in range(args.sessions)]
+
+    rss_before, threads_before = _process_stats()
+    sampler = ResourceSampler(args.sample_interval)
+    sampler.start()
+    print(f"Iniciando {args.sessions} sessões ({args.questions} perguntas cada, dataset {args.rows}x{args.cols})...")
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    started_at = time.perf_counter()
+    with output:
+        workers = []
+        for session in sessions:
+            worker = threading.Thread(target=session.run, name=f"load-test-session-{session.index}")
+            worker.start()
+            workers.append(worker)
+            if args.ramp_up and args.sessions > 1:
+                time.sleep(args.ramp_up / (args.sessions - 1))
+        for worker in workers:
+            worker.join()
+    duration = time.perf_counter() - started_at
+
+    # As sessões continuam vivas (como no servidor) durante a medição final
+    rss_after, threads_after = _process_stats()
+    sampler.stop()
+
+    turn_ms = [ms for s in sessions for ms in s.turn_ms]
+    upload_ms = [s.upload_ms for s in sessions if s.upload_ms is not None]
+    errors = [f"sessão {s.index}: {e}" for s in sessions for e in s.errors]
+    footprints = [s.footprint() for s in sessions]
+    report = {
+        "sessions": args.sessions,
+        "questions_per_session": args.questions,
+        "dataset": {"rows": args.rows, "cols": args.cols, "csv_mb": round(len(csv_bytes) / 1024 / 1024, 2)},
+        "llm_latency_ms": args.latency_ms,
+        "duration_s": round(duration, 2),
+        "turns": len(turn_ms),
+        "throughput_turns_per_s": round(len(turn_ms) / duration, 3) if duration else 0.0,
+        "turn_latency_ms": {
+            "p50": round(_percentile(turn_ms, 0.5), 1),
+            "p95": round(_percentile(turn_ms, 0.95), 1),
+            "p99": round(_percentile(turn_ms, 0.99), 1),
+            "max": round(max(turn_ms), 1) if turn_ms else 0.0,
+        },
+        "upload_latency_ms": {
+            "p50": round(_percentile(upload_ms, 0.5), 1),
+            "p95": round(_percentile(upload_ms, 0.95), 1),
+        },
+        "rss_mb": {
+            "before": round(rss_before, 1),
+            "peak": max((s["rss_mb"] for s in sampler.samples), default=round(rss_after, 1)),
+            "after": round(rss_after, 1),
+            "per_session": round((rss_after - rss_before) / args.sessions, 2) if args.sessions else 0.0,
+        },
+        "threads": {
+            "before": threads_before,
+            "peak": max((s["threads"] for s in sampler.samples), default=threads_after),
+            "after": threads_after,
+        },
+        "session_state": {
+            "df_mb_total": round(sum(f["df_mb"] for f in footprints), 2),
+            # Sessões com o mesmo arquivo compartilham o DataFrame: memória efetiva dos datasets
+            "shared_datasets_mb": round(get_registry().memory_bytes() / 1024 / 1024, 2),
+            "messages_total": sum(f["messages"] for f in footprints),
+            "history_chars_total": sum(f["history_chars"] for f in footprints),
+        },
+        "errors": errors,
+    }
+
+    print(f"Duração: {report['duration_s']} s — {report['turns']} turnos "
+          f"({report['throughput_turns_per_s']} turnos/s)")
+    latency = report["turn_latency_ms"]
+    print(f"Latência por turno: p50={latency['p50']} ms  p95={latency['p95']} ms  "
+          f"p99={latency['p99']} ms  máx={latency['max']} ms")
+    print(f"Upload: p50={report['upload_latency_ms']['p50']} ms  p95={report['upload_latency_ms']['p95']} ms")
+    rss = report["rss_mb"]
+    print(f"RSS: {rss['before']} MB → pico {rss['peak']} MB → {rss['after']} MB "
+          f"(≈ {rss['per_session']} MB por sessão)")
+    print(f"Threads: {report['threads']['before']} → pico {report['threads']['peak']}")
+    print(f"Estado das sessões: {report['session_state']['df_mb_total']} MB em DataFrames "
+          f"({report['session_state']['shared_datasets_mb']} MB após deduplicação), "
+          f"{report['session_state']['messages_total']} mensagens")
+    if errors:
+        print(f"❌ {len(errors)} erro(s):")
+        for line in errors[:10]:
+            print(f"  {line}")
+
+    if args.output:
+        report["samples"] = sampler.samples
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    set_llm_factory(None)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""
+Benchmark offline do pipeline de agentes.
+
+Executa os agentes, o gerador de sugestões, o carregamento do CSV (em memória
+ou, acima do limite, convertido para Parquet fora da memória), a extração
+de metadados e a execução de gráficos contra um LLM falso (respostas gravadas
+com latência configurável) e um Supabase em memória, em datasets sintéticos de
+tamanhos variados. Reporta percentis de latência e pico de memória por caso e
+compara com um baseline gravado.
+
+Uso:
+    python -m benchmarks.run_benchmarks                  # grade rápida
+    python -m benchmarks.run_benchmarks --full           # 1k a 10M linhas, 5 a 500 colunas
+    python -m benchmarks.run_benchmarks --save-baseline  # grava o baseline atual
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tomllib
+import tracemalloc
+
+# Limites altos para que o agendador não limite a vazão do LLM falso
+os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+os.environ.setdefault("LLM_MAX_CONCURRENCY", "64")
+os.environ.setdefault("LLM_MAX_QUEUE", "10000")
+# Parquets dos carregamentos fora da memória em um diretório próprio, apagado ao final
+BENCHMARK_CACHE_DIR = tempfile.mkdtemp(prefix="insightagent_benchmark_")
+os.environ.setdefault("INSIGHTAGENT_SESSION_CACHE_DIR", BENCHMARK_CACHE_DIR)
+
+from agents.agent_setup import get_dataset_preview, set_llm_factory
+from agents.coordinator import run_coordinator
+from agents.data_analyst import run_data_analyst
+from agents.visualization import run_visualization
+from agents.consultant import run_consultant
+from agents.code_generator import run_code_generator
+from agents.sql_generator import render_sql_code, run_sql_generator
+from agents.orchestrator import arun_turn
+from benchmarks.datasets import estimate_csv_bytes, make_dataset, to_csv_bytes
+from benchmarks.fakes import FakeSupabaseClient, FakeUploadedFile, ReplayChatModel, load_recordings
+from components.suggestion_generator import generate_dynamic_suggestions
+from utils import chart_cache
+from utils.aggregate_cube import get_cube, get_cube_registry
+from utils.async_runtime import run_sync
+from utils.chart_cache import exec_with_cache
+from utils.chart_templates import match_template
+from utils.data_loader import (compute_file_hash, get_dataset_info, load_csv_out_of_core, load_dataframe,
+                               parquet_path_for)
+from utils.dataset_registry import DATASET_HASH_ATTR
+from utils.memory import SupabaseMemory
+from utils.query_engine import is_available
+
+QUICK_ROWS = (1_000, 100_000)
+QUICK_COLS = (5, 50)
+FULL_ROWS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+FULL_COLS = (5, 50, 500)
+
+# Combinações acima deste número de células são ignoradas (≈ 400 MB em float64)
+DEFAULT_MAX_CELLS = 50_000_000
+# Configuração do Streamlit do app, com o limite do upload (`server.maxUploadSize`)
+STREAMLIT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".streamlit", "config.toml")
+DEFAULT_MAX_UPLOAD_MB = 200
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Diferenças abaixo destes valores são tratadas como ruído
+MIN_LATENCY_DELTA_MS = 10.0
+MIN_MEMORY_DELTA_MB = 1.0
+
+API_KEY = "benchmark"
+HISTORY = (
+    "Usuário: Quais são as estatísticas descritivas?\n"
+    "Assistente: As variáveis numéricas têm média próxima de zero e desvio padrão próximo de 1.\n"
+)
+QUESTION = "Mostre a distribuição da primeira variável numérica em um histograma."
+CHART_CODE = (
+    "import plotly.express as px\n"
+    "num_col = df.select_dtypes(include='number').columns[0]\n"
+    "fig = px.histogram(df, x=num_col, nbins=30)\n"
+)
+
+
+SQL_CHART_CODE = render_sql_code({
+    "sql": "SELECT FLOOR(num_0 * 4) / 4 AS faixa, COUNT(*) AS frequencia FROM df GROUP BY faixa ORDER BY faixa",
+    "chart": {"type": "bar", "x": "faixa", "y": "frequencia", "color": None, "title": "Distribuição de num_0"},
+})
+
+
+def _percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure(func, repeat: int, warmup: int = 1, setup=None) -> dict:
+    """Mede a latência de `func` em `repeat` execuções e o pico de memória em uma execução extra."""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        func()
+
+    durations = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        started_at = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started_at) * 1000)
+
+    # O tracemalloc deixa a execução mais lenta, por isso o pico é medido à parte
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "runs": repeat,
+        "p50_ms": round(_percentile(durations, 0.5), 3),
+        "p95_ms": round(_percentile(durations, 0.95), 3),
+        "max_ms": round(max(durations), 3),
+        "peak_mb": round(peak / 1024 / 1024, 3),
+    }
+
+
+def max_upload_mb() -> int:
+    """Limite do upload no app, lido do `.streamlit/config.toml` (ou o padrão do Streamlit)."""
+    try:
+        with open(STREAMLIT_CONFIG_PATH, "rb") as f:
+            return int(tomllib.load(f).get("server", {}).get("maxUploadSize", DEFAULT_MAX_UPLOAD_MB))
+    except (OSError, ValueError) as e:
+        print(f"Configuração do Streamlit não lida ({e}); usando o limite padrão de {DEFAULT_MAX_UPLOAD_MB} MB")
+        return DEFAULT_MAX_UPLOAD_MB
+
+
+def _remove_parquet(file_hash: str):
+    """Apaga o Parquet do arquivo para que a conversão seja medida a cada execução."""
+    path = parquet_path_for(file_hash)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def build_cases(df, memory: SupabaseMemory) -> list:
+    """Casos medidos para um dataset: (nome, função, setup)."""
+    # Como os datasets do registro: o hash do arquivo identifica os dados no cache de gráficos e no cubo
+    df.attrs[DATASET_HASH_ATTR] = f"benchmark-{len(df)}x{df.shape[1]}"
+    info = get_dataset_info(df, "benchmark.csv")
+    preview = get_dataset_preview(df)
+    session_id = memory.create_session("benchmark.csv", "benchmark", "benchmark-user")
+
+    cases = []
+    csv_bytes_estimate = estimate_csv_bytes(df)
+    upload_limit_mb = max_upload_mb()
+    if csv_bytes_estimate <= upload_limit_mb * 1024 * 1024:
+        uploaded = FakeUploadedFile("benchmark.csv", to_csv_bytes(df))
+        file_hash = compute_file_hash(uploaded)
+        # O mesmo caminho do app: em memória ou, acima de `out_of_core_threshold_mb`, Parquet + DuckDB
+        cases.append(("load_dataframe", lambda: load_dataframe(uploaded, file_hash),
+                      lambda: _remove_parquet(file_hash)))
+        if is_available():
+            # Conversão para Parquet e amostra em todos os tamanhos, para comparar com o carregamento em memória
+            cases.append(("load_csv_out_of_core", lambda: load_csv_out_of_core(uploaded, file_hash),
+                          lambda: _remove_parquet(file_hash)))
+        else:
+            print("  load_csv_out_of_core ignorado: DuckDB não instalado")
+    else:
+        print(f"  load_dataframe ignorado: CSV estimado em {csv_bytes_estimate / 1024 / 1024:.0f} MB "
+              f"(limite do upload {upload_limit_mb} MB)")
+
+    breakdown = next(c for c in df.columns if c.startswith("cat_"))
+    measure = df.select_dtypes(include="number").columns[0]
+
+    cases += [
+        ("get_dataset_info", lambda: get_dataset_info(df, "benchmark.csv"), None),
+        ("run_coordinator", lambda: run_coordinator(API_KEY, df, HISTORY, QUESTION), None),
+        ("run_data_analyst", lambda: run_data_analyst(API_KEY, df, HISTORY, "Calcule as estatísticas descritivas."), None),
+        ("run_visualization", lambda: run_visualization(API_KEY, df, HISTORY, QUESTION), None),
+        ("run_consultant", lambda: run_consultant(API_KEY, df, HISTORY, "Quais recomendações você faria?"), None),
+        ("run_code_generator", lambda: run_code_generator(API_KEY, str(info), f"Pergunta do usuário: {QUESTION}"), None),
+        ("run_sql_generator", lambda: run_sql_generator(API_KEY, df, HISTORY, QUESTION), None),
+        ("exec_sql_plan", lambda: exec_with_cache(SQL_CHART_CODE, df), chart_cache._cache.clear),
+        ("generate_dynamic_suggestions", lambda: generate_dynamic_suggestions(API_KEY, preview, HISTORY), None),
+        ("exec_with_cache (miss)", lambda: exec_with_cache(CHART_CODE, df), chart_cache._cache.clear),
+        ("exec_with_cache (hit)", lambda: exec_with_cache(CHART_CODE, df), None),
+        # Modelo local (sem LLM): histograma da primeira coluna numérica
+        ("chart_template", lambda: exec_with_cache(match_template(
+            f"Mostre a distribuição de {df.select_dtypes(include='number').columns[0]} em um histograma", df
+        )["code"], df), chart_cache._cache.clear),
+        # Cubo de agregações: montagem (1-D) e consulta de um corte já materializado
+        ("cube_build", lambda: get_cube(df), lambda: get_cube_registry()._cubes.pop(df.attrs[DATASET_HASH_ATTR], None)),
+        ("cube_lookup", lambda: get_cube(df).aggregate(df, [breakdown], measure, "mean"), None),
+        ("arun_turn", lambda: run_sync(arun_turn(
+            API_KEY, df, info, HISTORY, HISTORY, QUESTION, memory=memory, session_id=session_id
+        )), None),
+    ]
+    return cases
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Casos cuja latência (p50) ou pico de memória pioraram além da tolerância."""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        for metric, min_delta in (("p50_ms", MIN_LATENCY_DELTA_MS), ("peak_mb", MIN_MEMORY_DELTA_MB)):
+            before, after = previous[metric], current[metric]
+            if after > before * (1 + tolerance) and after - before > min_delta:
+                regressions.append(f"{key}: {metric} {before} -> {after} (+{(after / before - 1) * 100 if before else 100:.0f}%)")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline do pipeline de agentes.")
+    parser.add_argument("--full", action="store_true", help="Grade completa: 1k a 10M linhas e 5 a 500 colunas.")
+    parser.add_argument("--rows", type=int, nargs="+", help="Números de linhas a medir.")
+    parser.add_argument("--cols", type=int, nargs="+", help="Números de colunas a medir.")
+    parser.add_argument("--repeat", type=int, default=5, help="Execuções medidas por caso.")
+    parser.add_argument("--max-cells", type=int, default=DEFAULT_MAX_CELLS,
+                        help="Ignora datasets com mais células que este limite.")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latência simulada do LLM até o primeiro token.")
+    parser.add_argument("--token-delay-ms", type=float, default=0.0, help="Atraso simulado por token da resposta.")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="Latência simulada por requisição ao Supabase.")
+    parser.add_argument("--only", nargs="+", help="Mede apenas os casos com estes nomes.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Arquivo de baseline para comparação.")
+    parser.add_argument("--save-baseline", action="store_true", help="Grava os resultados como novo baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Piora relativa tolerada (0.2 = 20%%).")
+    parser.add_argument("--output", help="Grava os resultados completos em JSON neste arquivo.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    rows_grid = args.rows or (FULL_ROWS if args.full else QUICK_ROWS)
+    cols_grid = args.cols or (FULL_COLS if args.full else QUICK_COLS)
+
+    model = ReplayChatModel(
+        recordings=load_recordings(),
+        latency_s=args.latency_ms / 1000,
+        token_delay_s=args.token_delay_ms / 1000,
+    )
+    set_llm_factory(lambda api_key: model)
+    memory = SupabaseMemory(url=None, key=None, client=FakeSupabaseClient(latency_s=args.db_latency_ms / 1000))
+
+    results = {}
+    try:
+        for rows in rows_grid:
+            for cols in cols_grid:
+                if rows * cols > args.max_cells:
+                    print(f"[{rows}x{cols}] ignorado: {rows * cols:,} células excedem --max-cells")
+                    continue
+                print(f"[{rows}x{cols}] gerando dataset...")
+                df = make_dataset(rows, cols)
+                for name, func, setup in build_cases(df, memory):
+                    if args.only and name not in args.only:
+                        continue
+                    stats = measure(func, args.repeat, setup=setup)
+                    results[f"{name}@{rows}x{cols}"] = stats
+                    print(f"  {name:<30} p50={stats['p50_ms']:>10.2f} ms  p95={stats['p95_ms']:>10.2f} ms  "
+                          f"pico={stats['peak_mb']:>9.2f} MB")
+                del df
+                gc.collect()
+    finally:
+        set_llm_factory(None)
+        shutil.rmtree(BENCHMARK_CACHE_DIR, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_ms": args.latency_ms,
+            "token_delay_ms": args.token_delay_ms,
+            "repeat": args.repeat,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    exit_code = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regressão(ões) em relação ao baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            exit_code = 1
+        else:
+            print("\n✅ Nenhuma regressão em relação ao baseline.")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline gravado em {args.baseline}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
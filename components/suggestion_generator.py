@@ -1,7 +1,9 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from agents.agent_setup import get_llm
-import json
+from agents.agent_setup import get_llm, ainvoke_chain
+from utils.llm_scheduler import PRIORITY_SUGGESTION
+from utils.async_runtime import run_sync
+from utils.json_output import JSONOutputError, parse_json_object
 
 SUGGESTION_PROMPT_TEMPLATE = """
 Você é um assistente que gera sugestões de perguntas inteligentes e relevantes para análise de dados.
@@ -51,16 +53,23 @@ Analise o histórico da conversa e o contexto do dataset para gerar 3 sugestões
 - "Gere um relatório completo das análises realizadas"
 """
 
+# Esquema da resposta, usado no modo JSON do provedor
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {"suggestions": {"type": "array", "items": {"type": "string"}}},
+    "required": ["suggestions"],
+}
+
 def get_suggestion_generator(api_key: str):
     """Cria o agente gerador de sugestões."""
-    llm = get_llm(api_key)
+    llm = get_llm(api_key, response_schema=RESPONSE_SCHEMA)
     prompt = ChatPromptTemplate.from_template(SUGGESTION_PROMPT_TEMPLATE)
     chain = prompt | llm | StrOutputParser()
     return chain
 
-def generate_dynamic_suggestions(api_key: str, dataset_preview: str, conversation_history: str) -> list:
+async def agenerate_dynamic_suggestions(api_key: str, dataset_preview: str, conversation_history: str) -> list:
     """
-    Gera sugestões dinâmicas baseadas no contexto da conversa.
+    Gera sugestões dinâmicas baseadas no contexto da conversa (versão assíncrona).
 
     Args:
         api_key: Chave da API do Google
@@ -73,21 +82,15 @@ def generate_dynamic_suggestions(api_key: str, dataset_preview: str, conversatio
     try:
         agent = get_suggestion_generator(api_key)
 
-        response = agent.invoke({
+        response = await ainvoke_chain(agent, {
             "dataset_preview": dataset_preview,
             "conversation_history": conversation_history
-        })
-
-        # Limpar a resposta para extrair JSON
-        if "```json" in response:
-            response = response.split("```json")[1].split("```")[0].strip()
-        elif "```" in response:
-            response = response.replace("```", "").strip()
+        }, agent="SuggestionGenerator", priority=PRIORITY_SUGGESTION)
 
-        # Tentar fazer parse do JSON
-        suggestions_data = json.loads(response)
+        # Ler o JSON (com reparo local se a resposta vier malformada)
+        suggestions_data = parse_json_object(response, "SuggestionGenerator")
 
-        suggestions = suggestions_data.get("suggestions", [])
+        suggestions = [str(s) for s in suggestions_data.get("suggestions") or [] if str(s).strip()]
 
         # Garantir que temos exatamente 3 sugestões
         if len(suggestions) < 3:
@@ -103,7 +106,7 @@ def generate_dynamic_suggestions(api_key: str, dataset_preview: str, conversatio
 
         return suggestions[:3]
 
-    except json.JSONDecodeError as e:
+    except JSONOutputError as e:
         print(f"Erro ao decodificar JSON das sugestões: {e}")
         print(f"Resposta bruta recebida: {response}")
         return get_fallback_suggestions()[:3]
@@ -113,6 +116,10 @@ def generate_dynamic_suggestions(api_key: str, dataset_preview: str, conversatio
         print(f"Erro ao gerar sugestões dinâmicas: {e}")
         return get_fallback_suggestions()[:3]
 
+def generate_dynamic_suggestions(api_key: str, dataset_preview: str, conversation_history: str) -> list:
+    """Gera sugestões dinâmicas no loop compartilhado e aguarda o resultado."""
+    return run_sync(agenerate_dynamic_suggestions(api_key, dataset_preview, conversation_history))
+
 def extract_conversation_context(conversation_history: str) -> dict:
     """
     Extrai informações contextuais do histórico da conversa.
@@ -3,6 +3,7 @@ import pandas as pd
 import time
 import hashlib
 from datetime import datetime, timezone, timedelta
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 
 
@@ -72,63 +73,82 @@ def build_horizontal_menu(memory, user_id):
     return uploaded_file
 
 
+def rerun_fragment():
+    """Reexecuta apenas o fragmento atual; se a execução for do script completo, reexecuta o app."""
+    ctx = get_script_run_ctx()
+    # O Streamlit só aceita scope="fragment" durante a reexecução parcial de um fragmento
+    st.rerun(scope="fragment" if ctx is not None and ctx.fragment_ids_this_run else "app")
+
+
 def build_sidebar(memory, user_id):
-    """Constrói a sidebar do aplicativo (mantido para compatibilidade)."""
+    """Constrói a sidebar do aplicativo e retorna a lista de arquivos enviados."""
     with st.sidebar:
         st.header("Análise EDA com IA")
 
         # Key única baseada no user_id para manter consistência
         unique_key = f"file_uploader_{user_id}"
 
-        uploaded_file = st.file_uploader(
-            "Faça o upload do seu arquivo CSV",
+        # Vários arquivos viram várias tabelas, que podem ser combinadas com sql() (joins)
+        uploaded_files = st.file_uploader(
+            "Faça o upload dos seus arquivos CSV (um ou mais)",
             type=["csv"],
-            accept_multiple_files=False,
+            accept_multiple_files=True,
             key=unique_key
         )
 
         st.subheader("Histórico de Sessões")
-        sessions = memory.get_user_sessions(user_id)
-        if sessions:
-            for session in sessions:
-                try:
-                    # Converte a string de data/hora para um objeto datetime com timezone UTC
-                    # O formato esperado é algo como '2025-09-26T22:26:00.000000+00:00'
-                    created_at_str = session['created_at']
-                    
-                    # Verifica se já tem timezone (deve ter vindo do Supabase com +00:00)
-                    if 'Z' in created_at_str or '+00:00' in created_at_str:
-                        # Se já tiver timezone UTC, converte para objeto datetime com timezone
-                        created_at = datetime.fromisoformat(created_at_str.replace('Z', '+00:00'))
-                        # Converte para o fuso horário local do sistema
-                        local_time = created_at.astimezone()
-                        # Obtém o offset local formatado (ex: -03:00)
-                        offset = local_time.strftime('%z')
-                        offset_str = f"UTC{offset[:3]}:{offset[3:5]}"
-                    else:
-                        # Se não tiver timezone, assume UTC e converte para local
-                        created_at = datetime.fromisoformat(created_at_str).replace(tzinfo=timezone.utc)
-                        local_time = created_at.astimezone()
-                        offset = local_time.strftime('%z')
-                        offset_str = f"UTC{offset[:3]}:{offset[3:5]}"
-                    
-                    st.info(
-                        f"ID: ...{session['id'][-6:]}\n"
-                        f"Dataset: {session['dataset_name']}\n"
-                        f"Data: {local_time.strftime('%d/%m/%Y %H:%M')} ({offset_str})"
-                    )
-                except Exception as e:
-                    st.error(f"Erro ao exibir sessão: {e}")
-        else:
-            st.write("Nenhuma sessão anterior encontrada.")
+        build_session_history(memory, user_id)
 
         st.subheader("Configurações")
         st.info("Configurações futuras aqui.")
-    return uploaded_file
+    return uploaded_files or []
 
 
-def display_chat_message(role, content, chart_fig=None, key=None, generated_code=None):
-    """Exibe uma mensagem no chat."""
+@st.fragment
+def build_session_history(memory, user_id):
+    """Lista as sessões anteriores do usuário (fragmento: não é reconsultada nas interações do chat)."""
+    sessions = memory.get_user_sessions(user_id)
+    if sessions:
+        for session in sessions:
+            try:
+                # Converte a string de data/hora para um objeto datetime com timezone UTC
+                # O formato esperado é algo como '2025-09-26T22:26:00.000000+00:00'
+                created_at_str = session['created_at']
+                
+                # Verifica se já tem timezone (deve ter vindo do Supabase com +00:00)
+                if 'Z' in created_at_str or '+00:00' in created_at_str:
+                    # Se já tiver timezone UTC, converte para objeto datetime com timezone
+                    created_at = datetime.fromisoformat(created_at_str.replace('Z', '+00:00'))
+                    # Converte para o fuso horário local do sistema
+                    local_time = created_at.astimezone()
+                    # Obtém o offset local formatado (ex: -03:00)
+                    offset = local_time.strftime('%z')
+                    offset_str = f"UTC{offset[:3]}:{offset[3:5]}"
+                else:
+                    # Se não tiver timezone, assume UTC e converte para local
+                    created_at = datetime.fromisoformat(created_at_str).replace(tzinfo=timezone.utc)
+                    local_time = created_at.astimezone()
+                    offset = local_time.strftime('%z')
+                    offset_str = f"UTC{offset[:3]}:{offset[3:5]}"
+                
+                st.info(
+                    f"ID: ...{session['id'][-6:]}\n"
+                    f"Dataset: {session['dataset_name']}\n"
+                    f"Data: {local_time.strftime('%d/%m/%Y %H:%M')} ({offset_str})"
+                )
+            except Exception as e:
+                st.error(f"Erro ao exibir sessão: {e}")
+    else:
+        st.write("Nenhuma sessão anterior encontrada.")
+
+
+def display_chat_message(role, content, chart_fig=None, key=None, generated_code=None, chart_valid=None):
+    """
+    Exibe uma mensagem no chat.
+
+    `chart_valid` é a validade do gráfico já conhecida (calculada ao guardar a
+    figura); com None, o gráfico é serializado para verificar.
+    """
     execution_container = None
     results_container = None
 
@@ -147,7 +167,7 @@ def display_chat_message(role, content, chart_fig=None, key=None, generated_code
         if chart_fig and role == "assistant":
             try:
                 # Verificar se o gráfico ainda é válido
-                if _is_chart_valid(chart_fig):
+                if chart_valid if chart_valid is not None else _is_chart_valid(chart_fig):
                     # Gera uma chave única se não foi fornecida
                     if key is None:
                         content_hash = hashlib.md5(f"{role}_{content}_{str(chart_fig)}".encode()).hexdigest()[:8]
@@ -166,6 +186,37 @@ def display_chat_message(role, content, chart_fig=None, key=None, generated_code
     return execution_container, results_container
 
 
+def _show_older_messages(window: int):
+    st.session_state.chat_history_extra = st.session_state.get("chat_history_extra", 0) + window
+
+
+def display_chat_history(messages: list, resources, window: int):
+    """
+    Exibe as últimas `window` mensagens do chat; as anteriores ficam recolhidas.
+
+    Cada clique em "mostrar anteriores" carrega mais `window` mensagens. As
+    figuras só são obtidas (e recarregadas do disco) para as mensagens exibidas,
+    e a chave e a validade de cada gráfico vêm do id guardado na mensagem, sem
+    serializar a figura a cada execução.
+    """
+    visible = window + st.session_state.get("chat_history_extra", 0)
+    hidden = max(0, len(messages) - visible)
+    if hidden:
+        st.button(f"⬆️ Mostrar mensagens anteriores ({hidden} ocultas)", key="show_older_messages",
+                  on_click=_show_older_messages, args=(window,))
+
+    for message in messages[hidden:]:
+        chart_id = message.get("chart_id")
+        display_chat_message(
+            message["role"],
+            message["content"],
+            resources.get_figure(chart_id),
+            key=f"chart_{chart_id}" if chart_id else None,
+            generated_code=message.get("generated_code"),
+            chart_valid=resources.figure_is_valid(chart_id) if chart_id else None,
+        )
+
+
 def _is_chart_valid(chart_fig):
     """Verifica se um gráfico Plotly é válido e pode ser exibido."""
     try:
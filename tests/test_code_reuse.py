@@ -0,0 +1,42 @@
+"""Reaproveitamento de códigos entre sessões sem expor valores do dataset de origem."""
+import pandas as pd
+
+from utils.code_reuse import CodeReuseIndex
+
+# Novo dataset, de outro usuário
+NEW_DF = pd.DataFrame({"preco": [10.0, 12.5, 9.9], "loja": ["centro", "norte", "sul"]})
+
+
+def test_cross_session_code_with_literal_filter_is_not_reused():
+    index = CodeReuseIndex()
+    # Código lido do Supabase (sem o dataset de origem) com um valor de filtro de outro usuário
+    code = "fig = px.histogram(df[df['cliente'] == 'ACME'], x='valor', color='cliente')"
+
+    assert not index.add("histograma de valor por cliente", code)
+    assert index.match("histograma de preco por loja", NEW_DF) is None
+
+
+def test_cross_session_code_is_adapted_and_foreign_titles_are_masked():
+    index = CodeReuseIndex()
+    code = ("fig = px.histogram(df, x='valor', color='cliente', title='Valores da ACME em 2023', "
+            "labels={'valor': 'Valor faturado ACME'})")
+
+    assert index.add("histograma de valor por cliente", code)
+    match = index.match("histograma de preco por loja", NEW_DF)
+
+    assert match is not None
+    assert match["mapping"] == {"valor": "preco", "cliente": "loja"}
+    assert "ACME" not in match["code"] and "2023" not in match["code"]
+    assert "x='preco'" in match["code"] and "color='loja'" in match["code"]
+    assert "title='histograma de preco por loja'" in match["code"]
+    assert "labels={'preco': 'preco'}" in match["code"]
+
+
+def test_titles_made_of_columns_and_question_words_are_kept():
+    index = CodeReuseIndex()
+    code = "fig = px.histogram(df, x='valor', color='cliente', title='Distribuição de valor por cliente')"
+
+    assert index.add("histograma de valor por cliente", code)
+    match = index.match("histograma de preco por loja", NEW_DF)
+
+    assert "title='Distribuição de preco por loja'" in match["code"]
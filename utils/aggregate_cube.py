@@ -0,0 +1,595 @@
+"""
+Cubo de agregações materializado para perguntas de quebra por categoria.
+
+Perguntas como "compare as vendas por região e mês" viravam, a cada vez, um
+groupby sobre o DataFrame completo. O cubo é montado uma vez por dataset (hash
+do arquivo) a partir das dimensões de baixa cardinalidade (colunas
+categóricas, numéricas em faixas e datas por mês ou ano) e guarda, por grupo,
+contagem, soma, soma dos quadrados, mínimo e máximo de cada coluna numérica.
+
+- Os cortes de uma dimensão são materializados na montagem; combinações de
+  duas dimensões só quando pedidas pela primeira vez (e descartadas primeiro
+  quando o orçamento `cube_memory_mb` é ultrapassado).
+- Quartis e mediana vêm de um esboço (histograma por grupo, com faixas de
+  igual frequência por coluna), calculado sob demanda: os valores são
+  aproximados.
+- O código dos gráficos usa `cube(dimensões, measure=..., agg=...)`,
+  disponível no escopo de execução como `sql()`, e `match_cube_question`
+  monta gráficos de barras e box plots de perguntas de quebra sem o LLM
+  (pedidos de outros tipos de gráfico e de medianas exatas seguem o caminho
+  normal).
+"""
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.chart_templates import (CATEGORICAL, NUMERIC, PRIMARY_COLOR, aggregation_for, column_kind, find_mentions,
+                                   named_chart_types, normalize_text)
+from utils.config import get_config
+from utils.dataset_registry import dataset_hash
+from utils.query_engine import out_of_core_info
+from utils.telemetry import record_cache
+from utils.tracing import start_span
+
+# Cardinalidade máxima de uma coluna categórica (ou inteira) usada como dimensão
+MAX_DIMENSION_CARDINALITY = 50
+# Inteiros com até este número de valores viram categorias; acima, faixas
+MAX_DISCRETE_VALUES = 12
+# Faixas de igual largura das colunas numéricas usadas como dimensão
+NUMERIC_BINS = 10
+# Datas que cobrem mais meses que este valor são agrupadas por ano
+MAX_MONTHS = 36
+MAX_DIMENSIONS = 30
+MAX_MEASURES = 30
+# Dimensões por consulta (cortes de uma e de duas dimensões)
+MAX_QUERY_DIMENSIONS = 2
+# Faixas do esboço usado nos quartis
+SKETCH_BINS = 128
+# Hashes de cubos acima do orçamento lembrados pelo registro
+MAX_OVERSIZED_HASHES = 1024
+
+MONTH = "month"
+YEAR = "year"
+BINS = "bins"
+_GRAIN_SUFFIXES = (MONTH, YEAR)
+
+AGGREGATIONS = ("count", "sum", "mean", "median", "min", "max", "std", "quartiles")
+
+_BREAKDOWN_PATTERN = re.compile(r"\b(por|compar\w*|quebra|segmentad\w*|cada)\b")
+_BOX_PATTERN = re.compile(r"\b(box ?plot|boxplot|caixa|quartis|quartil)\b")
+_MONTH_PATTERN = re.compile(r"\b(mes|meses|mensal|mensais)\b")
+_YEAR_PATTERN = re.compile(r"\b(ano|anos|anual|anuais)\b")
+
+
+def _small_codes(codes: np.ndarray) -> np.ndarray:
+    return codes.astype(np.int8 if codes.max(initial=0) < 127 else np.int16 if codes.max(initial=0) < 32767
+                        else np.int32)
+
+
+class CubeDimension:
+    """Dimensão do cubo: código do grupo de cada linha (-1 para ausente) e rótulos dos grupos."""
+
+    def __init__(self, name: str, column, grain: str | None, codes: np.ndarray, labels: list):
+        self.name = name
+        self.column = column
+        self.grain = grain
+        self.codes = _small_codes(codes)
+        self.labels = labels
+
+    @property
+    def size(self) -> int:
+        return len(self.labels)
+
+
+def _factorized(name, series: pd.Series) -> CubeDimension:
+    codes, uniques = pd.factorize(series, sort=True)
+    return CubeDimension(str(name), name, None, codes, list(uniques))
+
+
+def _binned(name, series: pd.Series) -> CubeDimension | None:
+    values = series.to_numpy(dtype="float64", na_value=np.nan)
+    low, high = np.nanmin(values), np.nanmax(values)
+    if not np.isfinite(low) or not np.isfinite(high) or low == high:
+        return None
+    edges = np.linspace(low, high, NUMERIC_BINS + 1)
+    missing = np.isnan(values)
+    scaled = (np.where(missing, low, values) - low) / (high - low) * NUMERIC_BINS
+    codes = np.clip(scaled.astype("int64"), 0, NUMERIC_BINS - 1)
+    codes[missing] = -1
+    labels = [f"{edges[i]:.4g} – {edges[i + 1]:.4g}" for i in range(NUMERIC_BINS)]
+    return CubeDimension(str(name), name, BINS, codes, labels)
+
+
+def _dated(name, series: pd.Series, grain: str) -> CubeDimension:
+    periods = series.dt.to_period("M" if grain == MONTH else "Y")
+    codes, uniques = pd.factorize(periods, sort=True)
+    return CubeDimension(f"{name}:{grain}", name, grain, codes, [str(p) for p in uniques])
+
+
+def build_dimensions(df: pd.DataFrame) -> list:
+    """Dimensões do dataset: categorias de baixa cardinalidade, números em faixas e datas por mês e ano."""
+    dimensions = []
+    for column in df.columns:
+        if len(dimensions) >= MAX_DIMENSIONS:
+            break
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            if series.notna().any():
+                dimensions += [_dated(column, series, MONTH), _dated(column, series, YEAR)]
+            continue
+        kind = column_kind(series)
+        unique = series.nunique(dropna=True)
+        if unique < 2:
+            continue
+        if kind == CATEGORICAL and unique <= MAX_DIMENSION_CARDINALITY:
+            dimensions.append(_factorized(column, series))
+        elif kind == NUMERIC:
+            discrete = pd.api.types.is_integer_dtype(series) and unique <= MAX_DISCRETE_VALUES
+            dimension = _factorized(column, series) if discrete else _binned(column, series)
+            if dimension is not None:
+                dimensions.append(dimension)
+    return dimensions
+
+
+def _measure_columns(df: pd.DataFrame) -> list:
+    return [c for c in df.columns
+            if column_kind(df[c]) == NUMERIC and not pd.api.types.is_bool_dtype(df[c])][:MAX_MEASURES]
+
+
+class _Cuboid:
+    """Corte do cubo para um conjunto de dimensões: estatísticas por grupo não vazio."""
+
+    def __init__(self, dimensions: tuple, keys: np.ndarray, rows: np.ndarray, stats: dict):
+        self.dimensions = dimensions  # CubeDimension, na ordem da chave
+        self.keys = keys              # chave do grupo (índice na grade das dimensões)
+        self.rows = rows              # linhas por grupo
+        self.stats = stats            # medida -> {estatística -> array}
+        self.sketches = {}            # medida -> (bordas, contagens por grupo e faixa)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.keys, self.rows] + [a for s in self.stats.values() for a in s.values()]
+        arrays += [counts for _, counts in self.sketches.values()]
+        return int(sum(a.nbytes for a in arrays))
+
+    def labels(self) -> dict:
+        positions = np.unravel_index(self.keys, [d.size for d in self.dimensions])
+        return {d: np.asarray(d.labels, dtype=object)[p] for d, p in zip(self.dimensions, positions)}
+
+
+def _group_keys(dimensions: tuple) -> tuple:
+    """Chave de cada linha na grade das dimensões e a máscara das linhas sem dimensão ausente."""
+    key = np.zeros(len(dimensions[0].codes), dtype=np.int64)
+    valid = np.ones(len(key), dtype=bool)
+    for dimension in dimensions:
+        key = key * dimension.size + dimension.codes
+        valid &= dimension.codes >= 0
+    return key, valid
+
+
+class AggregateCube:
+    """Cubo de um dataset: dimensões, medidas e cortes materializados."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.rows = int(df.shape[0])
+        self.columns = list(df.columns)
+        self.dimensions = {d.name: d for d in build_dimensions(df)}
+        self.measures = _measure_columns(df)
+        self._base = {}              # cortes de uma dimensão (materializados na montagem)
+        self._lazy = OrderedDict()   # combinações materializadas sob demanda (LRU)
+        self._lock = threading.RLock()
+        self.stats = {"lookups": 0, "lazy_builds": 0, "evictions": 0}
+        for dimension in self.dimensions.values():
+            self._base[(dimension.name,)] = self._materialize(df, (dimension,))
+
+    @property
+    def nbytes(self) -> int:
+        codes = sum(d.codes.nbytes for d in self.dimensions.values())
+        return codes + sum(c.nbytes for c in self._base.values()) + self.lazy_bytes
+
+    @property
+    def lazy_bytes(self) -> int:
+        return sum(c.nbytes for c in self._lazy.values())
+
+    def dimension(self, name: str) -> CubeDimension:
+        """Dimensão pelo nome: a coluna ou, para datas, `coluna:month`/`coluna:year` (só a coluna: mês)."""
+        if name in self.dimensions:
+            return self.dimensions[name]
+        if f"{name}:{MONTH}" in self.dimensions:
+            return self.dimensions[f"{name}:{MONTH}"]
+        raise KeyError(f"Dimensão não disponível no cubo: {name!r}")
+
+    def _materialize(self, df: pd.DataFrame, dimensions: tuple) -> _Cuboid:
+        key, valid = _group_keys(dimensions)
+        key = key[valid]
+        keys, groups = np.unique(key, return_inverse=True)
+        count = len(keys)
+        rows = np.bincount(groups, minlength=count)
+        stats = {}
+        for measure in self.measures:
+            values = df[measure].to_numpy(dtype="float64", na_value=np.nan)[valid]
+            present = ~np.isnan(values)
+            grouped = groups[present]
+            values = values[present]
+            minimum = np.full(count, np.inf)
+            maximum = np.full(count, -np.inf)
+            np.minimum.at(minimum, grouped, values)
+            np.maximum.at(maximum, grouped, values)
+            stats[measure] = {
+                "count": np.bincount(grouped, minlength=count),
+                "sum": np.bincount(grouped, weights=values, minlength=count),
+                "sumsq": np.bincount(grouped, weights=values * values, minlength=count),
+                "min": minimum,
+                "max": maximum,
+            }
+        return _Cuboid(dimensions, keys, rows, stats)
+
+    def _cuboid(self, df: pd.DataFrame, dimensions: tuple) -> _Cuboid:
+        """Corte das dimensões (em ordem canônica), materializado na primeira consulta se preciso."""
+        signature = tuple(sorted(d.name for d in dimensions))
+        with self._lock:
+            self.stats["lookups"] += 1
+            cuboid = self._base.get(signature) or self._lazy.get(signature)
+            if cuboid is not None:
+                if signature in self._lazy:
+                    self._lazy.move_to_end(signature)
+                record_cache("cube", hit=True)
+                return cuboid
+            record_cache("cube", hit=False)
+            if df is None or df.shape[0] != self.rows:
+                raise ValueError("O corte pedido não está materializado e o dataset original não está disponível.")
+            with start_span("cube_materialize", dimensions=len(dimensions)):
+                cuboid = self._materialize(df, tuple(self.dimensions[name] for name in signature))
+            self._lazy[signature] = cuboid
+            self.stats["lazy_builds"] += 1
+        get_cube_registry().enforce_budget(current=self)
+        return cuboid
+
+    def evict_lazy(self) -> int:
+        """Descarta a combinação usada há mais tempo; retorna os bytes liberados."""
+        with self._lock:
+            if not self._lazy:
+                return 0
+            _, cuboid = self._lazy.popitem(last=False)
+            self.stats["evictions"] += 1
+            return cuboid.nbytes
+
+    def _sketch(self, df: pd.DataFrame, cuboid: _Cuboid, measure: str) -> tuple:
+        """Histograma da medida por grupo, com as mesmas faixas para todos os grupos."""
+        with self._lock:
+            if measure in cuboid.sketches:
+                return cuboid.sketches[measure]
+            if df is None or df.shape[0] != self.rows:
+                raise ValueError("Os quartis precisam do dataset original.")
+            key, valid = _group_keys(cuboid.dimensions)
+            values = df[measure].to_numpy(dtype="float64", na_value=np.nan)
+            valid &= ~np.isnan(values)
+            groups = np.searchsorted(cuboid.keys, key[valid])
+            values = values[valid]
+            # Faixas de igual frequência no dataset inteiro: distribuições assimétricas continuam precisas
+            edges = np.unique(np.quantile(values, np.linspace(0, 1, SKETCH_BINS + 1))) if len(values) \
+                else np.array([0.0, 1.0])
+            if len(edges) < 2:
+                edges = np.array([edges[0], edges[0]])
+            bins = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, len(edges) - 2)
+            width = len(edges) - 1
+            counts = np.bincount(groups * width + bins, minlength=len(cuboid.keys) * width)
+            sketch = (edges, counts.reshape(len(cuboid.keys), width).astype(np.int32))
+            cuboid.sketches[measure] = sketch
+        get_cube_registry().enforce_budget(current=self)
+        return sketch
+
+    def _quantiles(self, df, cuboid: _Cuboid, measure: str, qs: tuple) -> dict:
+        edges, counts = self._sketch(df, cuboid, measure)
+        widths = np.diff(edges)
+        cumulative = counts.cumsum(axis=1)
+        total = cumulative[:, -1]
+        stats = cuboid.stats[measure]
+        result = {}
+        for q in qs:
+            target = q * total
+            index = (cumulative >= target[:, None]).argmax(axis=1)
+            before = np.where(index > 0, cumulative[np.arange(len(index)), index - 1], 0)
+            in_bin = counts[np.arange(len(index)), index]
+            fraction = np.divide(target - before, in_bin, out=np.zeros(len(index)), where=in_bin > 0)
+            value = edges[index] + fraction * widths[index]
+            # O valor aproximado não sai do intervalo observado no grupo
+            result[q] = np.where(total > 0, np.clip(value, stats["min"], stats["max"]), np.nan)
+        return result
+
+    def aggregate(self, df: pd.DataFrame | None, dimensions: list, measure: str | None = None,
+                  agg: str = "count") -> pd.DataFrame:
+        """
+        Resultado agregado por grupo, com uma coluna por dimensão.
+
+        `agg="count"` sem medida conta as linhas (coluna `contagem`); com a
+        medida, a coluna do valor tem o nome da medida. `agg="quartiles"`
+        devolve as colunas min, q1, median, q3 e max; medianas e quartis são
+        aproximados (esboço), as demais agregações são exatas.
+        """
+        if isinstance(dimensions, str):
+            dimensions = [dimensions]
+        if not 1 <= len(dimensions) <= MAX_QUERY_DIMENSIONS:
+            raise ValueError(f"Use de 1 a {MAX_QUERY_DIMENSIONS} dimensões no cubo.")
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Agregação não suportada pelo cubo: {agg!r} (use {', '.join(AGGREGATIONS)})")
+        if measure is not None and measure not in self.measures:
+            raise KeyError(f"Medida não disponível no cubo: {measure!r}")
+        if measure is None and agg != "count":
+            raise ValueError(f"A agregação {agg!r} precisa de uma medida.")
+        requested = [self.dimension(name) for name in dimensions]
+        cuboid = self._cuboid(df, tuple(requested))
+        labels = cuboid.labels()
+        result = pd.DataFrame({str(d.column): labels[d] for d in requested})
+
+        if measure is None:
+            result["contagem"] = cuboid.rows
+            return result
+        stats = cuboid.stats[measure]
+        count = stats["count"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = stats["sum"] / count
+            if agg == "count":
+                result[measure] = count
+            elif agg == "sum":
+                result[measure] = stats["sum"]
+            elif agg == "mean":
+                result[measure] = mean
+            elif agg == "std":
+                variance = (stats["sumsq"] - count * mean * mean) / (count - 1)
+                result[measure] = np.sqrt(np.clip(variance, 0, None))
+            elif agg in ("min", "max"):
+                result[measure] = stats[agg]
+            elif agg == "median":
+                result[measure] = self._quantiles(df, cuboid, measure, (0.5,))[0.5]
+            else:
+                quartiles = self._quantiles(df, cuboid, measure, (0.25, 0.5, 0.75))
+                result["min"], result["q1"], result["median"] = stats["min"], quartiles[0.25], quartiles[0.5]
+                result["q3"], result["max"], result["count"] = quartiles[0.75], stats["max"], count
+        return result[count > 0].reset_index(drop=True)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"rows": self.rows, "dimensions": len(self.dimensions), "measures": len(self.measures),
+                    "base_cuboids": len(self._base), "lazy_cuboids": len(self._lazy),
+                    "mb": round(self.nbytes / 1024 / 1024, 2), **self.stats}
+
+
+class CubeRegistry:
+    """Cubos do processo por hash do dataset, com orçamento de memória (`cube_memory_mb`)."""
+
+    def __init__(self):
+        self._cubes = OrderedDict()
+        self._building = {}  # hash -> lock da montagem (duas sessões não montam o mesmo cubo)
+        self._oversized = OrderedDict()  # hash -> bytes dos cubos que não couberam (não são montados de novo)
+        self._lock = threading.Lock()
+        self.stats = {"built": 0, "skipped_budget": 0, "evicted_cubes": 0}
+
+    def get(self, df: pd.DataFrame, key: str | None = None, build: bool = True) -> AggregateCube | None:
+        """Cubo do dataset, montado na primeira chamada; None se o dataset não tiver hash ou não couber."""
+        if not get_config()["cube_enabled"] or df is None or out_of_core_info(df) is not None:
+            return None
+        key = key or dataset_hash(df)
+        if key is None:
+            return None
+        with self._lock:
+            cube = self._cubes.get(key)
+            if cube is not None:
+                self._cubes.move_to_end(key)
+                return cube
+            if not build or self._oversized.get(key, 0) > self.budget_bytes:
+                return None
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                cube = self._cubes.get(key)
+                oversized = self._oversized.get(key, 0) > self.budget_bytes
+            if cube is not None or oversized:
+                return cube
+            try:
+                with start_span("cube_build", rows=int(df.shape[0]), cols=int(df.shape[1])) as span:
+                    cube = AggregateCube(df)
+                    span.set_attributes(dimensions=len(cube.dimensions), measures=len(cube.measures),
+                                        bytes=cube.nbytes)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+            with self._lock:
+                if cube.nbytes > self.budget_bytes:
+                    # Lembrado pelo hash: só volta a ser montado se o orçamento aumentar
+                    self._oversized[key] = cube.nbytes
+                    while len(self._oversized) > MAX_OVERSIZED_HASHES:
+                        self._oversized.popitem(last=False)
+                    self.stats["skipped_budget"] += 1
+                    print(f"Cubo de agregações não montado: {cube.nbytes / 1024 / 1024:.1f} MB acima do orçamento")
+                    return None
+                self._cubes[key] = cube
+                self.stats["built"] += 1
+        self.enforce_budget(current=cube)
+        return cube
+
+    @property
+    def budget_bytes(self) -> int:
+        return get_config()["cube_memory_mb"] * 1024 * 1024
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            cubes = list(self._cubes.values())
+        return sum(cube.nbytes for cube in cubes)
+
+    def enforce_budget(self, current: AggregateCube | None = None):
+        """
+        Acima do orçamento, descarta primeiro as combinações sob demanda (dos
+        cubos usados há mais tempo) e, depois, cubos inteiros, preservando o atual.
+        """
+        total = self.memory_bytes()
+        with self._lock:
+            cubes = list(self._cubes.items())
+        for _, cube in cubes:
+            while total > self.budget_bytes and cube.lazy_bytes and cube is not current:
+                total -= cube.evict_lazy()
+        while total > self.budget_bytes and current is not None and current.lazy_bytes > 0 \
+                and len(current._lazy) > 1:
+            total -= current.evict_lazy()
+        for key, cube in cubes:
+            if total <= self.budget_bytes:
+                break
+            if cube is current:
+                continue
+            with self._lock:
+                if self._cubes.pop(key, None) is not None:
+                    total -= cube.nbytes
+                    self.stats["evicted_cubes"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            cubes = {key[:8]: cube for key, cube in self._cubes.items()}
+        return {"cubes": len(cubes), "mb": round(sum(c.nbytes for c in cubes.values()) / 1024 / 1024, 2),
+                "budget_mb": get_config()["cube_memory_mb"], "oversized": len(self._oversized), **self.stats,
+                "datasets": {key: cube.metrics() for key, cube in cubes.items()}}
+
+
+_registry = CubeRegistry()
+
+
+def get_cube_registry() -> CubeRegistry:
+    """Registro único de cubos do processo."""
+    return _registry
+
+
+def get_cube(df: pd.DataFrame, key: str | None = None, build: bool = True) -> AggregateCube | None:
+    return _registry.get(df, key=key, build=build)
+
+
+def make_cube_function(df: pd.DataFrame):
+    """
+    Função `cube(dimensões, measure=None, agg="count")` para o escopo de execução do código gerado.
+
+    O cubo só é procurado (ou montado) na primeira chamada.
+    """
+    def cube(dimensions, measure: str | None = None, agg: str = "count") -> pd.DataFrame:
+        aggregate_cube = get_cube(df)
+        if aggregate_cube is None:
+            raise RuntimeError("Cubo de agregações indisponível para este dataset.")
+        return aggregate_cube.aggregate(df, dimensions, measure=measure, agg=agg)
+
+    return cube
+
+
+def _dimension_for(cube: AggregateCube, column, text: str) -> str | None:
+    """Nome da dimensão da coluna citada, com a granularidade pedida para datas."""
+    name = str(column)
+    if name in cube.dimensions:
+        return name
+    if f"{name}:{MONTH}" not in cube.dimensions:
+        return None
+    if _YEAR_PATTERN.search(text) and not _MONTH_PATTERN.search(text):
+        return f"{name}:{YEAR}"
+    if _MONTH_PATTERN.search(text):
+        return f"{name}:{MONTH}"
+    months = cube.dimensions[f"{name}:{MONTH}"].size
+    return f"{name}:{MONTH}" if months <= MAX_MONTHS else f"{name}:{YEAR}"
+
+
+def is_cube_question(question: str, df: pd.DataFrame) -> bool:
+    """
+    Verificações só do texto (sem o cubo): pedido de quebra "por", sem outro
+    tipo de gráfico além de barras e box plot e sem barra de mediana exata.
+    """
+    if not question:
+        return False
+    text = normalize_text(question)
+    if re.search(r"\bpor\b", text) is None or not _BREAKDOWN_PATTERN.search(text):
+        return False
+    if named_chart_types(question, [str(c) for c in df.columns]) - {"bar", "box"}:
+        # Pizza, linha, histograma...: o cubo só desenha barras e box plots
+        return False
+    box = _BOX_PATTERN.search(text) is not None
+    # A mediana do cubo é aproximada; a barra de mediana exata vem do modelo de barras
+    return box or aggregation_for(text)[0] != "median"
+
+
+def match_cube_question(question: str, df: pd.DataFrame, cube: AggregateCube) -> dict | None:
+    """
+    Gráfico de quebra servido pelo cubo: {"code", "dimensions", "measure", "agg", "chart"}, ou None.
+
+    A medida é a coluna numérica citada antes de "por" e as dimensões, as
+    colunas citadas depois (até duas; "por mês"/"por ano" usa a coluna de data).
+    """
+    if cube is None or not is_cube_question(question, df):
+        return None
+    text = normalize_text(question)
+    split = re.search(r"\bpor\b", text)
+    before, after = text[:split.start()], text[split.end():]
+
+    columns = [c for c in df.columns if str(c) in cube.dimensions or f"{c}:{MONTH}" in cube.dimensions]
+    dimensions = []
+    for column in find_mentions(after, columns):
+        name = _dimension_for(cube, column, after)
+        if name is not None and name not in dimensions:
+            dimensions.append(name)
+    dated = [d for d in cube.dimensions.values() if d.grain in _GRAIN_SUFFIXES]
+    date_columns = list(dict.fromkeys(d.column for d in dated))
+    if len(date_columns) == 1 and not any(n.startswith(f"{date_columns[0]}:") for n in dimensions):
+        grain = YEAR if _YEAR_PATTERN.search(after) else MONTH if _MONTH_PATTERN.search(after) else None
+        if grain is not None:
+            dimensions.append(f"{date_columns[0]}:{grain}")
+    if not 1 <= len(dimensions) <= MAX_QUERY_DIMENSIONS:
+        return None
+
+    measures = find_mentions(before, [c for c in cube.measures])
+    measure = measures[0] if measures else None
+    box = _BOX_PATTERN.search(text) is not None
+    if box and (measure is None or len(dimensions) != 1):
+        return None
+    func, label = aggregation_for(text, default=("mean", "Média") if measure is not None else ("count", "Contagem"))
+    if measure is None:
+        func, label = "count", "Contagem"
+    agg = "quartiles" if box else func
+    code = _render_code(cube, dimensions, measure, agg, label)
+    return {"code": code, "dimensions": dimensions, "measure": measure, "agg": agg,
+            "chart": "box" if box else "bar"}
+
+
+_GRAIN_LABELS = {MONTH: "mês", YEAR: "ano"}
+
+
+def _dimension_label(dimension: CubeDimension) -> str:
+    grain = _GRAIN_LABELS.get(dimension.grain)
+    return f"{dimension.column} ({grain})" if grain else str(dimension.column)
+
+
+def _render_code(cube: AggregateCube, dimensions: list, measure, agg: str, label: str) -> str:
+    columns = [str(cube.dimensions[name].column) for name in dimensions]
+    titles = [_dimension_label(cube.dimensions[name]) for name in dimensions]
+    # Datas no eixo x e a outra dimensão nas cores
+    order = sorted(range(len(dimensions)), key=lambda i: cube.dimensions[dimensions[i]].grain not in _GRAIN_SUFFIXES)
+    x, x_title = columns[order[0]], titles[order[0]]
+    color = columns[order[1]] if len(columns) > 1 else None
+    lookup = f"result = cube({dimensions!r}" + (f", measure={measure!r}, agg={agg!r})" if measure is not None else ")")
+    header = ["import plotly.express as px", "import plotly.graph_objects as go", ""] if agg == "quartiles" \
+        else ["import plotly.express as px", ""]
+
+    if agg == "quartiles":
+        title = f"Distribuição de {measure} por {x_title} (quartis aproximados)"
+        return "\n".join(header + [
+            "# Quartis aproximados do cubo de agregações (sem percorrer o dataset)",
+            lookup,
+            f"fig = go.Figure(go.Box(x=result[{x!r}], lowerfence=result['min'], q1=result['q1'], "
+            f"median=result['median'], q3=result['q3'], upperfence=result['max'], name={measure!r}, "
+            f"marker_color={PRIMARY_COLOR!r}))",
+            f"fig.update_layout(title={title!r}, xaxis_title={x_title!r}, yaxis_title={measure!r}, template='plotly_white')",
+        ])
+
+    value = measure if measure is not None else "contagem"
+    title = (f"{label} de {measure}" if measure is not None else label) + " por " + " e ".join(titles)
+    arguments = f", color={color!r}, barmode='group'" if color else f", color_discrete_sequence=[{PRIMARY_COLOR!r}]"
+    return "\n".join(header + [
+        "# Agregação servida pelo cubo pré-calculado (sem groupby sobre o dataset completo)",
+        lookup,
+        f"fig = px.bar(result, x={x!r}, y={value!r}{arguments}, title={title!r})",
+        "fig.update_layout(template='plotly_white')",
+    ])
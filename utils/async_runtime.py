@@ -0,0 +1,70 @@
+"""
+Loop asyncio compartilhado pelo processo.
+
+As sessões do Streamlit submetem corrotinas a um único loop que roda em uma
+thread dedicada e aguardam o resultado via `concurrent.futures.Future`. Chamadas
+bloqueantes (Supabase, pandas pesado) são despachadas para um pool de threads
+limitado, de modo que o número de threads não cresce com o número de sessões.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Número máximo de threads para chamadas bloqueantes (I/O síncrono)
+MAX_IO_THREADS = 8
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_thread: threading.Thread | None = None
+_io_executor: ThreadPoolExecutor | None = None
+_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Retorna o loop compartilhado, iniciando a thread dedicada na primeira chamada."""
+    global _loop, _loop_thread, _io_executor
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _io_executor = ThreadPoolExecutor(max_workers=MAX_IO_THREADS, thread_name_prefix="insightagent-io")
+            _loop.set_default_executor(_io_executor)
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="insightagent-loop", daemon=True)
+            _loop_thread.start()
+    return _loop
+
+
+def submit(coro) -> Future:
+    """Agenda a corrotina no loop compartilhado e retorna um Future thread-safe."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_sync(coro, timeout: float | None = None):
+    """Submete a corrotina ao loop compartilhado e bloqueia até o resultado."""
+    if threading.current_thread() is _loop_thread:
+        # Bloquear a própria thread do loop causaria deadlock
+        coro.close()
+        raise RuntimeError("run_sync não pode ser chamado de dentro do loop compartilhado; use await.")
+    return submit(coro).result(timeout)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Executa uma função síncrona no pool de I/O limitado sem bloquear o loop."""
+    loop = asyncio.get_running_loop()
+    # Propaga o contexto (sessão, span atual) para a thread do pool
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args, **kwargs))
+
+
+def shutdown():
+    """Encerra o loop compartilhado e o pool de threads de I/O."""
+    global _loop, _loop_thread, _io_executor
+    with _lock:
+        if _loop is not None and not _loop.is_closed():
+            _loop.call_soon_threadsafe(_loop.stop)
+            if _loop_thread is not None:
+                _loop_thread.join(timeout=5)
+            _loop.close()
+        if _io_executor is not None:
+            _io_executor.shutdown(wait=False)
+        _loop, _loop_thread, _io_executor = None, None, None
@@ -1,25 +1,84 @@
 """
 Cache simples para gráficos.
+
+A chave combina a impressão digital do código com a identidade dos dados (o
+hash do arquivo de cada tabela, além do esquema): códigos iguais sobre arquivos
+diferentes nunca compartilham a figura. DataFrames que não vieram do registro
+de datasets não têm hash e são executados sem cache.
 """
 import hashlib
-import time
+import threading
+from collections import OrderedDict
+
+import plotly.express as px
 import plotly.graph_objects as go
+from utils.aggregate_cube import make_cube_function
+from utils.code_analysis import CodeValidationError, analyze_code
+from utils.dataset_registry import dataset_hash
+from utils.query_engine import make_sql_function, sql_tables
+from utils.telemetry import record_cache
+from utils.tracing import start_span
+
+# Figuras guardadas (LRU; as usadas há mais tempo saem primeiro)
+MAX_CACHED_FIGURES = 256
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def exec_with_cache(code, df, tables=None):
+    """
+    Executa o código do gráfico e retorna `fig` (ou None), reaproveitando figuras já geradas.
+
+    O código é analisado antes da execução: erros de sintaxe, colunas
+    inexistentes e chamadas proibidas levantam CodeValidationError sem executar
+    nada. Erros da execução também são propagados.
+    """
+    with start_span("exec_code", code_length=len(code or ""), tables=len(tables or {})) as span:
+        if hasattr(df, "shape"):
+            span.set_attributes(dataset_rows=int(df.shape[0]), dataset_cols=int(df.shape[1]))
+        analysis = analyze_code(code)
+        try:
+            analysis.validate(df, tables)
+        except CodeValidationError as e:
+            span.set_attribute("static_error", str(e)[:200])
+            raise
+        fig = _exec_with_cache(analysis.executable_code, df, span, tables, analysis.fingerprint)
+        span.set_attribute("figure_created", fig is not None)
+        return fig
+
+
+def _cache_key(code, df, tables=None, fingerprint=None) -> str | None:
+    """Chave pela impressão digital do código e pelo hash e esquema de cada tabela; None se faltar um hash."""
+    identities = [(None, df)] + list((tables or {}).items())
+    signature = []
+    for name, table in identities:
+        file_hash = dataset_hash(table)
+        if file_hash is None or not hasattr(table, "columns"):
+            return None
+        signature.append((name, file_hash, table.shape, [str(c) for c in table.columns]))
+    return hashlib.md5(f"{fingerprint or code}_{signature}".encode()).hexdigest()
+
+
+def _exec_with_cache(code, df, span, tables=None, fingerprint=None):
+    key = _cache_key(code, df, tables, fingerprint)
+    if key is not None:
+        with _cache_lock:
+            fig = _cache.get(key)
+            if fig is not None:
+                _cache.move_to_end(key)
+        span.set_attribute("cache_hit", fig is not None)
+        record_cache("chart", hit=fig is not None)
+        if fig is not None:
+            return fig
 
-_cache = {}
-
-def exec_with_cache(code, df):
-    # Criar chave mais robusta incluindo o código e as dimensões do DataFrame
-    key = hashlib.md5(f"{code}_{df.shape}_{str(df.columns.tolist())}".encode()).hexdigest()
-    if key in _cache:
-        return _cache[key]
-
-    try:
-        local_scope = {"df": df, "go": go, "px": __import__('plotly.express')}
-        exec(code, local_scope)
-        if 'fig' in local_scope:
-            _cache[key] = local_scope['fig']
-            return local_scope['fig']
-    except Exception as e:
-        print(f"Erro na execução do código em cache: {e}")
-        pass
-    return None
+    # Erros da execução chegam a quem chamou, que pode pedir a correção do código
+    local_scope = {"df": df, "go": go, "px": px, "tables": tables or {},
+                   "sql": make_sql_function(sql_tables(df, tables)), "cube": make_cube_function(df)}
+    exec(code, local_scope)
+    fig = local_scope.get("fig")
+    if fig is not None and key is not None:
+        with _cache_lock:
+            _cache[key] = fig
+            while len(_cache) > MAX_CACHED_FIGURES:
+                _cache.popitem(last=False)
+    return fig
@@ -0,0 +1,298 @@
+"""
+Modelos de gráficos parametrizados, montados sem chamar o LLM.
+
+Os pedidos mais comuns (histograma, dispersão com linha de tendência, heatmap
+de correlação, box plot por categoria e barras agregadas) são resolvidos
+localmente: palavras-chave da pergunta escolhem o modelo e as colunas citadas
+preenchem os parâmetros tipados (coluna numérica ou categórica, número de
+faixas, agregação). O código montado é exibido e executado como o do agente
+de visualização, com operações vetorizadas do pandas/NumPy; pedidos que não
+se encaixam em nenhum modelo (ou que citam um tipo de gráfico que os modelos
+não desenham, como pizza ou linha) seguem para o LLM.
+"""
+import re
+import unicodedata
+
+import pandas as pd
+
+NUMERIC = "numeric"
+CATEGORICAL = "categorical"
+
+PRIMARY_COLOR = "#6C5CE7"
+TREND_COLOR = "#E17055"
+DEFAULT_BINS = 30
+# Categorias exibidas nas barras agregadas
+MAX_BAR_CATEGORIES = 50
+
+_BINS_PATTERN = re.compile(r"\b(\d{1,3})\s*(faixas|bins|intervalos|classes|barras)\b")
+# Agregações das barras: palavra-chave normalizada -> (função do pandas, rótulo)
+_AGGREGATIONS = (
+    (re.compile(r"\b(media|medio|medios|medias)\b"), "mean", "Média"),
+    (re.compile(r"\bmediana\b"), "median", "Mediana"),
+    (re.compile(r"\b(soma|total|totais|somatorio)\b"), "sum", "Soma"),
+    (re.compile(r"\b(maximo|maior|maiores)\b"), "max", "Máximo"),
+    (re.compile(r"\b(minimo|menor|menores)\b"), "min", "Mínimo"),
+    (re.compile(r"\b(contagem|quantidade|quantos|quantas|numero de|frequencia)\b"), "count", "Contagem"),
+)
+
+# Tipos de gráfico citados pelo nome na pergunta normalizada
+_CHART_TYPES = (
+    ("bar", re.compile(r"\b(barras?|bar chart)\b")),
+    ("box", re.compile(r"\b(box ?plot|boxplot|caixa)\b")),
+    ("histogram", re.compile(r"\b(histograma|histogram)\b")),
+    ("scatter", re.compile(r"\b(dispersao|scatter)\b")),
+    ("heatmap", re.compile(r"\b(heatmap|mapa de calor)\b")),
+    ("pie", re.compile(r"\b(pizza|pie|rosca|donut)\b")),
+    ("line", re.compile(r"\b(linhas?|line|serie temporal)\b(?! de tendencia)")),
+    ("area", re.compile(r"\b(graficos? de areas?|area chart)\b")),
+    ("violin", re.compile(r"\b(violin|violino)\b")),
+    ("stacked", re.compile(r"\b(empilhad\w*|stacked)\b")),
+    ("map", re.compile(r"\b(mapa|map)\b(?! de calor)")),
+    ("treemap", re.compile(r"\b(treemap|sunburst)\b")),
+    ("funnel", re.compile(r"\b(funil|funnel)\b")),
+    ("radar", re.compile(r"\bradar\b")),
+    ("bubble", re.compile(r"\b(bolhas?|bubble)\b")),
+    ("waterfall", re.compile(r"\b(cascata|waterfall)\b")),
+    ("sankey", re.compile(r"\bsankey\b")),
+    ("3d", re.compile(r"\b3d\b")),
+)
+# Tipos que os modelos sabem desenhar; pedidos que citam outros seguem para o LLM
+TEMPLATE_CHART_TYPES = frozenset({"bar", "box", "histogram", "scatter", "heatmap"})
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sem acentos e com pontuação e `_` como espaço, para comparar a pergunta com os nomes das colunas."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def column_kind(series: pd.Series) -> str | None:
+    """Tipo do parâmetro que a coluna pode preencher (datas e outros tipos ficam de fora)."""
+    if pd.api.types.is_bool_dtype(series):
+        return CATEGORICAL
+    if pd.api.types.is_numeric_dtype(series):
+        return NUMERIC
+    if isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_object_dtype(series) \
+            or pd.api.types.is_string_dtype(series):
+        return CATEGORICAL
+    return None
+
+
+def find_mentions(question: str, names) -> list:
+    """Nomes (de colunas) citados na pergunta, na ordem em que aparecem."""
+    text = f" {normalize_text(question)} "
+    found = []
+    # Nomes mais longos primeiro: "valor total" não deve ser lido também como "valor"
+    for name in sorted(names, key=lambda c: -len(str(c))):
+        normalized = normalize_text(name)
+        if not normalized:
+            continue
+        for match in re.finditer(rf"(?<=\s){re.escape(normalized)}s?(?=\s)", text):
+            if not any(match.start() < end and start < match.end() for start, end, _ in found):
+                found.append((match.start(), match.end(), name))
+                break
+    return [name for _, _, name in sorted(found, key=lambda item: item[0])]
+
+
+def named_chart_types(question: str, columns=()) -> set:
+    """Tipos de gráfico citados pelo nome na pergunta (nomes de colunas citadas não contam)."""
+    text = f" {normalize_text(question)} "
+    for column in sorted(columns, key=lambda c: -len(str(c))):
+        name = normalize_text(column)
+        if name:
+            text = re.sub(rf"(?<=\s){re.escape(name)}s?(?=\s)", " ", text)
+    return {name for name, pattern in _CHART_TYPES if pattern.search(text)}
+
+
+def mentioned_columns(question: str, df: pd.DataFrame) -> list:
+    """Colunas citadas na pergunta, na ordem em que aparecem: [(coluna, tipo)]."""
+    kinds = {column: column_kind(df[column]) for column in df.columns}
+    return [(column, kinds[column])
+            for column in find_mentions(question, [c for c, kind in kinds.items() if kind is not None])]
+
+
+class TemplateParam:
+    """Parâmetro de coluna de um modelo: nome, tipo aceito e se é obrigatório."""
+
+    def __init__(self, name: str, kind: str, required: bool = True):
+        self.name = name
+        self.kind = kind
+        self.required = required
+
+
+class ChartTemplate:
+    """Modelo de gráfico: padrão da pergunta, parâmetros de coluna e função que monta o código."""
+
+    def __init__(self, name: str, pattern: str, params: tuple, render, accepts=None):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.params = params
+        self.render = render
+        self.accepts = accepts
+
+    def bind(self, columns: list) -> dict | None:
+        """Preenche os parâmetros com as colunas citadas, na ordem; None se faltar um obrigatório."""
+        available = list(columns)
+        bound = {}
+        for param in self.params:
+            column = next((c for c, kind in available if kind == param.kind), None)
+            if column is None and param.required:
+                return None
+            bound[param.name] = column
+            available = [(c, kind) for c, kind in available if c != column]
+        return bound
+
+
+def _code(lines: list) -> str:
+    return "\n".join(lines)
+
+
+def _arguments(**kwargs) -> str:
+    return "".join(f", {name}={value!r}" for name, value in kwargs.items() if value is not None)
+
+
+def _render_histogram(df, p: dict, options: dict) -> str:
+    title = f"Distribuição de {p['x']}" + (f" por {p['color']}" if p["color"] else "")
+    colors = None if p["color"] else [PRIMARY_COLOR]
+    return _code([
+        "import plotly.express as px",
+        "",
+        f"# Modelo \"histograma\": distribuição de {p['x']}",
+        f"fig = px.histogram(df, x={p['x']!r}{_arguments(color=p['color'], nbins=options['bins'], title=title, color_discrete_sequence=colors)})",
+        "fig.update_layout(bargap=0.1, template='plotly_white')",
+    ])
+
+
+def _render_scatter(df, p: dict, options: dict) -> str:
+    x, y = p["x"], p["y"]
+    colors = None if p["color"] else [PRIMARY_COLOR]
+    return _code([
+        "import numpy as np",
+        "import plotly.express as px",
+        "import plotly.graph_objects as go",
+        "",
+        f"# Modelo \"dispersão\": relação entre {x} e {y}",
+        f"fig = px.scatter(df, x={x!r}, y={y!r}{_arguments(color=p['color'], title=f'Relação entre {x} e {y}', color_discrete_sequence=colors)}, opacity=0.7)",
+        "",
+        "# Linha de tendência (mínimos quadrados, vetorizada com NumPy)",
+        f"valid = df[[{x!r}, {y!r}]].dropna()",
+        "if len(valid) > 1:",
+        f"    slope, intercept = np.polyfit(valid[{x!r}], valid[{y!r}], 1)",
+        f"    xs = np.array([valid[{x!r}].min(), valid[{x!r}].max()])",
+        f"    fig.add_trace(go.Scatter(x=xs, y=slope * xs + intercept, mode='lines', name='Tendência', "
+        f"line={{'color': {TREND_COLOR!r}}}))",
+        "fig.update_layout(template='plotly_white')",
+    ])
+
+
+def _render_heatmap(df, p: dict, options: dict) -> str:
+    numeric = [c for c, kind in options["columns"] if kind == NUMERIC]
+    selection = f"df[{numeric!r}]" if len(numeric) >= 2 else "df.select_dtypes(include='number')"
+    return _code([
+        "import plotly.express as px",
+        "",
+        "# Modelo \"heatmap de correlação\"",
+        f"corr_matrix = {selection}.corr()",
+        "fig = px.imshow(corr_matrix, text_auto='.2f', aspect='auto', color_continuous_scale='RdBu_r', "
+        "zmin=-1, zmax=1, title='Matriz de Correlação entre Variáveis Numéricas')",
+    ])
+
+
+def _render_box(df, p: dict, options: dict) -> str:
+    title = f"Distribuição de {p['y']}" + (f" por {p['x']}" if p["x"] else "")
+    colors = None if p["x"] else [PRIMARY_COLOR]
+    return _code([
+        "import plotly.express as px",
+        "",
+        f"# Modelo \"box plot\": {title.lower()}",
+        f"fig = px.box(df, y={p['y']!r}{_arguments(x=p['x'], color=p['x'], title=title, color_discrete_sequence=colors)})",
+        "fig.update_layout(showlegend=False, template='plotly_white')",
+    ])
+
+
+def _render_bar(df, p: dict, options: dict) -> str:
+    x, y = p["x"], p["y"]
+    func, label = options["aggregation"]
+    if y is None or func == "count":
+        value, label = "contagem", "Contagem"
+        aggregate = f"result = df[{x!r}].value_counts().head({MAX_BAR_CATEGORIES}).rename_axis({x!r}).reset_index(name='contagem')"
+        title = f"Contagem por {x}"
+    else:
+        value = y
+        aggregate = (f"result = df.groupby({x!r}, observed=True)[{y!r}].{func}().reset_index()"
+                     f".sort_values({y!r}, ascending=False).head({MAX_BAR_CATEGORIES})")
+        title = f"{label} de {y} por {x}"
+    return _code([
+        "import plotly.express as px",
+        "",
+        f"# Modelo \"barras\": {title.lower()} (agregação vetorizada no pandas)",
+        aggregate,
+        f"fig = px.bar(result, x={x!r}, y={value!r}, title={title!r}, color_discrete_sequence=[{PRIMARY_COLOR!r}])",
+        "fig.update_layout(template='plotly_white')",
+    ])
+
+
+def _heatmap_accepts(question: str, df, columns: list) -> bool:
+    numeric_in_df = sum(column_kind(df[c]) == NUMERIC for c in df.columns)
+    mentioned = sum(kind == NUMERIC for _, kind in columns)
+    # "correlação entre a e b" com duas colunas fica melhor como dispersão, salvo pedido explícito de heatmap
+    explicit = re.search(r"\b(heatmap|mapa de calor|matriz)\b", question) is not None
+    return numeric_in_df >= 2 and (explicit or mentioned != 2)
+
+
+# Em ordem de prioridade: o primeiro modelo cujo padrão e parâmetros se aplicam é usado
+TEMPLATES = (
+    ChartTemplate("heatmap", r"\b(heatmap|mapa de calor|matriz|correlac\w*)\b", (), _render_heatmap,
+                  accepts=_heatmap_accepts),
+    ChartTemplate("scatter", r"\b(dispersao|scatter|relacao entre|versus|vs|correlac\w*)\b",
+                  (TemplateParam("x", NUMERIC), TemplateParam("y", NUMERIC), TemplateParam("color", CATEGORICAL, False)),
+                  _render_scatter),
+    ChartTemplate("histogram", r"\b(histograma|distribuicao|frequencia)\b",
+                  (TemplateParam("x", NUMERIC), TemplateParam("color", CATEGORICAL, False)), _render_histogram),
+    ChartTemplate("box", r"\b(box ?plot|boxplot|caixa|compar\w*)\b",
+                  (TemplateParam("y", NUMERIC), TemplateParam("x", CATEGORICAL, False)), _render_box),
+    # "por" sozinho não basta: "vendas por região" pode pedir qualquer tipo de gráfico
+    ChartTemplate("bar", r"\b(barras?|ranking)\b"
+                  r"|\b(media|mediana|soma|total|contagem|quantidade|quantos|quantas|numero|maximo|minimo)\b.*\bpor\b",
+                  (TemplateParam("x", CATEGORICAL), TemplateParam("y", NUMERIC, False)), _render_bar),
+)
+
+
+def aggregation_for(question: str, default=("mean", "Média")) -> tuple:
+    """Agregação pedida na pergunta normalizada: (função do pandas, rótulo)."""
+    return next(((func, label) for pattern, func, label in _AGGREGATIONS if pattern.search(question)), default)
+
+
+def _options(question: str, columns: list) -> dict:
+    bins = _BINS_PATTERN.search(question)
+    return {
+        "bins": min(int(bins.group(1)), 200) if bins else DEFAULT_BINS,
+        "aggregation": aggregation_for(question),
+        "columns": columns,
+    }
+
+
+def match_template(question: str, df: pd.DataFrame) -> dict | None:
+    """
+    Modelo que atende ao pedido: {"template", "params", "code"}, ou None para usar o LLM.
+
+    O código usa apenas colunas existentes em `df`, com nomes escapados.
+    """
+    if df is None or not question:
+        return None
+    text = normalize_text(question)
+    columns = mentioned_columns(question, df)
+    if named_chart_types(question, [c for c, _ in columns]) - TEMPLATE_CHART_TYPES:
+        # Pizza, linha, violino...: o modelo desenharia outro tipo de gráfico
+        return None
+    options = _options(text, columns)
+    for template in TEMPLATES:
+        if not template.pattern.search(text):
+            continue
+        if template.accepts is not None and not template.accepts(text, df, columns):
+            continue
+        params = template.bind(columns)
+        if params is None:
+            continue
+        return {"template": template.name, "params": params, "code": template.render(df, params, options)}
+    return None
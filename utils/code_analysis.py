@@ -0,0 +1,204 @@
+"""
+Análise estática do código gerado pelos agentes, antes da execução.
+
+O código é lido uma única vez para uma árvore sintática (AST), que fornece:
+
+- uma impressão digital normalizada (comentários, espaços, formatação das
+  strings e docstrings não contam), usada como chave do cache de gráficos;
+- a verificação das colunas referenciadas (`df["col"]`, `tables["t"]["col"]`
+  e os argumentos `x=`, `y=`, `color=`... de `px.*(df, ...)`) contra o
+  esquema do dataset;
+- as chamadas proibidas: leitura e gravação de arquivos (`pd.read_csv`),
+  `open`, `exec`/`eval` e módulos de sistema e rede.
+
+Erros de sintaxe, colunas inexistentes e chamadas proibidas geram
+`CodeValidationError` sem que nada seja executado. Um `fig.show()` isolado
+(comum mesmo com a instrução contrária no prompt) não impede a execução: a
+linha é retirada de `executable_code`, já que a aplicação exibe a figura.
+"""
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Análises guardadas por texto do código (LRU)
+MAX_CACHED_ANALYSES = 256
+
+# Argumentos do plotly.express que recebem nomes de colunas
+_PX_COLUMN_ARGS = ("x", "y", "z", "color", "size", "symbol", "names", "values", "facet_row", "facet_col",
+                   "hover_name", "text", "line_group", "animation_frame", "parents", "path")
+
+# Funções e métodos que leem ou gravam arquivos, abrem a figura fora da aplicação ou executam código
+_FORBIDDEN_NAMES = {"open", "exec", "eval", "compile", "__import__", "input", "breakpoint"}
+_FORBIDDEN_ATTRS = {
+    "show", "read_csv", "read_excel", "read_parquet", "read_json", "read_table", "read_sql", "read_html",
+    "read_pickle", "read_feather", "to_csv", "to_excel", "to_parquet", "to_pickle", "write_html",
+    "write_image", "savefig", "system", "popen",
+}
+_FORBIDDEN_MODULES = {"os", "sys", "subprocess", "shutil", "socket", "requests", "urllib", "http", "pathlib",
+                      "pickle", "ftplib", "smtplib", "importlib", "ctypes", "multiprocessing", "httpx"}
+
+
+class CodeValidationError(ValueError):
+    """O código gerado não pode ser executado (sintaxe, colunas inexistentes ou chamadas proibidas)."""
+
+    def __init__(self, message: str, analysis: "CodeAnalysis | None" = None):
+        super().__init__(message)
+        self.analysis = analysis
+
+
+class CodeAnalysis:
+    """Resultado da leitura do código: árvore, impressão digital e referências encontradas."""
+
+    def __init__(self, code: str):
+        self.code = code or ""
+        self.tree = None
+        self.syntax_error = None
+        self.columns = set()           # colunas lidas de `df`
+        self.table_columns = {}        # tabela -> colunas lidas de `tables["tabela"]`
+        self.assigned_columns = set()  # colunas criadas pelo próprio código (`df["nova"] = ...`)
+        self.df_reassigned = False     # `df = ...`: o esquema original deixa de valer
+        self.forbidden_calls = []
+        self.executable_code = self.code  # código executado (sem os `fig.show()` isolados)
+        try:
+            self.tree = ast.parse(self.code)
+        except SyntaxError as e:
+            self.syntax_error = f"linha {e.lineno}: {e.msg}"
+            self.fingerprint = hashlib.md5(self.code.encode()).hexdigest()
+            return
+        self.fingerprint = hashlib.md5(_normalized_dump(self.tree).encode()).hexdigest()
+        show_calls = [stmt for stmt in self.tree.body if _is_show_call(stmt)]
+        if show_calls:
+            self.executable_code = ast.unparse(ast.Module(
+                body=[stmt for stmt in self.tree.body if stmt not in show_calls], type_ignores=[]))
+        self._collect(skip=show_calls)
+
+    @property
+    def errors(self) -> list:
+        """Problemas independentes do dataset (sintaxe e chamadas proibidas)."""
+        if self.syntax_error:
+            return [f"Erro de sintaxe no código gerado ({self.syntax_error})"]
+        return [f"Chamada não permitida no código gerado: {call}" for call in self.forbidden_calls]
+
+    def missing_columns(self, df=None, tables: dict | None = None) -> list:
+        """Colunas e tabelas referenciadas que não existem no esquema do dataset."""
+        missing = []
+        if df is not None and hasattr(df, "columns") and not self.df_reassigned:
+            known = set(map(str, df.columns)) | self.assigned_columns
+            missing += [f"df[{c!r}]" for c in sorted(self.columns) if c not in known]
+        for table, columns in sorted(self.table_columns.items()):
+            if tables is None:
+                continue
+            if table not in tables:
+                missing.append(f"tables[{table!r}]")
+                continue
+            known = set(map(str, tables[table].columns))
+            missing += [f"tables[{table!r}][{c!r}]" for c in sorted(columns) if c not in known]
+        return missing
+
+    def validate(self, df=None, tables: dict | None = None):
+        """Levanta CodeValidationError se o código não puder ser executado com este dataset."""
+        errors = self.errors
+        if not errors:
+            missing = self.missing_columns(df, tables)
+            if missing:
+                errors = [f"Colunas inexistentes no dataset: {', '.join(missing)}"]
+        if errors:
+            raise CodeValidationError("; ".join(errors), self)
+
+    def _collect(self, skip=()):
+        skipped = {id(node) for stmt in skip for node in ast.walk(stmt)}
+        for node in ast.walk(self.tree):
+            if id(node) in skipped:
+                continue
+            if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "df" for t in node.targets):
+                self.df_reassigned = True
+            elif isinstance(node, ast.Subscript):
+                self._collect_subscript(node)
+            elif isinstance(node, ast.Call):
+                self._collect_call(node)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                modules = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module or ""]
+                self.forbidden_calls += [f"import {m}" for m in modules if m.split(".")[0] in _FORBIDDEN_MODULES]
+
+    def _collect_subscript(self, node: ast.Subscript):
+        keys = _string_keys(node.slice)
+        if not keys:
+            return
+        value = node.value
+        if isinstance(value, ast.Name) and value.id == "df":
+            if isinstance(node.ctx, ast.Store):
+                self.assigned_columns.update(keys)
+            else:
+                self.columns.update(keys)
+        elif isinstance(value, ast.Name) and value.id == "tables":
+            self.table_columns.setdefault(keys[0], set())
+        elif (isinstance(value, ast.Subscript) and isinstance(value.value, ast.Name)
+              and value.value.id == "tables" and not isinstance(node.ctx, ast.Store)):
+            table_keys = _string_keys(value.slice)
+            if table_keys:
+                self.table_columns.setdefault(table_keys[0], set()).update(keys)
+
+    def _collect_call(self, node: ast.Call):
+        func = node.func
+        if isinstance(func, ast.Name) and func.id in _FORBIDDEN_NAMES:
+            self.forbidden_calls.append(f"{func.id}()")
+        elif isinstance(func, ast.Attribute):
+            if func.attr in _FORBIDDEN_ATTRS:
+                self.forbidden_calls.append(f"{_dotted(func)}()")
+            elif (isinstance(func.value, ast.Name) and func.value.id == "px" and node.args
+                  and isinstance(node.args[0], ast.Name) and node.args[0].id == "df"):
+                # px.bar(df, x="coluna", ...): os argumentos nomeados são colunas de df
+                for keyword in node.keywords:
+                    if keyword.arg in _PX_COLUMN_ARGS:
+                        self.columns.update(_string_keys(keyword.value))
+
+
+def _is_show_call(stmt) -> bool:
+    """Instrução `algo.show()` isolada, sem argumentos."""
+    return (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call)
+            and isinstance(stmt.value.func, ast.Attribute) and stmt.value.func.attr == "show"
+            and not stmt.value.args and not stmt.value.keywords)
+
+
+def _string_keys(node) -> list:
+    """Strings literais de um índice: `"a"` ou `["a", "b"]`."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [e.value for e in node.elts if isinstance(e, ast.Constant) and isinstance(e.value, str)]
+    return []
+
+
+def _dotted(node) -> str:
+    if isinstance(node, ast.Attribute):
+        return f"{_dotted(node.value)}.{node.attr}"
+    return node.id if isinstance(node, ast.Name) else "..."
+
+
+def _normalized_dump(tree: ast.Module) -> str:
+    """AST sem docstrings nem posições: comentários e formatação não mudam o resultado."""
+    body = [stmt for stmt in tree.body
+            if not (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant)
+                    and isinstance(stmt.value.value, str))]
+    return ast.dump(ast.Module(body=body, type_ignores=[]), annotate_fields=False, include_attributes=False)
+
+
+_analyses = OrderedDict()
+_analyses_lock = threading.Lock()
+
+
+def analyze_code(code: str) -> CodeAnalysis:
+    """Análise do código, guardada para que o mesmo texto seja lido uma única vez."""
+    key = hashlib.md5((code or "").encode()).hexdigest()
+    with _analyses_lock:
+        analysis = _analyses.get(key)
+        if analysis is not None:
+            _analyses.move_to_end(key)
+            return analysis
+    analysis = CodeAnalysis(code)
+    with _analyses_lock:
+        _analyses[key] = analysis
+        while len(_analyses) > MAX_CACHED_ANALYSES:
+            _analyses.popitem(last=False)
+    return analysis
@@ -0,0 +1,438 @@
+"""
+Reaproveitamento dos códigos de gráficos já gerados, sem chamar o LLM.
+
+Cada código gerado pelo agente de visualização entra em um índice do processo
+com a intenção da pergunta (as palavras, sem os nomes das colunas) e as
+colunas que o código referencia, com seus tipos. Quando uma pergunta parecida
+é feita sobre um dataset de esquema compatível (as colunas citadas têm os
+mesmos tipos, na mesma ordem), o código é adaptado: os nomes das colunas são
+trocados na árvore sintática, o resultado é validado contra o novo esquema e
+executado como o do agente. Os códigos salvos no Supabase (`generated_codes`,
+de todas as sessões) são carregados uma vez por processo; como o dataset de
+origem não é conhecido, os tipos das colunas são deduzidos do uso no código
+(agregações numéricas, `groupby`, `color=`...) e códigos com alguma coluna de
+tipo indefinido ficam de fora. O índice é compartilhado entre usuários: o
+cabeçalho do código reaproveitado não mostra o pedido de origem, códigos com
+strings que não são colunas nem opções conhecidas do pandas/plotly (valores de
+filtro como `df[df["cliente"] == "ACME"]`) não entram no índice, e títulos e
+rótulos com palavras que não estão na nova pergunta são substituídos.
+"""
+import ast
+import re
+import threading
+from collections import deque
+
+import pandas as pd
+
+from utils.async_runtime import run_blocking, submit
+from utils.chart_templates import CATEGORICAL, NUMERIC, column_kind, find_mentions, normalize_text
+from utils.code_analysis import analyze_code
+
+# Códigos guardados no índice (os mais antigos saem primeiro)
+MAX_REUSE_ENTRIES = 500
+# Códigos lidos do Supabase ao carregar o índice
+LOAD_LIMIT = 500
+# Similaridade mínima (Jaccard) entre as intenções das perguntas
+MIN_INTENT_SIMILARITY = 0.6
+# Nomes de colunas mais curtos não são trocados dentro de textos (títulos), só como valor exato
+MIN_NAME_IN_TEXT = 3
+
+# Palavras que não distinguem um pedido de outro
+_STOPWORDS = {
+    "a", "o", "as", "os", "e", "de", "da", "do", "das", "dos", "em", "no", "na", "nos", "nas", "um", "uma",
+    "com", "para", "que", "qual", "quais", "me", "mostre", "mostrar", "gere", "gerar", "crie", "criar", "faca",
+    "fazer", "exiba", "exibir", "plote", "plotar", "grafico", "visualizacao", "coluna", "colunas", "variavel",
+    "dados", "dataset",
+}
+
+
+# Strings aceitas no código além das colunas: opções do pandas, do plotly e nomes de cores
+_KNOWN_LITERALS = {
+    "mean", "sum", "count", "size", "min", "max", "median", "std", "var", "nunique", "first", "last", "prod",
+    "index", "columns", "records", "list", "dict", "values", "any", "all", "number", "object", "category",
+    "int", "int64", "float", "float64", "bool", "str", "string", "datetime64", "datetime64[ns]", "coerce",
+    "ignore", "raise", "inner", "left", "right", "outer", "cross", "pearson", "spearman", "kendall", "linear",
+    "D", "W", "M", "ME", "MS", "Q", "QE", "Y", "YE", "YS", "h", "v", "group", "stack", "overlay", "relative",
+    "ols", "lowess", "rolling", "ewm", "expanding", "rug", "box", "violin", "outliers", "suspectedoutliers",
+    "percent", "probability", "density", "probability density", "total descending", "total ascending",
+    "category ascending", "category descending", "auto", "inside", "outside", "top", "bottom", "middle", "center",
+    "lines", "markers", "lines+markers", "text", "none", "plotly", "plotly_white", "plotly_dark", "ggplot2",
+    "seaborn", "simple_white", "presentation", "x", "y", "x unified", "y unified", "closest", "red", "blue",
+    "green", "orange", "gray", "grey", "black", "white", "purple", "steelblue", "lightblue", "darkblue", "indianred",
+}
+# Argumentos com textos exibidos no gráfico (títulos, rótulos e nomes de séries)
+_TEXT_ARGS = {"title", "title_text", "xaxis_title", "yaxis_title", "legend_title", "legend_title_text",
+              "coloraxis_colorbar_title", "name", "hovertemplate", "texttemplate", "labels"}
+# Palavras de títulos que não identificam o dataset de origem
+_CHART_WORDS = {
+    "distribuicao", "media", "medias", "mediana", "soma", "total", "contagem", "quantidade", "frequencia",
+    "por", "x", "vs", "versus", "e", "histograma", "boxplot", "dispersao", "evolucao", "ao", "longo", "tempo",
+    "top", "correlacao", "relacao", "entre", "proporcao", "percentual", "valor", "valores", "comparacao",
+    "ranking", "tendencia", "barras", "linha", "pizza", "mapa", "calor", "registros", "numero",
+}
+
+
+def intent_terms(question: str, columns=()) -> frozenset:
+    """Palavras da pergunta que descrevem o pedido, sem os nomes das colunas citadas."""
+    text = f" {normalize_text(question)} "
+    for column in sorted(columns, key=lambda c: -len(str(c))):
+        name = normalize_text(column)
+        if name:
+            text = re.sub(rf"(?<=\s){re.escape(name)}s?(?=\s)", " ", text)
+    return frozenset(word for word in text.split() if word not in _STOPWORDS)
+
+
+# Métodos que só fazem sentido com colunas numéricas
+_NUMERIC_METHODS = {"mean", "sum", "std", "var", "median", "quantile", "corr", "cumsum", "pct_change", "round",
+                    "skew", "kurt"}
+# Argumentos do plotly.express que recebem colunas numéricas ou categóricas, por função
+_PX_NUMERIC_ARGS = {"scatter": ("x", "y", "size"), "line": ("y",), "box": ("y",), "violin": ("y",),
+                    "histogram": ("x",), "bar": ("y",), "density_heatmap": ("z",)}
+_PX_CATEGORICAL_ARGS = ("color", "symbol", "facet_row", "facet_col", "names", "line_group")
+
+
+def infer_column_kinds(tree) -> dict:
+    """
+    Tipos das colunas deduzidos do uso no código (para códigos sem o dataset de origem).
+
+    Numéricas: agregadas (`.mean()`, `.sum()`...), passadas ao NumPy ou usadas
+    como eixo de valores do plotly; categóricas: chaves de `groupby`,
+    `value_counts()` e argumentos como `color=`. Colunas com usos
+    contraditórios ou sem uso característico ficam de fora.
+    """
+    evidence = {}
+
+    def note(keys, kind):
+        for key in keys:
+            evidence.setdefault(key, set()).add(kind)
+
+    parents = {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript):
+            keys = _constant_strings(node.slice)
+            parent = parents.get(node)
+            if keys and isinstance(parent, ast.Attribute) and isinstance(parents.get(parent), ast.Call):
+                if parent.attr in _NUMERIC_METHODS:
+                    note(keys, NUMERIC)
+                elif parent.attr == "value_counts":
+                    note(keys, CATEGORICAL)
+            elif keys and isinstance(parent, ast.Call) and _module_call(parent, "np"):
+                note(keys, NUMERIC)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            if node.func.attr == "groupby":
+                for arg in node.args[:1]:
+                    note(_constant_strings(arg), CATEGORICAL)
+                for keyword in node.keywords:
+                    if keyword.arg == "by":
+                        note(_constant_strings(keyword.value), CATEGORICAL)
+            elif _module_call(node, "px"):
+                numeric_args = _PX_NUMERIC_ARGS.get(node.func.attr, ())
+                for keyword in node.keywords:
+                    if keyword.arg in numeric_args:
+                        note(_constant_strings(keyword.value), NUMERIC)
+                    elif keyword.arg in _PX_CATEGORICAL_ARGS or (node.func.attr == "box" and keyword.arg == "x"):
+                        note(_constant_strings(keyword.value), CATEGORICAL)
+    return {key: next(iter(kinds)) for key, kinds in evidence.items() if len(kinds) == 1}
+
+
+def _constant_strings(node) -> list:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [e.value for e in node.elts if isinstance(e, ast.Constant) and isinstance(e.value, str)]
+    return []
+
+
+def _text_nodes(tree) -> list:
+    """
+    (nó, texto padrão) das strings exibidas no gráfico: títulos, nomes de séries e rótulos.
+
+    O texto padrão de um rótulo (`labels={"coluna": "Rótulo"}`) é a própria
+    coluna; o dos demais textos é definido por quem os substitui (None).
+    """
+    found = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        for keyword in node.keywords:
+            if keyword.arg not in _TEXT_ARGS:
+                continue
+            value = keyword.value
+            if isinstance(value, ast.Dict):
+                for key, item in zip(value.keys, value.values):
+                    if isinstance(key, ast.Constant) and isinstance(key.value, str):
+                        found.append((item, key.value if keyword.arg == "labels" else None))
+            else:
+                found.append((value, None))
+    return [(node, default) for node, default in found if isinstance(node, (ast.Constant, ast.JoinedStr))]
+
+
+def _is_known_literal(value: str) -> bool:
+    """String que não carrega valores do dataset: opção conhecida, cor, formato ou texto sem letras."""
+    if value in _KNOWN_LITERALS or value.lower() in _KNOWN_LITERALS:
+        return True
+    if re.fullmatch(r"#[0-9a-fA-F]{3,8}|[$,.+#0-9]*[a-z%]?", value):
+        return True
+    # Modelos do plotly (`%{y:.2f}`), formatos de data (`%Y-%m`) e quebras de linha
+    rest = re.sub(r"%\{[^}]*\}|%[a-zA-Z]|<br>", "", value)
+    return not re.search(r"[^\W\d_]", rest) or _is_colorscale(value)
+
+
+def _is_colorscale(value: str) -> bool:
+    try:
+        import plotly.express as px
+    except ImportError:
+        return False
+    name = value.lower().removesuffix("_r")
+    return name in px.colors.named_colorscales()
+
+
+def _literal_text(node) -> str:
+    if isinstance(node, ast.Constant):
+        return node.value if isinstance(node.value, str) else ""
+    return " ".join(part.value for part in node.values if isinstance(part, ast.Constant) and isinstance(part.value, str))
+
+
+def _foreign_literals(tree, columns) -> list:
+    """Strings do código que não são colunas, opções conhecidas nem textos exibidos (ex.: valores de filtro)."""
+    text_nodes = {id(node) for node, _ in _text_nodes(tree)}
+    text_parts = {id(part) for node in ast.walk(tree) if id(node) in text_nodes and isinstance(node, ast.JoinedStr)
+                  for part in node.values}
+    return sorted({
+        node.value for node in ast.walk(tree)
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in text_nodes
+        and id(node) not in text_parts and node.value not in columns and not _is_known_literal(node.value)
+    })
+
+
+def _module_call(node, module: str) -> bool:
+    """Chamada `module.função(...)` (ex.: `np.polyfit`, `px.bar`)."""
+    return (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+            and isinstance(node.func.value, ast.Name) and node.func.value.id == module)
+
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    union = a | b
+    return len(a & b) / len(union) if union else 0.0
+
+
+def _calls_sql(tree) -> bool:
+    return any(isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "sql"
+               for node in ast.walk(tree))
+
+
+class ReusableCode:
+    """
+    Código guardado no índice.
+
+    `slots` são as colunas citadas na pergunta original, na ordem, que serão
+    trocadas pelas colunas citadas na nova pergunta; `fixed`, as demais
+    colunas referenciadas, que o novo dataset precisa ter. Os tipos vêm do
+    dataset de origem ou, nos códigos lidos do Supabase, do uso no código.
+    """
+
+    def __init__(self, question: str, code: str, slots: list, fixed: list, fingerprint: str):
+        self.question = question
+        self.code = code
+        self.slots = slots
+        self.fixed = fixed
+        self.fingerprint = fingerprint
+        self.intent = intent_terms(question, [name for name, _ in slots])
+
+
+def _compatible(kind: str, new_kind: str | None) -> bool:
+    return new_kind is not None and kind == new_kind
+
+
+class _TextMasker(ast.NodeTransformer):
+    """Troca os títulos e rótulos com palavras alheias à nova pergunta (podem ser de outro usuário)."""
+
+    def __init__(self, tree, columns, question: str):
+        self.columns = list(columns)
+        self.allowed = intent_terms(question, self.columns) | _CHART_WORDS
+        self.fallback = question.strip().rstrip("?").strip()
+        self.replacements = {}
+        for node, default in _text_nodes(tree):
+            if not intent_terms(_literal_text(node), self.columns) <= self.allowed:
+                self.replacements[id(node)] = default if default is not None else self.fallback
+
+    def visit(self, node):
+        if id(node) in self.replacements:
+            return ast.copy_location(ast.Constant(self.replacements[id(node)]), node)
+        return super().visit(node)
+
+
+class _ColumnRenamer(ast.NodeTransformer):
+    """Troca os nomes das colunas nas strings do código: valores exatos e citações em títulos."""
+
+    def __init__(self, mapping: dict):
+        self.mapping = mapping
+        names = sorted((name for name in mapping if len(name) >= MIN_NAME_IN_TEXT), key=len, reverse=True)
+        self.pattern = re.compile(rf"(?<!\w)({'|'.join(map(re.escape, names))})(?!\w)") if names else None
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, str):
+            return node
+        if node.value in self.mapping:
+            value = self.mapping[node.value]
+        elif self.pattern is not None:
+            value = self.pattern.sub(lambda m: self.mapping[m.group(1)], node.value)
+        else:
+            return node
+        return ast.copy_location(ast.Constant(value), node)
+
+
+def adapt_code(code: str, mapping: dict, question: str | None = None) -> str:
+    """
+    Código com as colunas de `mapping` ({antiga: nova}) trocadas; comentários não são mantidos.
+
+    Com a nova `question`, títulos e rótulos que, depois da troca, têm
+    palavras fora dela e dos nomes das colunas são substituídos.
+    """
+    tree = ast.parse(code)
+    if any(old != new for old, new in mapping.items()):
+        tree = ast.fix_missing_locations(_ColumnRenamer(mapping).visit(tree))
+    if question:
+        tree = ast.fix_missing_locations(_TextMasker(tree, mapping.values(), question).visit(tree))
+    return ast.unparse(tree)
+
+
+class CodeReuseIndex:
+    """Índice do processo com os códigos de gráficos gerados, compartilhado pelas sessões."""
+
+    def __init__(self, max_entries: int = MAX_REUSE_ENTRIES):
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self._load_started = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, question: str, code: str, df: pd.DataFrame | None = None) -> bool:
+        """
+        Guarda o código gerado para a pergunta; retorna False se ele não puder ser reaproveitado.
+
+        Com o `df` de origem, os tipos das colunas vêm dele; sem o `df`, do uso
+        no código. Códigos com erros, consultas SQL, várias tabelas, que
+        substituem `df`, com colunas de tipo indefinido ou com strings que
+        podem ser valores do dataset de origem ficam de fora.
+        """
+        if not question or not code:
+            return False
+        analysis = analyze_code(code)
+        if (analysis.errors or analysis.df_reassigned or analysis.table_columns or not analysis.columns
+                or _calls_sql(analysis.tree)):
+            return False
+        if df is not None:
+            if analysis.missing_columns(df):
+                return False
+            kinds = {str(c): column_kind(df[c]) for c in df.columns}
+        else:
+            kinds = infer_column_kinds(analysis.tree)
+        columns = sorted(analysis.columns)
+        if any(kinds.get(name) is None for name in columns):
+            return False
+        # O índice é compartilhado entre usuários: valores de filtro não podem ir para outra sessão
+        known_names = analysis.columns | analysis.assigned_columns | set(infer_column_kinds(analysis.tree))
+        if _foreign_literals(analysis.tree, known_names):
+            return False
+        mentioned = find_mentions(question, columns)
+        entry = ReusableCode(
+            question, analysis.executable_code,
+            slots=[(name, kinds.get(name)) for name in mentioned],
+            fixed=[(name, kinds.get(name)) for name in columns if name not in mentioned],
+            fingerprint=analysis.fingerprint,
+        )
+        with self._lock:
+            if any(e.fingerprint == entry.fingerprint and e.intent == entry.intent for e in self._entries):
+                return False
+            self._entries.append(entry)
+        return True
+
+    def match(self, question: str, df: pd.DataFrame) -> dict | None:
+        """
+        Código adaptado para a pergunta e o dataset: {"code", "source", "similarity", "mapping"}, ou None.
+
+        Entre os códigos de intenção parecida, o mais parecido (e, no empate, o
+        mais recente) cujas colunas se encaixam no esquema é adaptado e validado.
+        """
+        if df is None or not question or not self._entries:
+            return None
+        kinds = {str(c): column_kind(df[c]) for c in df.columns}
+        mentioned = find_mentions(question, [c for c, kind in kinds.items() if kind is not None])
+        intent = intent_terms(question, mentioned)
+        with self._lock:
+            entries = list(self._entries)
+        candidates = []
+        for position, entry in enumerate(entries):
+            if len(entry.slots) != len(mentioned):
+                continue
+            similarity = _similarity(intent, entry.intent)
+            if similarity >= MIN_INTENT_SIMILARITY:
+                candidates.append((-similarity, -position, entry))
+        for negative_similarity, _, entry in sorted(candidates, key=lambda c: c[:2]):
+            mapping = self._map_columns(entry, mentioned, kinds)
+            if mapping is None:
+                continue
+            try:
+                code = adapt_code(entry.code, mapping, question)
+            except (SyntaxError, ValueError) as e:
+                print(f"Erro ao adaptar código reaproveitado: {e}")
+                continue
+            analysis = analyze_code(code)
+            if analysis.errors or analysis.missing_columns(df):
+                continue
+            changed = {old: new for old, new in mapping.items() if old != new}
+            # O pedido de origem pode ser de outro usuário: fica fora do código exibido
+            header = "# Código reaproveitado de um pedido parecido"
+            if changed:
+                header += " (colunas: " + ", ".join(f"{old} → {new}" for old, new in changed.items()) + ")"
+            return {"code": f"{header}\n{code}", "source": entry.question, "similarity": -negative_similarity,
+                    "mapping": changed}
+        return None
+
+    @staticmethod
+    def _map_columns(entry: ReusableCode, mentioned: list, kinds: dict) -> dict | None:
+        """Colunas do código -> colunas do novo dataset, ou None se o esquema não for compatível."""
+        mapping = {}
+        for (name, kind), new_name in zip(entry.slots, mentioned):
+            if not _compatible(kind, kinds.get(new_name)):
+                return None
+            mapping[name] = new_name
+        targets = set(mapping.values())
+        for name, kind in entry.fixed:
+            if name in targets or not _compatible(kind, kinds.get(name)):
+                return None
+            mapping[name] = name
+        return mapping
+
+    def ensure_loaded(self, memory):
+        """Carrega em segundo plano, uma vez por processo, os códigos salvos no Supabase."""
+        with self._lock:
+            if self._load_started:
+                return
+            self._load_started = True
+        submit(run_blocking(self._load, memory))
+
+    def _load(self, memory):
+        try:
+            rows = memory.get_recent_generated_codes("visualization", limit=LOAD_LIMIT)
+        except Exception as e:
+            print(f"Erro ao carregar códigos para reaproveitamento: {e}")
+            return
+        # Do mais antigo para o mais recente, como se tivessem sido gerados agora
+        for row in reversed(rows or []):
+            self.add(row.get("description") or "", row.get("python_code") or "")
+
+
+_index: CodeReuseIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_code_reuse_index() -> CodeReuseIndex:
+    """Índice único do processo, criado na primeira chamada."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CodeReuseIndex()
+    return _index
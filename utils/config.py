@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 
 # Verificar se estamos rodando no Python 3.11+ para usar tomllib
 if sys.version_info >= (3, 11):
@@ -7,13 +8,102 @@ if sys.version_info >= (3, 11):
 else:
     import toml as tomllib
 
-def get_config():
-    """Carrega e retorna as configurações do secrets.toml."""
+def _int_setting(app_config: dict, key: str, default: int) -> int:
+    """Lê um inteiro do secrets.toml, da variável de ambiente equivalente ou usa o padrão."""
+    value = app_config.get(key, os.getenv(key.upper()))
+    try:
+        return int(value) if value is not None else default
+    except (TypeError, ValueError):
+        return default
+
+
+def _bool_setting(app_config: dict, key: str, default: bool) -> bool:
+    """Lê um booleano do secrets.toml ou da variável de ambiente equivalente ("1", "true", "sim")."""
+    value = app_config.get(key, os.getenv(key.upper()))
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "sim", "on")
+
+
+def _tuning_settings(app_config: dict) -> dict:
+    """Parâmetros de desempenho (opcionais) com valores padrão seguros."""
+    return {
+        # Agendador global de requisições ao LLM
+        "llm_requests_per_minute": _int_setting(app_config, "llm_requests_per_minute", 60),
+        "llm_max_concurrency": _int_setting(app_config, "llm_max_concurrency", 4),
+        "llm_max_queue": _int_setting(app_config, "llm_max_queue", 100),
+        # Orçamento de memória das sessões e tempo até descarregar sessões ociosas para o disco
+        "session_memory_budget_mb": _int_setting(app_config, "session_memory_budget_mb", 2048),
+        "session_idle_seconds": _int_setting(app_config, "session_idle_seconds", 900),
+        # Arquivos acima deste tamanho são convertidos para Parquet e consultados no DuckDB (fora da memória)
+        "out_of_core_threshold_mb": _int_setting(app_config, "out_of_core_threshold_mb", 200),
+        "out_of_core_sample_rows": _int_setting(app_config, "out_of_core_sample_rows", 100_000),
+        # Memória máxima do DuckDB por consulta (o excedente é despejado em disco)
+        "duckdb_memory_limit_mb": _int_setting(app_config, "duckdb_memory_limit_mb", 1024),
+        # Geração de gráficos/código: "python", "sql" (consulta DuckDB + gráfico) ou "auto"
+        "query_mode": app_config.get("query_mode", os.getenv("QUERY_MODE", "auto")),
+        # No modo "auto", datasets a partir deste número de linhas usam SQL
+        "sql_mode_min_rows": _int_setting(app_config, "sql_mode_min_rows", 1_000_000),
+        # Pré-busca especulativa das sugestões de perguntas (opcional; consome requisições ao LLM)
+        "prefetch_enabled": _bool_setting(app_config, "prefetch_enabled", False),
+        # Máximo de turnos pré-buscados por sessão e espera máxima por uma pré-busca em andamento
+        "prefetch_max_per_session": _int_setting(app_config, "prefetch_max_per_session", 12),
+        "prefetch_wait_seconds": _int_setting(app_config, "prefetch_wait_seconds", 30),
+        # Modelos de gráficos locais para os pedidos mais comuns (sem chamar o LLM)
+        "chart_templates_enabled": _bool_setting(app_config, "chart_templates_enabled", True),
+        # Pré-cálculo em segundo plano ao carregar o dataset (perfil, correlações, outliers, gráficos e sugestões)
+        "precompute_enabled": _bool_setting(app_config, "precompute_enabled", True),
+        # Memória máxima dos resultados pré-calculados guardados no processo (figuras, matrizes e perfis)
+        "precompute_memory_mb": _int_setting(app_config, "precompute_memory_mb", 128),
+        # Cubo de agregações para perguntas de quebra por categoria e orçamento de memória dos cubos do processo
+        "cube_enabled": _bool_setting(app_config, "cube_enabled", True),
+        "cube_memory_mb": _int_setting(app_config, "cube_memory_mb", 256),
+        # Reaproveitamento de códigos de gráficos já gerados para perguntas parecidas (sem chamar o LLM)
+        "code_reuse_enabled": _bool_setting(app_config, "code_reuse_enabled", True),
+        # Correção automática do código de gráficos que falhou: máximo de tentativas e orçamento de tempo
+        "chart_repair_attempts": _int_setting(app_config, "chart_repair_attempts", 2),
+        "chart_repair_seconds": _int_setting(app_config, "chart_repair_seconds", 45),
+        # Mensagens mais recentes do chat exibidas a cada execução; as anteriores são carregadas sob demanda
+        "chat_history_window": _int_setting(app_config, "chat_history_window", 20),
+        # Modo dos prompts dos agentes: "compact" (padrão) ou "full"
+        "prompt_mode": app_config.get("prompt_mode", os.getenv("PROMPT_MODE", "compact")),
+    }
+
+
+_config: dict | None = None
+_config_lock = threading.Lock()
+
+
+def get_config() -> dict:
+    """
+    Configurações do processo, lidas do secrets.toml uma única vez.
+
+    As execuções do script e os módulos compartilham o mesmo dicionário; use
+    `reload_config()` para reler o arquivo e as variáveis de ambiente.
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = load_config()
+        return _config
+
+
+def reload_config() -> dict:
+    """Descarta a configuração em cache e a relê."""
+    global _config
+    with _config_lock:
+        _config = load_config()
+        return _config
+
+
+def load_config() -> dict:
+    """Carrega as configurações do secrets.toml (ou das variáveis de ambiente)."""
     config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.streamlit', 'secrets.toml')
 
     try:
         with open(config_path, 'rb') as f:
-            print(config_path)
             config_data = tomllib.load(f)
         app_config = config_data.get('custom', {})
 
@@ -21,6 +111,7 @@ def get_config():
             "google_api_key": app_config.get("google_api_key"),
             "supabase_url": app_config.get("supabase_url"),
             "supabase_key": app_config.get("supabase_key"),
+            **_tuning_settings(app_config),
         }
     except FileNotFoundError:
         print("Aviso: Arquivo secrets.toml não encontrado. Usando variáveis de ambiente como fallback.")
@@ -29,6 +120,7 @@ def get_config():
             "google_api_key": os.getenv("GOOGLE_API_KEY"),
             "supabase_url": os.getenv("SUPABASE_URL"),
             "supabase_key": os.getenv("SUPABASE_KEY"),
+            **_tuning_settings({}),
         }
     except Exception as e:
         print(f"Erro ao carregar secrets.toml: {e}")
@@ -36,4 +128,5 @@ def get_config():
             "google_api_key": None,
             "supabase_url": None,
             "supabase_key": None,
+            **_tuning_settings({}),
         }
\ No newline at end of file
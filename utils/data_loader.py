@@ -1,9 +1,73 @@
 import pandas as pd
 import io
+import os
 import hashlib
+import tempfile
 
+from utils.config import get_config
+from utils.query_engine import (OUT_OF_CORE_ATTR, csv_to_parquet, is_available, out_of_core_info,
+                                parquet_row_count, parquet_sample, profile_parquet)
 
-def load_csv(uploaded_file, max_size_mb=200):
+# Parquet dos datasets fora da memória, por hash do arquivo (a conversão ocorre uma única vez)
+PARQUET_DIR = os.path.join(
+    os.getenv("INSIGHTAGENT_SESSION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "insightagent_sessions")),
+    "parquet",
+)
+# Limite dos CSVs carregados inteiros em memória quando o DuckDB não está instalado
+MAX_IN_MEMORY_CSV_MB = 200
+
+
+def _file_bytes(uploaded_file) -> memoryview:
+    """Conteúdo do upload sem cópia quando possível (buffer do BytesIO do Streamlit)."""
+    getbuffer = getattr(uploaded_file, "getbuffer", None)
+    return getbuffer() if getbuffer is not None else memoryview(uploaded_file.getvalue())
+
+
+def compute_file_hash(uploaded_file) -> str:
+    """Hash MD5 do conteúdo do arquivo (o mesmo retornado por `load_csv`)."""
+    with _file_bytes(uploaded_file) as content:
+        return hashlib.md5(content).hexdigest()
+
+
+def should_load_out_of_core(uploaded_file) -> bool:
+    """Arquivos acima de `out_of_core_threshold_mb` vão para o modo fora da memória (requer DuckDB)."""
+    return is_available() and uploaded_file.size > get_config()["out_of_core_threshold_mb"] * 1024 * 1024
+
+
+def parquet_path_for(file_hash: str) -> str:
+    return os.path.join(PARQUET_DIR, f"{file_hash}.parquet")
+
+
+def load_csv_out_of_core(uploaded_file, file_hash: str | None = None) -> pd.DataFrame:
+    """
+    Converte o CSV para Parquet no disco e retorna apenas uma amostra em memória.
+
+    A amostra carrega em `attrs` o caminho do Parquet e o total de linhas: o
+    `sql()` do código gerado e o `get_dataset_info` consultam o arquivo completo.
+    """
+    file_hash = file_hash or compute_file_hash(uploaded_file)
+    path = parquet_path_for(file_hash)
+    if not os.path.exists(path):
+        os.makedirs(PARQUET_DIR, exist_ok=True)
+        csv_path = f"{path}.csv"
+        try:
+            with open(csv_path, "wb") as f, _file_bytes(uploaded_file) as content:
+                f.write(content)
+            csv_to_parquet(csv_path, path)
+        finally:
+            if os.path.exists(csv_path):
+                os.remove(csv_path)
+
+    sample = parquet_sample(path, get_config()["out_of_core_sample_rows"])
+    sample.attrs[OUT_OF_CORE_ATTR] = {
+        "path": path,
+        "rows": parquet_row_count(path),
+        "sample_rows": len(sample),
+    }
+    return sample
+
+
+def load_csv(uploaded_file, max_size_mb=MAX_IN_MEMORY_CSV_MB):
     """Carrega, valida e detecta automaticamente o formato de um arquivo CSV."""
     if uploaded_file.size > max_size_mb * 1024 * 1024:
         raise ValueError(f"Arquivo excede o tamanho máximo de {max_size_mb} MB.")
@@ -23,7 +87,7 @@ def load_csv(uploaded_file, max_size_mb=200):
                     # Heurística simples: se a maioria das colunas foi criada, sucesso.
                     if len(df.columns) > 1 or sep == separators[-1]:
                         # Calcula o hash do conteúdo para identificar o dataset
-                        file_hash = hashlib.md5(file_content).hexdigest()
+                        file_hash = compute_file_hash(uploaded_file)
                         return df, file_hash
                 except Exception:
                     continue
@@ -33,8 +97,26 @@ def load_csv(uploaded_file, max_size_mb=200):
     raise ValueError("Não foi possível decodificar ou parsear o arquivo CSV. Verifique o encoding e o separador.")
 
 
+def load_dataframe(uploaded_file, file_hash: str | None = None) -> pd.DataFrame:
+    """DataFrame do upload: completo em memória ou, para arquivos grandes, a amostra do modo fora da memória."""
+    if should_load_out_of_core(uploaded_file):
+        return load_csv_out_of_core(uploaded_file, file_hash)
+    if is_available():
+        # Com o DuckDB, tudo acima do limite já foi para o modo fora da memória
+        return load_csv(uploaded_file, max_size_mb=get_config()["out_of_core_threshold_mb"])[0]
+    try:
+        return load_csv(uploaded_file)[0]
+    except ValueError as e:
+        if uploaded_file.size > MAX_IN_MEMORY_CSV_MB * 1024 * 1024:
+            raise ValueError(f"{e} Instale o DuckDB para carregar arquivos maiores fora da memória.") from e
+        raise
+
+
 def get_dataset_info(df: pd.DataFrame, dataset_name: str) -> dict:
     """Extrai metadados e estatísticas básicas de um dataframe."""
+    if out_of_core_info(df) is not None:
+        return _get_out_of_core_info(df, dataset_name)
+
     buffer = io.StringIO()
     df.info(buf=buffer)
     info_str = buffer.getvalue()
@@ -48,4 +130,26 @@ def get_dataset_info(df: pd.DataFrame, dataset_name: str) -> dict:
         "duplicated_rows": int(df.duplicated().sum()),
         "info_string": info_str,
         "head": df.head().to_json(orient='split')
-    }
\ No newline at end of file
+    }
+
+def _get_out_of_core_info(sample: pd.DataFrame, dataset_name: str) -> dict:
+    """Metadados de um dataset fora da memória: contagens do Parquet completo, tipos da amostra."""
+    source = out_of_core_info(sample)
+    profile = profile_parquet(source["path"])
+    rows = profile["rows"]
+    lines = [f"Dataset fora da memória (Parquet): {rows} linhas x {sample.shape[1]} colunas; "
+             f"amostra em memória de {source['sample_rows']} linhas"]
+    lines += [f"{col}  {rows - profile['missing_values'].get(col, 0)} non-null  {dtype}"
+              for col, dtype in sample.dtypes.items()]
+
+    return {
+        "name": dataset_name,
+        "shape": (rows, sample.shape[1]),
+        "columns": sample.columns.tolist(),
+        "dtypes": {col: str(dtype) for col, dtype in sample.dtypes.items()},
+        "missing_values": profile["missing_values"],
+        "duplicated_rows": profile["duplicated_rows"],
+        "info_string": "\n".join(lines),
+        "head": profile["head"].to_json(orient='split'),
+        "out_of_core": {"rows": rows, "sample_rows": source["sample_rows"]},
+    }
@@ -0,0 +1,191 @@
+"""
+Registro de datasets compartilhados entre as sessões do processo.
+
+Sessões que enviam o mesmo arquivo (mesmo hash de conteúdo) recebem visões de
+um único DataFrame em vez de cópias completas. As visões são cópias rasas com
+copy-on-write do pandas: compartilham os dados com o DataFrame base e qualquer
+alteração feita por uma sessão gera uma cópia apenas para ela. O registro conta
+as sessões que usam cada dataset e, quando nenhuma o mantém em memória, grava o
+DataFrame no disco até o próximo acesso.
+"""
+import os
+import tempfile
+import threading
+
+import pandas as pd
+
+from utils.data_loader import get_dataset_info
+from utils.query_engine import out_of_core_info
+
+# Copy-on-write é o padrão a partir do pandas 3.0; no 2.x precisa ser ativado
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# Atributo do DataFrame com o hash do arquivo de origem (acompanha as visões das sessões)
+DATASET_HASH_ATTR = "insightagent_dataset_hash"
+
+CACHE_DIR = os.path.join(
+    os.getenv("INSIGHTAGENT_SESSION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "insightagent_sessions")),
+    "datasets",
+)
+
+
+class _Dataset:
+    """DataFrame base de um hash, com contagem de sessões e de sessões ativas."""
+
+    def __init__(self, file_hash: str):
+        self.file_hash = file_hash
+        self.df = None
+        self.info = None
+        self.name = None
+        self.bytes = 0
+        self.path = None
+        self.source_path = None  # Parquet de um dataset fora da memória (o DataFrame é uma amostra)
+        self.sessions = 0  # sessões que referenciam o dataset
+        self.active = 0    # sessões com o dataset em memória
+        self.lock = threading.Lock()
+
+
+class DatasetRegistry:
+    """Datasets do processo indexados pelo hash do conteúdo do arquivo."""
+
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._datasets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, file_hash: str, loader, name: str) -> tuple:
+        """
+        Registra mais uma sessão no dataset e retorna (visão do DataFrame, metadados).
+
+        `loader()` só é chamado se nenhuma sessão tiver carregado o mesmo arquivo.
+        """
+        with self._lock:
+            dataset = self._datasets.get(file_hash)
+            if dataset is None:
+                dataset = self._datasets[file_hash] = _Dataset(file_hash)
+            dataset.sessions += 1
+
+        try:
+            # O lock do dataset evita que duas sessões façam o parse do mesmo arquivo ao mesmo tempo
+            with dataset.lock:
+                if dataset.df is None and dataset.path is None:
+                    df = loader()
+                    df.attrs[DATASET_HASH_ATTR] = file_hash
+                    dataset.df = df
+                    dataset.info = get_dataset_info(df, name)
+                    dataset.name = name
+                    dataset.source_path = (out_of_core_info(df) or {}).get("path")
+                    try:
+                        dataset.bytes = int(df.memory_usage(deep=True).sum())
+                    except Exception:
+                        dataset.bytes = int(df.memory_usage().sum())
+                view = self._activate(dataset)
+        except Exception:
+            self.release(file_hash, active=False)
+            raise
+
+        info = dict(dataset.info)
+        info["name"] = name
+        return view, info
+
+    def reactivate(self, file_hash: str) -> pd.DataFrame:
+        """Nova visão para uma sessão que havia descarregado o dataset."""
+        with self._lock:
+            dataset = self._datasets[file_hash]
+        with dataset.lock:
+            return self._activate(dataset)
+
+    def _activate(self, dataset: _Dataset) -> pd.DataFrame:
+        if dataset.df is None:
+            dataset.df = pd.read_pickle(dataset.path)
+        dataset.active += 1
+        return dataset.df.copy(deep=False)
+
+    def deactivate(self, file_hash: str) -> int:
+        """
+        A sessão deixou de manter o dataset em memória.
+
+        Quando nenhuma sessão ativa resta, o DataFrame vai para o disco; retorna
+        os bytes liberados.
+        """
+        with self._lock:
+            dataset = self._datasets.get(file_hash)
+        if dataset is None:
+            return 0
+        with dataset.lock:
+            dataset.active = max(0, dataset.active - 1)
+            if dataset.active or dataset.df is None:
+                return 0
+            try:
+                if dataset.path is None:
+                    # As visões são copy-on-write: o DataFrame base nunca muda e é gravado uma única vez
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    path = os.path.join(self.cache_dir, f"{file_hash}.pkl")
+                    dataset.df.to_pickle(path)
+                    dataset.path = path
+                dataset.df = None
+                return dataset.bytes
+            except Exception as e:
+                print(f"Erro ao gravar dataset compartilhado no disco: {e}")
+                return 0
+
+    def release(self, file_hash: str, active: bool):
+        """Remove uma sessão do dataset; sem sessões, o dataset é descartado."""
+        with self._lock:
+            dataset = self._datasets.get(file_hash)
+            if dataset is None:
+                return
+            dataset.sessions -= 1
+            if active:
+                dataset.active = max(0, dataset.active - 1)
+            if dataset.sessions > 0:
+                return
+            del self._datasets[file_hash]
+        with dataset.lock:
+            dataset.df = None
+            for path in (dataset.path, dataset.source_path):
+                if path is not None:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def dataset_bytes(self, file_hash: str | None) -> int:
+        with self._lock:
+            dataset = self._datasets.get(file_hash)
+        return dataset.bytes if dataset is not None else 0
+
+    def memory_bytes(self) -> int:
+        """Bytes dos DataFrames base mantidos em memória (cada dataset conta uma vez)."""
+        with self._lock:
+            return sum(d.bytes for d in self._datasets.values() if d.df is not None)
+
+    def status(self) -> list:
+        with self._lock:
+            datasets = list(self._datasets.values())
+        return sorted((
+            {
+                "dataset": d.name,
+                "hash": d.file_hash[:8],
+                "mb": round(d.bytes / 1024 / 1024, 2),
+                "sessões": d.sessions,
+                "ativas": d.active,
+                "em_memória": d.df is not None,
+                "fora_da_memória": d.source_path is not None,
+            }
+            for d in datasets
+        ), key=lambda r: r["mb"], reverse=True)
+
+
+def dataset_hash(df) -> str | None:
+    """Hash do arquivo que originou o DataFrame, se ele veio do registro."""
+    return getattr(df, "attrs", {}).get(DATASET_HASH_ATTR)
+
+
+_registry = DatasetRegistry()
+
+
+def get_registry() -> DatasetRegistry:
+    """Registro único de datasets do processo."""
+    return _registry
@@ -0,0 +1,122 @@
+"""
+Leitura tolerante das respostas em JSON dos agentes.
+
+Mesmo no modo JSON do provedor, a resposta pode chegar com cercas de markdown,
+texto ao redor, vírgulas sobrando, aspas tipográficas ou simples, literais do
+Python ou truncada. `parse_json_object` localiza o primeiro objeto e tenta o
+decodificador padrão; se falhar, aplica um único reparo local, sem nova chamada
+ao LLM. Cada leitura é contabilizada por agente como direta, reparada ou falha.
+"""
+import json
+import re
+
+from utils.telemetry import record_parse
+
+_DECODER = json.JSONDecoder()
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'"})
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_STRING_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+class JSONOutputError(ValueError):
+    """A resposta do agente não contém um objeto JSON legível, nem após o reparo."""
+
+
+def _close_value(out: list):
+    """Antes de fechar um objeto ou lista: remove a vírgula final e completa um valor ausente com null."""
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+    if out and out[-1] == ":":
+        out.append("null")
+
+
+def repair_json(text: str) -> str:
+    """
+    Reescreve o primeiro objeto do texto como JSON válido, em uma única passada.
+
+    Converte aspas simples e tipográficas, literais do Python e chaves sem
+    aspas, escapa quebras de linha dentro de strings, remove vírgulas finais e
+    fecha strings, listas e objetos truncados.
+    """
+    text = text.translate(_SMART_QUOTES)
+    out, stack, quote = [], [], None
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote is not None:
+            # Dentro de uma string (aberta com `quote`)
+            if ch == "\\" and i + 1 < len(text):
+                escaped = text[i + 1]
+                out.append("'" if escaped == "'" else ch + escaped)
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+            else:
+                out.append(_STRING_ESCAPES.get(ch, ch))
+        elif ch in "\"'":
+            out.append('"')
+            quote = ch
+        elif ch in "{[":
+            out.append(ch)
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            _close_value(out)
+            out.append(stack.pop() if stack else ch)
+            if not stack:
+                break  # fim do objeto de nível superior; o restante é texto ao redor
+        elif ch == "_" or ch.isalpha():
+            word = _WORD.match(text, i).group(0)
+            rest = text[i + len(word):].lstrip()
+            if word in _LITERALS or word in ("true", "false", "null"):
+                out.append(_LITERALS.get(word, word))
+            elif rest.startswith(":"):
+                out.append(json.dumps(word))  # chave sem aspas
+            else:
+                out.append(word)
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # Resposta truncada: fecha a string, completa o valor pendente e fecha listas e objetos
+    if quote is not None:
+        out.append('"')
+    _close_value(out)
+    out.extend(reversed(stack))
+    return "".join(out)
+
+
+def parse_json_object(raw_output: str, agent: str) -> dict:
+    """Primeiro objeto JSON da resposta do `agent`; levanta JSONOutputError se nem o reparo resolver."""
+    raw_output = raw_output or ""
+    start = raw_output.find("{")
+    if start == -1:
+        record_parse(agent, "failed")
+        raise JSONOutputError("A resposta não contém um objeto JSON.")
+    text = raw_output[start:]
+
+    try:
+        # raw_decode ignora o que vier depois do objeto (cercas de markdown, explicações)
+        value, _ = _DECODER.raw_decode(text)
+        outcome = "direct"
+    except json.JSONDecodeError:
+        try:
+            value = json.loads(repair_json(text))
+            outcome = "repaired"
+        except json.JSONDecodeError as e:
+            record_parse(agent, "failed")
+            raise JSONOutputError(f"JSON inválido mesmo após o reparo: {e}") from e
+
+    if not isinstance(value, dict):
+        record_parse(agent, "failed")
+        raise JSONOutputError("A resposta não é um objeto JSON.")
+    record_parse(agent, outcome)
+    return value
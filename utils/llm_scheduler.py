@@ -0,0 +1,249 @@
+"""
+Agendador global das requisições ao LLM.
+
+Todas as chamadas dos agentes passam por aqui: um token bucket limita a taxa
+de requisições do processo, um limite de concorrência evita rajadas, a fila
+é ordenada por prioridade (resposta ao usuário > roteamento > sugestões >
+pré-busca) e erros de rate limit/indisponibilidade são repetidos com backoff
+exponencial.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+from utils.config import get_config
+
+# Classes de prioridade (menor valor = atendido primeiro)
+PRIORITY_ANSWER = 0
+PRIORITY_ROUTING = 1
+PRIORITY_SUGGESTION = 2
+PRIORITY_PREFETCH = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_ANSWER: "answer",
+    PRIORITY_ROUTING: "routing",
+    PRIORITY_SUGGESTION: "suggestion",
+    PRIORITY_PREFETCH: "prefetch",
+}
+
+# Prioridade mínima das requisições do contexto atual (ex.: turnos de pré-busca em segundo plano)
+_priority_floor = contextvars.ContextVar("llm_priority_floor", default=PRIORITY_ANSWER)
+
+# Fragmentos que identificam erros transitórios do provedor (rate limit, timeout, 5xx)
+_RETRYABLE_MARKERS = (
+    "429", "resource_exhausted", "resourceexhausted", "rate limit", "quota",
+    "503", "unavailable", "deadline", "timeout", "timed out", "500 internal",
+)
+
+
+def set_priority_floor(priority: int):
+    """
+    Rebaixa todas as requisições do contexto atual para no mínimo `priority`.
+
+    Vale para a tarefa corrente e para as tarefas criadas a partir dela.
+    """
+    _priority_floor.set(priority)
+
+
+class SchedulerOverloaded(RuntimeError):
+    """A fila do agendador atingiu o limite e a requisição foi rejeitada."""
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Indica se o erro é transitório e vale uma nova tentativa."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _RETRYABLE_MARKERS)
+
+
+class TokenBucket:
+    """Token bucket simples: `rate` tokens por segundo, até `capacity` acumulados."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> float:
+        """Consome um token e retorna 0, ou retorna quantos segundos faltam para haver um."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class LLMScheduler:
+    """Fila de prioridade com rate limit, concorrência limitada e retentativas."""
+
+    def __init__(self, requests_per_minute: int = 60, max_concurrency: int = 4, max_queue: int = 100,
+                 max_queue_wait: float = 60.0, max_retries: int = 3, base_backoff: float = 1.0,
+                 max_backoff: float = 20.0):
+        self.bucket = TokenBucket(rate=requests_per_minute / 60.0, capacity=max(1, max_concurrency))
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._waiters = []  # heap de (prioridade, sequência, future)
+        self._sequence = itertools.count()
+        self._active = 0
+        self._wakeup = None  # TimerHandle aguardando reposição de tokens
+
+        # Métricas
+        self._wait_times = deque(maxlen=500)
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "retries": 0,
+            "rejected": 0,
+            "queue_timeouts": 0,
+            "by_priority": {name: 0 for name in PRIORITY_NAMES.values()},
+        }
+
+    async def run(self, factory, priority: int = PRIORITY_ANSWER):
+        """
+        Executa `factory()` (que retorna um awaitable) respeitando a fila do agendador.
+
+        Erros transitórios são repetidos com backoff exponencial com jitter;
+        os demais são propagados imediatamente.
+        """
+        priority = max(priority, _priority_floor.get())
+        self._stats["submitted"] += 1
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+        self._stats["by_priority"][priority_name] = self._stats["by_priority"].get(priority_name, 0) + 1
+
+        attempt = 0
+        while True:
+            await self._acquire(priority)
+            try:
+                result = await factory()
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    self._stats["failed"] += 1
+                    raise
+                delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+                delay *= 0.5 + random.random() / 2
+                attempt += 1
+                self._stats["retries"] += 1
+                print(f"LLM indisponível ({type(e).__name__}); nova tentativa {attempt} em {delay:.1f}s")
+            else:
+                self._stats["completed"] += 1
+                return result
+            finally:
+                # A vaga é devolvida uma única vez, inclusive quando a chamada é cancelada
+                self._release()
+            await asyncio.sleep(delay)
+
+    async def _acquire(self, priority: int):
+        """Aguarda a vez na fila de prioridade."""
+        if len(self._waiters) >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise SchedulerOverloaded(
+                f"Fila de requisições ao LLM cheia ({self.max_queue}). Tente novamente em instantes."
+            )
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        enqueued_at = time.monotonic()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_queue_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # A vaga foi concedida no mesmo instante do timeout: devolve
+                self._release()
+            future.cancel()
+            self._stats["queue_timeouts"] += 1
+            raise SchedulerOverloaded(
+                f"Requisição ao LLM aguardou mais de {self.max_queue_wait:.0f}s na fila."
+            )
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            future.cancel()
+            raise
+        self._wait_times.append(time.monotonic() - enqueued_at)
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Libera waiters enquanto houver vaga de concorrência e token disponível."""
+        while self._waiters and self._active < self.max_concurrency:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                # Waiter cancelado ou expirado
+                heapq.heappop(self._waiters)
+                continue
+            if priority >= PRIORITY_PREFETCH and self._active >= self.max_concurrency - 1 > 0:
+                # A última vaga fica reservada para as requisições interativas
+                return
+            wait = self.bucket.try_acquire()
+            if wait > 0:
+                if self._wakeup is None:
+                    loop = asyncio.get_running_loop()
+                    self._wakeup = loop.call_later(wait, self._on_wakeup)
+                return
+            heapq.heappop(self._waiters)
+            self._active += 1
+            future.set_result(None)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def metrics(self) -> dict:
+        """Retorna o estado da fila e as estatísticas de espera."""
+        waits = sorted(self._wait_times)
+
+        def _percentile(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))]
+
+        return {
+            "queue_length": sum(1 for _, _, f in self._waiters if not f.done()),
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "wait_p50_s": round(_percentile(0.50), 3),
+            "wait_p95_s": round(_percentile(0.95), 3),
+            "wait_max_s": round(waits[-1], 3) if waits else 0.0,
+            **self._stats,
+        }
+
+
+_scheduler: LLMScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """Retorna o agendador único do processo, criado a partir da configuração."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            config = get_config()
+            _scheduler = LLMScheduler(
+                requests_per_minute=config["llm_requests_per_minute"],
+                max_concurrency=config["llm_max_concurrency"],
+                max_queue=config["llm_max_queue"],
+            )
+    return _scheduler
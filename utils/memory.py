@@ -1,10 +1,13 @@
 from supabase import create_client, Client
+from utils.tracing import traced
 
 
 class SupabaseMemory:
-    def __init__(self, url: str, key: str):
-        self.client: Client = create_client(url, key)
+    def __init__(self, url: str, key: str, client: Client | None = None):
+        # `client` permite injetar um cliente já criado (ex.: o substituto local dos benchmarks)
+        self.client: Client = client if client is not None else create_client(url, key)
 
+    @traced("supabase.create_session")
     def create_session(self, dataset_name: str, dataset_hash: str, user_id: str) -> str:
         response = self.client.table("sessions").insert({
             "dataset_name": dataset_name,
@@ -13,6 +16,7 @@ class SupabaseMemory:
         }).execute()
         return response.data[0]['id']
 
+    @traced("supabase.log_conversation")
     def log_conversation(self, session_id: str, question: str, answer: str, chart_json: dict | None = None) -> str:
         payload = {
             "session_id": session_id,
@@ -23,6 +27,7 @@ class SupabaseMemory:
         response = self.client.table("conversations").insert(payload).execute()
         return response.data[0]['id']
 
+    @traced("supabase.store_analysis")
     def store_analysis(self, session_id: str, conversation_id: str | None, analysis_type: str, results: dict):
         # Garante que temos pelo menos um ID de conversa válido
         if not conversation_id:
@@ -46,6 +51,7 @@ class SupabaseMemory:
             "results": results
         }).execute()
 
+    @traced("supabase.store_conclusion")
     def store_conclusion(self, session_id: str, conversation_id: str | None, conclusion_text: str,
                          confidence_score: float | None = None):
         # Garante que temos pelo menos um ID de conversa válido
@@ -70,6 +76,7 @@ class SupabaseMemory:
             "confidence_score": confidence_score
         }).execute()
 
+    @traced("supabase.store_generated_code")
     def store_generated_code(self, session_id: str, conversation_id: str, code_type: str, python_code: str,
                              description: str | None):
         # Adicionar proteção contra códigos muito longos que podem causar timeout
@@ -89,6 +96,7 @@ class SupabaseMemory:
             print(f"Erro ao salvar código gerado no banco: {e}")
             # Não relançar a exceção para não interromper o usuário
 
+    @traced("supabase.get_session_history")
     def get_session_history(self, session_id: str) -> dict:
         conversations = self.client.table("conversations").select("*").eq("session_id", session_id).order(
             "created_at").execute().data
@@ -103,11 +111,20 @@ class SupabaseMemory:
             "conclusions": conclusions
         }
 
+    @traced("supabase.get_user_sessions")
     def get_user_sessions(self, user_id: str):
         return self.client.table("sessions").select("id, created_at, dataset_name").eq("user_id", user_id).order(
             "created_at", desc=True).execute().data
 
+    @traced("supabase.get_generated_codes")
     def get_generated_codes(self, session_id: str):
         return self.client.table("generated_codes").select(
             "id, created_at, code_type, python_code, description, conversation_id"
-        ).eq("session_id", session_id).order("created_at", desc=True).execute().data
\ No newline at end of file
+        ).eq("session_id", session_id).order("created_at", desc=True).execute().data
+
+    @traced("supabase.get_recent_generated_codes")
+    def get_recent_generated_codes(self, code_type: str, limit: int = 500):
+        # Todas as sessões: alimenta o reaproveitamento de códigos entre datasets
+        return self.client.table("generated_codes").select(
+            "python_code, description"
+        ).eq("code_type", code_type).order("created_at", desc=True).limit(limit).execute().data
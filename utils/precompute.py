@@ -0,0 +1,468 @@
+"""
+Pré-cálculo em segundo plano ao carregar um dataset.
+
+Logo após o upload, um trabalho por dataset (identificado pelos hashes dos
+arquivos) calcula em paralelo, no pool de threads do loop compartilhado:
+
+- o perfil das colunas (tipos, ausentes, únicos, estatísticas e valores mais
+  frequentes);
+- as matrizes de correlação (Pearson e Spearman) e os pares mais correlacionados;
+- o resumo de outliers pelo critério de Tukey (IQR);
+- o cubo de agregações, usado nas perguntas de quebra por categoria;
+- os gráficos de visão geral, montados pelo cubo e pelos modelos locais e
+  executados pelo cache de gráficos: a mesma pergunta no chat encontra a
+  figura pronta;
+- etapas extras da aplicação (ex.: as sugestões iniciais do LLM, com a
+  prioridade da pré-busca).
+
+Cada resultado é publicado assim que fica pronto; `status()` informa o
+progresso para a interface e `summary()` resume o perfil, as correlações e os
+outliers para o contexto dos agentes. Sessões com o mesmo arquivo
+compartilham o trabalho, e `cancel()` (dataset removido ou substituído)
+interrompe as etapas pendentes quando nenhuma outra sessão usa o dataset; a
+sessão encerrada (os recursos da sessão coletados, como no gerenciador de
+memória das sessões) também deixa de contar como usuária do dataset. Os
+resultados guardados respeitam o orçamento `precompute_memory_mb`: acima dele,
+saem primeiro os dos datasets sem sessão e usados há mais tempo.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+
+from utils.aggregate_cube import get_cube, is_cube_question, match_cube_question
+from utils.async_runtime import run_blocking, submit
+from utils.chart_cache import exec_with_cache
+from utils.chart_templates import CATEGORICAL, MAX_BAR_CATEGORIES, NUMERIC, column_kind, match_template
+from utils.config import get_config
+from utils.llm_scheduler import PRIORITY_PREFETCH, set_priority_floor
+from utils.query_engine import out_of_core_info
+from utils.tracing import start_span
+
+# Datasets com resultados guardados (LRU; também limitados por `precompute_memory_mb`)
+MAX_CACHED_DATASETS = 32
+# Colunas numéricas consideradas nas correlações
+MAX_CORRELATION_COLUMNS = 50
+# Pares mais correlacionados no resumo
+TOP_CORRELATION_PAIRS = 10
+# Valores mais frequentes por coluna categórica no perfil
+TOP_VALUES = 5
+# Gráficos de visão geral por tipo
+OVERVIEW_HISTOGRAMS = 3
+OVERVIEW_BARS = 2
+# Colunas e pares descritos no resumo enviado aos agentes
+SUMMARY_COLUMNS = 30
+SUMMARY_PAIRS = 5
+_SUMMARY_STATS = ("mean", "std", "min", "50%", "max")
+# Atributos das figuras com os dados dos traços (contados no orçamento)
+_TRACE_DATA_ATTRS = ("x", "y", "z", "values", "labels", "text", "customdata", "lowerfence", "q1", "median", "q3",
+                     "upperfence")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+def profile_dataset(df: pd.DataFrame) -> dict:
+    """Perfil por coluna: tipo, ausentes, valores únicos e estatísticas (numéricas) ou mais frequentes."""
+    missing = df.isna().sum()
+    unique = df.nunique(dropna=True)
+    numeric = df.select_dtypes(include="number")
+    stats = numeric.describe().T if not numeric.empty else pd.DataFrame()
+    columns = {}
+    for column in df.columns:
+        entry = {
+            "dtype": str(df.dtypes[column]),
+            "kind": column_kind(df[column]),
+            "missing": int(missing[column]),
+            "unique": int(unique[column]),
+        }
+        if column in stats.index:
+            entry["stats"] = {k: None if pd.isna(v) else round(float(v), 4)
+                              for k, v in stats.loc[column].items() if k != "count"}
+        elif entry["kind"] == CATEGORICAL:
+            top = df[column].value_counts(dropna=True).head(TOP_VALUES)
+            entry["top_values"] = {str(value): int(count) for value, count in top.items()}
+        columns[str(column)] = entry
+    return {"rows": int(df.shape[0]), "columns": columns}
+
+
+def correlation_summary(df: pd.DataFrame) -> dict:
+    """Matrizes de correlação (Pearson e Spearman) e os pares com maior correlação absoluta."""
+    numeric = df.select_dtypes(include="number").iloc[:, :MAX_CORRELATION_COLUMNS]
+    numeric = numeric.loc[:, numeric.nunique(dropna=True) > 1]
+    if numeric.shape[1] < 2:
+        return {"pearson": None, "spearman": None, "top_pairs": []}
+    pearson = numeric.corr(method="pearson")
+    spearman = numeric.corr(method="spearman")
+    # Triângulo superior da matriz, sem a diagonal
+    upper = pearson.where(np.triu(np.ones(pearson.shape, dtype=bool), k=1)).stack().dropna()
+    top = upper.reindex(upper.abs().sort_values(ascending=False).index).head(TOP_CORRELATION_PAIRS)
+    return {
+        "pearson": pearson,
+        "spearman": spearman,
+        "top_pairs": [{"x": str(a), "y": str(b), "r": round(float(r), 4)} for (a, b), r in top.items()],
+    }
+
+
+def outlier_summary(df: pd.DataFrame) -> dict:
+    """Outliers por coluna numérica pelo critério de Tukey (fora de Q1 - 1,5·IQR e Q3 + 1,5·IQR)."""
+    numeric = df.select_dtypes(include="number")
+    if numeric.empty:
+        return {}
+    quartiles = numeric.quantile([0.25, 0.75])
+    q1, q3 = quartiles.loc[0.25], quartiles.loc[0.75]
+    lower, upper = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    counts = ((numeric < lower) | (numeric > upper)).sum()
+    present = numeric.notna().sum()
+    return {
+        str(column): {
+            "count": int(counts[column]),
+            "pct": round(100 * float(counts[column]) / float(present[column]), 2) if present[column] else 0.0,
+            "lower": None if pd.isna(lower[column]) else round(float(lower[column]), 4),
+            "upper": None if pd.isna(upper[column]) else round(float(upper[column]), 4),
+        }
+        for column in numeric.columns
+    }
+
+
+def overview_questions(df: pd.DataFrame) -> list:
+    """Perguntas da visão geral, atendidas pelos modelos de gráficos."""
+    kinds = {column: column_kind(df[column]) for column in df.columns}
+    numeric = [c for c, kind in kinds.items() if kind == NUMERIC and df[c].nunique(dropna=True) > 1]
+    categorical = [c for c, kind in kinds.items()
+                   if kind == CATEGORICAL and 1 < df[c].nunique(dropna=True) <= MAX_BAR_CATEGORIES]
+    questions = ["Mostre um heatmap de correlação entre as variáveis"] if len(numeric) >= 2 else []
+    questions += [f"Mostre o histograma de {c}" for c in numeric[:OVERVIEW_HISTOGRAMS]]
+    questions += [f"Gráfico de barras com a contagem por {c}" for c in categorical[:OVERVIEW_BARS]]
+    return questions
+
+
+def overview_charts(df: pd.DataFrame, tables: dict | None = None) -> list:
+    """
+    Gráficos de visão geral: [{"question", "template", "code", "figure"}].
+
+    As figuras passam pelo cache de gráficos com as mesmas tabelas do chat.
+    Datasets fora da memória ficam de fora (os modelos não os atendem).
+    """
+    if out_of_core_info(df) is not None:
+        return []
+    charts = []
+    questions = overview_questions(df)
+    cube = get_cube(df) if any(is_cube_question(question, df) for question in questions) else None
+    for question in questions:
+        # Mesma ordem do chat: quebras pelo cubo, os demais pelos modelos
+        match = match_cube_question(question, df, cube) or match_template(question, df)
+        if match is None:
+            continue
+        try:
+            figure = exec_with_cache(match["code"], df, tables=tables)
+        except Exception as e:
+            print(f"Erro no gráfico de visão geral ({question}): {e}")
+            continue
+        if figure is not None:
+            charts.append({"question": question, "template": match.get("template", "cube"), "code": match["code"],
+                           "figure": figure})
+    return charts
+
+
+def cube_summary(df: pd.DataFrame) -> dict | None:
+    """Monta o cubo de agregações do dataset e retorna o resumo (None se indisponível)."""
+    cube = get_cube(df)
+    return cube.metrics() if cube is not None else None
+
+
+def result_bytes(value) -> int:
+    """Estimativa dos bytes de um resultado: DataFrames, arrays e os dados dos traços das figuras."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(result_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(result_bytes(v) for v in value)
+    if hasattr(value, "data") and hasattr(value, "layout"):
+        # Figura Plotly: os arrays dos traços dominam o tamanho
+        return sum(_trace_bytes(getattr(trace, attr, None)) for trace in value.data for attr in _TRACE_DATA_ATTRS
+                   if attr in trace)
+    if isinstance(value, str):
+        return len(value)
+    return 0
+
+
+def _trace_bytes(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return 8 * len(value)
+    return 0
+
+
+def format_summary(results: dict) -> str:
+    """Perfil, correlações e outliers pré-calculados em texto compacto para o prompt dos agentes."""
+    lines = []
+    profile = results.get("profile")
+    if profile:
+        lines.append(f"Perfil pré-calculado do dataset completo ({profile['rows']} linhas):")
+        for name, entry in list(profile["columns"].items())[:SUMMARY_COLUMNS]:
+            details = [entry["dtype"], f"ausentes={entry['missing']}", f"únicos={entry['unique']}"]
+            stats = entry.get("stats") or {}
+            details += [f"{k}={stats[k]}" for k in _SUMMARY_STATS if stats.get(k) is not None]
+            if entry.get("top_values"):
+                details.append("mais frequentes=" + ", ".join(f"{v} ({c})" for v, c in entry["top_values"].items()))
+            lines.append(f"- {name}: " + "; ".join(details))
+    correlations = results.get("correlations")
+    if correlations and correlations.get("top_pairs"):
+        pairs = correlations["top_pairs"][:SUMMARY_PAIRS]
+        lines.append("Correlações de Pearson mais fortes: "
+                     + "; ".join(f"{p['x']} × {p['y']}: r={p['r']}" for p in pairs))
+    outliers = results.get("outliers")
+    if outliers:
+        flagged = [f"{name}: {o['count']} ({o['pct']}%)" for name, o in outliers.items() if o["count"]]
+        if flagged:
+            lines.append("Outliers (IQR): " + "; ".join(flagged[:SUMMARY_COLUMNS]))
+    return "\n".join(lines)
+
+
+def dataset_steps(df: pd.DataFrame, tables: dict | None = None) -> dict:
+    """Etapas de dados do pré-cálculo: nome -> função que retorna a corrotina da etapa."""
+    return {
+        "cube": lambda: run_blocking(cube_summary, df),
+        "profile": lambda: run_blocking(profile_dataset, df),
+        "correlations": lambda: run_blocking(correlation_summary, df),
+        "outliers": lambda: run_blocking(outlier_summary, df),
+        "overview_charts": lambda: run_blocking(overview_charts, df, tables),
+    }
+
+
+class PrecomputeJob:
+    """Pré-cálculo de um dataset: estado e resultado de cada etapa."""
+
+    def __init__(self, dataset_key: str, steps: list):
+        self.dataset_key = dataset_key
+        self.states = {name: PENDING for name in steps}
+        self.results = {}
+        self.errors = {}
+        self.seconds = {}
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.cancelled = False
+        self.future = None
+        self.bytes = 0
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def status(self) -> dict:
+        finished = sum(state in (DONE, FAILED) for state in self.states.values())
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return {"done": self.done, "cancelled": self.cancelled, "finished": finished, "total": len(self.states),
+                "steps": dict(self.states), "errors": dict(self.errors), "seconds": round(elapsed, 2)}
+
+
+class Precomputer:
+    """Trabalhos de pré-cálculo do processo, por dataset, e as sessões que usam cada um."""
+
+    def __init__(self):
+        self._jobs = OrderedDict()  # dataset -> PrecomputeJob
+        self._sessions = {}         # sessão -> dataset
+        self._owners = {}           # sessão -> finalizador do objeto que representa a sessão
+        self._ended = deque()       # sessões encerradas, removidas na próxima operação com o lock
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "shared": 0, "completed": 0, "cancelled": 0, "failed_steps": 0, "evicted": 0}
+
+    def start(self, session_key, dataset_key: str, steps: dict, owner=None) -> PrecomputeJob:
+        """
+        Inicia (ou reaproveita) o pré-cálculo do dataset para a sessão.
+
+        `steps`: nome -> função sem argumentos que retorna a corrotina da etapa.
+        O dataset anterior da sessão é cancelado se nenhuma outra sessão o usar.
+        Quando `owner` (ex.: os `SessionResources` da sessão) é coletado, a
+        sessão é considerada encerrada e sai do registro.
+        """
+        if owner is not None:
+            self._watch(session_key, owner)
+        with self._lock:
+            self._prune_ended()
+            previous = self._sessions.get(session_key)
+            self._sessions[session_key] = dataset_key
+            if previous is not None and previous != dataset_key:
+                self._release(previous)
+            job = self._jobs.get(dataset_key)
+            if job is not None and not job.cancelled:
+                self._jobs.move_to_end(dataset_key)
+                self._stats["shared"] += 1
+                return job
+            job = self._jobs[dataset_key] = PrecomputeJob(dataset_key, list(steps))
+            while len(self._jobs) > MAX_CACHED_DATASETS:
+                _, evicted = self._jobs.popitem(last=False)
+                self._cancel_job(evicted)
+            self._stats["started"] += 1
+        job.future = submit(self._run(job, steps))
+        return job
+
+    async def _run(self, job: PrecomputeJob, steps: dict):
+        # Tudo o que o pré-cálculo pede ao LLM fica atrás das perguntas dos usuários
+        set_priority_floor(PRIORITY_PREFETCH)
+
+        async def run_step(name, factory):
+            if job.cancelled:
+                return
+            job.states[name] = RUNNING
+            started_at = time.perf_counter()
+            with start_span("precompute_step", step=name) as span:
+                try:
+                    result = await factory()
+                except asyncio.CancelledError:
+                    job.states[name] = CANCELLED
+                    raise
+                except Exception as e:
+                    print(f"Erro no pré-cálculo ({name}): {e}")
+                    job.states[name] = FAILED
+                    job.errors[name] = f"{type(e).__name__}: {e}"[:300]
+                    self._stats["failed_steps"] += 1
+                    span.set_attribute("error", job.errors[name])
+                    return
+            job.seconds[name] = round(time.perf_counter() - started_at, 3)
+            if not job.cancelled:
+                job.results[name] = result
+                job.bytes += result_bytes(result)
+                job.states[name] = DONE
+                self.enforce_budget(current=job)
+
+        with start_span("precompute", steps=len(steps)):
+            try:
+                await asyncio.gather(*(run_step(name, factory) for name, factory in steps.items()))
+            finally:
+                job.finished_at = time.monotonic()
+        if not job.cancelled:
+            self._stats["completed"] += 1
+
+    def job(self, session_key) -> PrecomputeJob | None:
+        with self._lock:
+            dataset_key = self._sessions.get(session_key)
+            return self._jobs.get(dataset_key) if dataset_key is not None else None
+
+    def result(self, session_key, step: str):
+        """Resultado da etapa para o dataset da sessão, ou None se ainda não estiver pronto."""
+        job = self.job(session_key)
+        return job.results.get(step) if job is not None else None
+
+    def summary(self, file_hash: str | None) -> str:
+        """
+        Resumo do perfil, das correlações e dos outliers do arquivo para o contexto dos agentes.
+
+        Vazio enquanto nenhuma dessas etapas terminou (ou sem pré-cálculo para o arquivo).
+        """
+        if file_hash is None:
+            return ""
+        with self._lock:
+            job = next((job for key, job in reversed(self._jobs.items())
+                        if key.split("|")[0] == file_hash and not job.cancelled), None)
+        return format_summary(job.results) if job is not None else ""
+
+    def status(self, session_key) -> dict | None:
+        job = self.job(session_key)
+        return job.status() if job is not None else None
+
+    def _watch(self, session_key, owner):
+        with self._lock:
+            self._prune_ended()
+            finalizer = self._owners.get(session_key)
+            if finalizer is not None and finalizer.alive and finalizer.peek()[0] is owner:
+                return
+            if finalizer is not None:
+                finalizer.detach()
+            # O finalizador roda durante a coleta de lixo, possivelmente com o lock em uso: só enfileira
+            self._owners[session_key] = weakref.finalize(owner, self._ended.append, session_key)
+
+    def _prune_ended(self):
+        # Chamado com o lock
+        while self._ended:
+            session_key = self._ended.popleft()
+            self._owners.pop(session_key, None)
+            dataset_key = self._sessions.pop(session_key, None)
+            if dataset_key is not None:
+                self._release(dataset_key)
+
+    def cancel(self, session_key):
+        """A sessão deixou de usar o dataset (removido ou substituído): cancela o que estiver pendente."""
+        with self._lock:
+            self._prune_ended()
+            dataset_key = self._sessions.pop(session_key, None)
+            if dataset_key is not None:
+                self._release(dataset_key)
+
+    def _release(self, dataset_key: str):
+        # Chamado com o lock: resultados prontos continuam guardados para outras sessões com o mesmo arquivo
+        if dataset_key in self._sessions.values():
+            return
+        job = self._jobs.get(dataset_key)
+        if job is not None and not job.done:
+            del self._jobs[dataset_key]
+            self._cancel_job(job)
+
+    def _cancel_job(self, job: PrecomputeJob):
+        if job.done or job.cancelled:
+            return
+        job.cancelled = True
+        for name, state in job.states.items():
+            if state in (PENDING, RUNNING):
+                job.states[name] = CANCELLED
+        if job.future is not None:
+            job.future.cancel()
+        self._stats["cancelled"] += 1
+
+    @property
+    def budget_bytes(self) -> int:
+        return get_config()["precompute_memory_mb"] * 1024 * 1024
+
+    def enforce_budget(self, current: PrecomputeJob | None = None):
+        """
+        Acima do orçamento, descarta os resultados dos datasets sem sessão e,
+        depois, dos usados há mais tempo, preservando o atual e os em andamento.
+        """
+        with self._lock:
+            total = sum(job.bytes for job in self._jobs.values())
+            if total <= self.budget_bytes:
+                return
+            self._prune_ended()
+            referenced = set(self._sessions.values())
+            candidates = sorted(
+                (key for key, job in self._jobs.items() if job is not current and job.done),
+                key=lambda key: key in referenced,
+            )
+            for key in candidates:
+                if total <= self.budget_bytes:
+                    break
+                total -= self._jobs.pop(key).bytes
+                self._stats["evicted"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            self._prune_ended()
+            running = sum(1 for job in self._jobs.values() if not job.done)
+            memory = sum(job.bytes for job in self._jobs.values())
+            return {"datasets": len(self._jobs), "sessions": len(self._sessions), "running": running,
+                    "mb": round(memory / 1024 / 1024, 2), "budget_mb": get_config()["precompute_memory_mb"],
+                    **self._stats}
+
+
+_precomputer = Precomputer()
+
+
+def get_precomputer() -> Precomputer:
+    """Pré-cálculo único do processo."""
+    return _precomputer
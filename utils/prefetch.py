@@ -0,0 +1,162 @@
+"""
+Pré-busca especulativa das respostas às sugestões de perguntas.
+
+Enquanto o usuário lê a resposta, os turnos das sugestões exibidas são
+calculados em segundo plano no loop compartilhado. Cada resultado fica guardado
+pela sessão, pelo contexto da conversa (histórico, análises e arquivos) e pela
+pergunta: quando o usuário clica na sugestão com o mesmo contexto, o turno
+pronto é usado; se ainda estiver em andamento, a sessão aguarda o resultado em
+vez de começar do zero. Um contexto novo cancela as pré-buscas pendentes.
+
+O custo é limitado: a pré-busca é opcional (`prefetch_enabled`), cada sessão
+tem um máximo de turnos pré-buscados (`prefetch_max_per_session`) e nada é
+agendado enquanto houver requisições aguardando na fila do agendador.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeoutError
+
+from utils.async_runtime import submit
+from utils.config import get_config
+from utils.llm_scheduler import get_scheduler
+from utils.telemetry import record_cache
+
+# Quantidade máxima de sessões acompanhadas (LRU)
+MAX_TRACKED_SESSIONS = 1000
+
+
+def context_key(*parts) -> str:
+    """Hash do contexto da conversa; qualquer mudança invalida as pré-buscas da sessão."""
+    return hashlib.md5("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class _SessionPrefetch:
+    """Pré-buscas de uma sessão para o contexto atual."""
+
+    def __init__(self):
+        self.context = None
+        self.futures = {}  # pergunta -> Future do turno
+        self.spent = 0     # turnos pré-buscados desde o início da sessão
+
+
+class Prefetcher:
+    """Turnos pré-buscados de todas as sessões do processo."""
+
+    def __init__(self):
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "scheduled": 0,
+            "used": 0,
+            "joined": 0,  # usados depois de aguardar a pré-busca em andamento
+            "missed": 0,
+            "discarded": 0,
+            "failed": 0,
+            "skipped_busy": 0,
+            "skipped_budget": 0,
+        }
+
+    def _session(self, session_key) -> _SessionPrefetch:
+        state = self._sessions.get(session_key)
+        if state is None:
+            state = self._sessions[session_key] = _SessionPrefetch()
+            while len(self._sessions) > MAX_TRACKED_SESSIONS:
+                _, evicted = self._sessions.popitem(last=False)
+                self._discard(evicted)
+        else:
+            self._sessions.move_to_end(session_key)
+        return state
+
+    def _discard(self, state: _SessionPrefetch):
+        for future in state.futures.values():
+            future.cancel()
+        self._stats["discarded"] += len(state.futures)
+        state.futures.clear()
+
+    def schedule(self, session_key, context: str, questions: list, factory) -> int:
+        """
+        Agenda `factory(pergunta)` (uma corrotina que retorna o turno) para as perguntas ainda não buscadas.
+
+        Retorna quantas pré-buscas foram agendadas.
+        """
+        config = get_config()
+        if not config["prefetch_enabled"]:
+            return 0
+        with self._lock:
+            state = self._session(session_key)
+            if state.context != context:
+                self._discard(state)
+                state.context = context
+            pending = [q for q in dict.fromkeys(questions) if q and q not in state.futures]
+            if not pending:
+                return 0
+            if get_scheduler().metrics()["queue_length"] > 0:
+                # Requisições interativas aguardando: a pré-busca fica para a próxima execução
+                self._stats["skipped_busy"] += 1
+                return 0
+            budget = max(0, config["prefetch_max_per_session"] - state.spent)
+            if len(pending) > budget:
+                self._stats["skipped_budget"] += len(pending) - budget
+                pending = pending[:budget]
+            for question in pending:
+                # O contexto da thread do Streamlit (sessão, telemetria) acompanha a corrotina
+                state.futures[question] = submit(factory(question))
+            state.spent += len(pending)
+            self._stats["scheduled"] += len(pending)
+            return len(pending)
+
+    def take(self, session_key, context: str, question: str) -> dict | None:
+        """Turno pré-buscado da pergunta no contexto atual, ou None para executar o turno normalmente."""
+        config = get_config()
+        if not config["prefetch_enabled"]:
+            return None
+        with self._lock:
+            state = self._sessions.get(session_key)
+            future = None
+            if state is not None and state.context == context:
+                future = state.futures.pop(question, None)
+        if future is None:
+            self._stats["missed"] += 1
+            record_cache("prefetch", hit=False)
+            return None
+
+        was_done = future.done()
+        try:
+            turn = future.result(timeout=config["prefetch_wait_seconds"])
+        except (FutureTimeoutError, CancelledError):
+            future.cancel()
+            turn = None
+        except Exception as e:
+            print(f"Erro na pré-busca da sugestão: {e}")
+            turn = None
+        if turn is None or turn["errors"]:
+            self._stats["failed"] += 1
+            record_cache("prefetch", hit=False)
+            return None
+
+        self._stats["used"] += 1
+        self._stats["joined"] += int(not was_done)
+        record_cache("prefetch", hit=True)
+        return turn
+
+    def cancel(self, session_key):
+        """Cancela as pré-buscas pendentes da sessão (novo dataset, histórico limpo)."""
+        with self._lock:
+            state = self._sessions.get(session_key)
+            if state is not None:
+                self._discard(state)
+                state.context = None
+
+    def metrics(self) -> dict:
+        with self._lock:
+            pending = sum(1 for s in self._sessions.values() for f in s.futures.values() if not f.done())
+            return {"sessions": len(self._sessions), "pending": pending, **self._stats}
+
+
+_prefetcher = Prefetcher()
+
+
+def get_prefetcher() -> Prefetcher:
+    """Pré-buscador único do processo."""
+    return _prefetcher
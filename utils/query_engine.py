@@ -0,0 +1,242 @@
+"""
+Motor de consultas SQL sobre as tabelas da sessão (DuckDB, em processo).
+
+Cada arquivo enviado vira uma tabela. O código gerado pelos agentes pode chamar
+`sql("SELECT ...")` para fazer joins e agregações: o DuckDB lê os DataFrames
+registrados sem copiá-los, aplica os filtros e projeções direto na varredura e
+executa em paralelo, materializando em pandas apenas o resultado.
+
+Arquivos grandes (modo fora da memória) são convertidos uma vez para Parquet e
+a tabela SQL lê o arquivo no disco; em `tables` fica apenas uma amostra, marcada
+em `df.attrs[OUT_OF_CORE_ATTR]` com o caminho do Parquet e o total de linhas.
+
+O DuckDB é opcional: sem ele, `sql()` informa que o recurso não está disponível
+e as tabelas continuam acessíveis como DataFrames em `tables`.
+"""
+import os
+import re
+import tempfile
+
+import pandas as pd
+
+from utils.config import get_config
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - dependência opcional
+    duckdb = None
+
+# Colunas listadas por tabela no preview enviado aos agentes
+MAX_PREVIEW_COLS = 30
+
+# Chave em `df.attrs` das amostras de datasets fora da memória: {"path", "rows", "sample_rows"}
+OUT_OF_CORE_ATTR = "out_of_core"
+SPILL_DIR = os.path.join(tempfile.gettempdir(), "insightagent_duckdb")
+
+
+def is_available() -> bool:
+    """Indica se o DuckDB está instalado."""
+    return duckdb is not None
+
+
+def out_of_core_info(df) -> dict | None:
+    """Metadados do modo fora da memória se `df` for a amostra de um dataset em Parquet."""
+    return getattr(df, "attrs", {}).get(OUT_OF_CORE_ATTR)
+
+
+def connect():
+    """Conexão DuckDB em memória com limite de memória e despejo em disco."""
+    if duckdb is None:
+        raise RuntimeError("DuckDB não está instalado. Instale com `pip install duckdb` para usar sql().")
+    con = duckdb.connect(database=":memory:")
+    con.execute("SET enable_progress_bar = false")
+    con.execute(f"SET memory_limit = '{get_config()['duckdb_memory_limit_mb']}MB'")
+    con.execute(f"SET temp_directory = '{_sql_path(SPILL_DIR)}'")
+    return con
+
+
+def _sql_path(path: str) -> str:
+    return path.replace("'", "''")
+
+
+def table_name_for(filename: str, existing=()) -> str:
+    """Nome de tabela SQL válido e único a partir do nome do arquivo."""
+    base = os.path.splitext(os.path.basename(filename or "tabela"))[0].lower()
+    name = re.sub(r"[^a-z0-9_]+", "_", base).strip("_") or "tabela"
+    if name[0].isdigit():
+        name = f"t_{name}"
+    candidate, suffix = name, 2
+    while candidate in existing:
+        candidate = f"{name}_{suffix}"
+        suffix += 1
+    return candidate
+
+
+def validate_select(query: str) -> str:
+    """Garante que a consulta é um único SELECT (somente leitura); retorna o texto sem `;` final."""
+    if duckdb is None:
+        raise RuntimeError("DuckDB não está instalado. Instale com `pip install duckdb` para usar sql().")
+    query = (query or "").strip().rstrip(";").strip()
+    try:
+        statements = duckdb.extract_statements(query)
+    except Exception as e:
+        raise ValueError(f"SQL inválido: {e}") from e
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        raise ValueError("Apenas uma consulta SELECT é permitida.")
+    return query
+
+
+class QueryEngine:
+    """
+    Conexão DuckDB em memória com as tabelas da sessão registradas como views.
+
+    Depois do registro, o acesso a arquivos fica restrito aos Parquet das
+    tabelas e a configuração é travada: as consultas não leem nem gravam
+    outros arquivos nem instalam extensões.
+    """
+
+    def __init__(self, tables: dict):
+        self._con = connect()
+        allowed_paths = []
+        for name, df in tables.items():
+            source = out_of_core_info(df)
+            if source is not None:
+                # Dataset fora da memória: a consulta lê o Parquet completo, não a amostra
+                self._con.execute(f'CREATE VIEW "{name}" AS SELECT * FROM read_parquet(\'{_sql_path(source["path"])}\')')
+                allowed_paths.append(source["path"])
+            else:
+                # Registro sem cópia: o DuckDB varre o DataFrame diretamente
+                self._con.register(name, df)
+        paths = ", ".join(f"'{_sql_path(path)}'" for path in allowed_paths)
+        self._con.execute(f"SET allowed_paths = [{paths}]")
+        self._con.execute("SET enable_external_access = false")
+        self._con.execute("SET lock_configuration = true")
+
+    def sql(self, query: str) -> pd.DataFrame:
+        """Executa a consulta e retorna o resultado como DataFrame."""
+        return self._con.execute(query).df()
+
+    def result_columns(self, query: str) -> list:
+        """Colunas do resultado, obtidas do plano da consulta sem executá-la."""
+        return [row[0] for row in self._con.execute(f"DESCRIBE {query}").fetchall()]
+
+    def close(self):
+        self._con.close()
+
+
+def sql_tables(df, tables: dict | None = None) -> dict:
+    """Tabelas visíveis no SQL: as da sessão e a principal também como `df`."""
+    return {"df": df, **(tables or {})} if df is not None else dict(tables or {})
+
+
+def make_sql_function(tables: dict):
+    """
+    Função `sql(query)` para o escopo de execução do código gerado.
+
+    A conexão só é criada na primeira chamada, então códigos que não usam SQL
+    não pagam o custo de registrar as tabelas.
+    """
+    engine = None
+
+    def sql(query: str) -> pd.DataFrame:
+        nonlocal engine
+        if engine is None:
+            engine = QueryEngine(tables)
+        return engine.sql(query)
+
+    return sql
+
+
+def needs_table_summary(tables: dict | None) -> bool:
+    """O resumo das tabelas vai para os agentes se houver várias ou alguma fora da memória."""
+    return bool(tables) and (len(tables) > 1 or any(out_of_core_info(df) is not None for df in tables.values()))
+
+
+def describe_tables(tables: dict, primary: str | None = None) -> str:
+    """Resumo das tabelas (linhas e colunas com tipos) para o preview dos agentes."""
+    if is_available():
+        header = ('Tabelas disponíveis (DataFrames em `tables["nome"]`). Para joins e agregações use '
+                  'sql("SELECT ...") (DuckDB, retorna um DataFrame; nomes de colunas com espaços entre aspas duplas):')
+    else:
+        header = 'Tabelas disponíveis (DataFrames em `tables["nome"]`):'
+    lines = [header]
+    for name, df in tables.items():
+        cols = df.columns.tolist()[:MAX_PREVIEW_COLS]
+        columns = ", ".join(f"{c} ({df.dtypes[c]})" for c in cols)
+        marker = " [também disponível como `df`]" if name == primary else ""
+        source = out_of_core_info(df)
+        if source is not None:
+            rows = (f"{source['rows']} linhas (fora da memória: o DataFrame é uma amostra de "
+                    f"{source['sample_rows']} linhas; use sql() para resultados exatos)")
+        else:
+            rows = f"{df.shape[0]} linhas"
+        lines.append(f"- {name}{marker}: {rows}; colunas: {columns}")
+    return "\n".join(lines) + "\n"
+
+
+def csv_to_parquet(csv_path: str, parquet_path: str):
+    """
+    Converte o CSV para Parquet em streaming (a memória usada não depende do tamanho do arquivo).
+
+    Separador e tipos são detectados pelo DuckDB; se o arquivo não estiver em
+    UTF-8, tenta Latin-1, como o `load_csv`.
+    """
+    tmp_path = f"{parquet_path}.tmp"
+    con = connect()
+    try:
+        last_error = None
+        for encoding in ("utf-8", "latin-1"):
+            try:
+                con.execute(
+                    f"COPY (SELECT * FROM read_csv('{_sql_path(csv_path)}', encoding = '{encoding}')) "
+                    f"TO '{_sql_path(tmp_path)}' (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 122880)"
+                )
+                os.replace(tmp_path, parquet_path)
+                return
+            except Exception as e:
+                last_error = e
+        raise ValueError(f"Não foi possível converter o arquivo CSV para Parquet: {last_error}")
+    finally:
+        con.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def parquet_sample(parquet_path: str, rows: int) -> pd.DataFrame:
+    """Amostra aleatória (reservatório, reproduzível) do Parquet, lida em uma única varredura."""
+    con = connect()
+    try:
+        return con.execute(
+            f"SELECT * FROM read_parquet('{_sql_path(parquet_path)}') "
+            f"USING SAMPLE reservoir({int(rows)} ROWS) REPEATABLE (42)"
+        ).df()
+    finally:
+        con.close()
+
+
+def parquet_row_count(parquet_path: str) -> int:
+    """Total de linhas (lido dos metadados do Parquet, sem varrer os dados)."""
+    con = connect()
+    try:
+        return int(con.execute(f"SELECT COUNT(*) FROM read_parquet('{_sql_path(parquet_path)}')").fetchone()[0])
+    finally:
+        con.close()
+
+
+def profile_parquet(parquet_path: str) -> dict:
+    """Linhas, valores ausentes por coluna, linhas duplicadas e primeiras linhas, calculados no DuckDB."""
+    con = connect()
+    try:
+        source = f"read_parquet('{_sql_path(parquet_path)}')"
+        columns = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+        counts = ", ".join(f'COUNT(*) - COUNT("{c.replace(chr(34), chr(34) * 2)}")' for c in columns)
+        row = con.execute(f"SELECT COUNT(*), {counts} FROM {source}").fetchone()
+        distinct = con.execute(f"SELECT COUNT(*) FROM (SELECT DISTINCT * FROM {source})").fetchone()[0]
+        return {
+            "rows": int(row[0]),
+            "missing_values": {c: int(n) for c, n in zip(columns, row[1:])},
+            "duplicated_rows": int(row[0] - distinct),
+            "head": con.execute(f"SELECT * FROM {source} LIMIT 5").df(),
+        }
+    finally:
+        con.close()
@@ -0,0 +1,138 @@
+"""
+Serviços compartilhados pelo processo.
+
+A configuração e o cliente do Supabase (uma única sessão HTTP, com conexões
+keep-alive reaproveitadas) são criados uma vez e usados por todas as sessões e
+execuções do script, em vez de a cada rerun do Streamlit. Outros módulos com
+recursos do processo (clientes do LLM, caches) registram a própria limpeza
+com `add_shutdown_hook`; `shutdown()` executa esses ganchos, fecha o cliente
+do Supabase e o loop assíncrono e é registrado no `atexit`. `health()`
+verifica os serviços para o painel de debug.
+"""
+import atexit
+import threading
+import time
+
+from utils.async_runtime import get_event_loop, shutdown as shutdown_runtime
+from utils.config import get_config, reload_config
+from utils.llm_scheduler import get_scheduler
+from utils.memory import SupabaseMemory
+from utils.query_engine import is_available as duckdb_available
+
+# Intervalo mínimo entre verificações de saúde (a verificação do Supabase faz uma consulta)
+HEALTH_TTL_SECONDS = 30
+
+
+class Services:
+    """Configuração e clientes do processo, criados sob demanda e reaproveitados."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.started_at = time.time()
+        self._memory = None
+        self._lock = threading.Lock()
+        self._health = None
+        self._health_at = 0.0
+
+    @property
+    def memory(self) -> SupabaseMemory:
+        """Persistência no Supabase; o cliente é criado na primeira chamada."""
+        with self._lock:
+            if self._memory is None:
+                self._memory = SupabaseMemory(url=self.config["supabase_url"], key=self.config["supabase_key"])
+            return self._memory
+
+    def health(self, max_age: float = HEALTH_TTL_SECONDS) -> dict:
+        """Estado de cada serviço (`ok` e detalhes), reaproveitado por até `max_age` segundos."""
+        if self._health is not None and time.monotonic() - self._health_at < max_age:
+            return self._health
+
+        checks = {
+            "config": {"ok": bool(self.config["google_api_key"]),
+                       "supabase_configurado": bool(self.config["supabase_url"] and self.config["supabase_key"])},
+            "supabase": self._check_supabase(),
+            "event_loop": {"ok": get_event_loop().is_running()},
+            "llm_scheduler": {"ok": True, **{k: v for k, v in get_scheduler().metrics().items()
+                                             if k in ("queue_length", "active", "max_concurrency")}},
+            "duckdb": {"ok": duckdb_available()},
+        }
+        self._health = {
+            "ok": all(check["ok"] for check in checks.values()),
+            "uptime_s": round(time.time() - self.started_at),
+            "checks": checks,
+        }
+        self._health_at = time.monotonic()
+        return self._health
+
+    def _check_supabase(self) -> dict:
+        started_at = time.perf_counter()
+        try:
+            self.memory.client.table("sessions").select("id").limit(1).execute()
+            return {"ok": True, "latency_ms": round((time.perf_counter() - started_at) * 1000, 1)}
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    def close(self):
+        """Fecha a sessão HTTP do cliente do Supabase."""
+        with self._lock:
+            memory, self._memory = self._memory, None
+        postgrest = getattr(getattr(memory, "client", None), "_postgrest", None)
+        session = getattr(postgrest, "session", None)
+        if session is not None:
+            try:
+                session.close()
+            except Exception as e:
+                print(f"Erro ao fechar o cliente do Supabase: {e}")
+
+
+_services: Services | None = None
+_services_lock = threading.Lock()
+_shutdown_hooks = []
+
+
+def add_shutdown_hook(hook):
+    """Registra `hook()` para liberar recursos do processo no encerramento e ao recarregar os serviços."""
+    if hook not in _shutdown_hooks:
+        _shutdown_hooks.append(hook)
+
+
+def _run_shutdown_hooks():
+    for hook in list(_shutdown_hooks):
+        try:
+            hook()
+        except Exception as e:
+            print(f"Erro ao encerrar serviço ({getattr(hook, '__name__', hook)}): {e}")
+
+
+def get_services() -> Services:
+    """Serviços únicos do processo, criados na primeira chamada."""
+    global _services
+    with _services_lock:
+        if _services is None:
+            _services = Services(get_config())
+    return _services
+
+
+def reload_services() -> Services:
+    """Relê a configuração e recria os clientes (ex.: após alterar o secrets.toml)."""
+    global _services
+    with _services_lock:
+        if _services is not None:
+            _services.close()
+        _run_shutdown_hooks()
+        _services = Services(reload_config())
+    return _services
+
+
+def shutdown():
+    """Encerra os serviços do processo: ganchos registrados, cliente do Supabase e loop assíncrono."""
+    global _services
+    with _services_lock:
+        if _services is not None:
+            _services.close()
+            _services = None
+    _run_shutdown_hooks()
+    shutdown_runtime()
+
+
+atexit.register(shutdown)
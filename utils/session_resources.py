@@ -0,0 +1,403 @@
+"""
+Recursos pesados de cada sessão com orçamento de memória por processo.
+
+O DataFrame, os metadados do dataset e as figuras Plotly de uma sessão ficam em
+um `SessionResources` guardado no `st.session_state` (o ciclo de vida acompanha
+o da sessão) e registrado no gerenciador do processo. O DataFrame é uma visão
+do dataset compartilhado do `DatasetRegistry`, de modo que sessões com o mesmo
+arquivo não duplicam os dados. O gerenciador contabiliza os bytes em memória,
+descarrega os dados das sessões ociosas e, quando o total passa do orçamento,
+das sessões usadas há mais tempo. O acesso seguinte recarrega os dados de forma
+transparente.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+import pandas as pd
+import plotly.io as pio
+
+from utils.config import get_config
+from utils.dataset_registry import get_registry
+from utils.query_engine import table_name_for
+
+try:
+    import orjson  # noqa: F401
+    FIGURE_JSON_ENGINE = "orjson"
+except ImportError:  # pragma: no cover - dependência opcional
+    FIGURE_JSON_ENGINE = "json"
+
+SESSION_STATE_KEY = "resources"
+CACHE_DIR = os.getenv("INSIGHTAGENT_SESSION_CACHE_DIR",
+                      os.path.join(tempfile.gettempdir(), "insightagent_sessions"))
+
+
+def serialize_figure(fig) -> str | None:
+    """
+    JSON da figura, ou None se ela não puder ser serializada.
+
+    Usa o orjson quando instalado; no Plotly 6+ os arrays NumPy são gravados
+    como arrays tipados em base64, lidos diretamente pelo plotly.js. A figura
+    já foi validada ao ser construída, então a validação não é repetida.
+    """
+    try:
+        return pio.to_json(fig, validate=False, engine=FIGURE_JSON_ENGINE)
+    except Exception as e:
+        print(f"Erro ao serializar gráfico: {e}")
+        return None
+
+
+class _SessionDataset:
+    """Visão de um dataset compartilhado usada por uma sessão (uma tabela)."""
+
+    def __init__(self, owner, file_hash: str, table: str, df: pd.DataFrame, info: dict):
+        self.file_hash = file_hash
+        self.table = table
+        self.info = info
+        self.df = df
+        # Compartilhado com o finalizador: a visão está em memória?
+        self._active = [True]
+        # Libera a referência no registro quando a sessão deixar de existir
+        self._release = weakref.finalize(owner, _release_from_registry, file_hash, self._active)
+
+    def view(self) -> tuple:
+        """(visão, recarregou?) — reativa o dataset no registro se tiver sido descarregado."""
+        if self.df is not None:
+            return self.df, False
+        self.df = get_registry().reactivate(self.file_hash)
+        self._active[0] = True
+        return self.df, True
+
+    def deactivate(self) -> int:
+        if self.df is None:
+            return 0
+        # Alterações feitas pela sessão (copy-on-write) são descartadas junto com a visão
+        self.df = None
+        self._active[0] = False
+        return get_registry().deactivate(self.file_hash)
+
+    def release(self):
+        self._release()
+        self.df = None
+
+
+class SessionResources:
+    """DataFrames, metadados e figuras de uma sessão, com descarga para o disco."""
+
+    def __init__(self, session_key: str):
+        self.session_key = session_key
+        self.df_info = None
+        self.last_access = time.monotonic()
+        self.offloads = 0
+        self.reloads = 0
+        self._lock = threading.RLock()
+        self._datasets = []         # um por arquivo; o primeiro é o DataFrame principal (`df`)
+        self._figures = {}       # id -> figura em memória
+        self._figure_bytes = {}  # id -> tamanho (JSON) em bytes
+        self._figure_json = {}   # id -> JSON da figura, serializado uma única vez
+        self._figure_paths = {}  # id -> arquivo no disco
+        self._dir = os.path.join(CACHE_DIR, uuid.uuid4().hex)
+        # Remove os arquivos quando a sessão deixa de existir
+        weakref.finalize(self, shutil.rmtree, self._dir, True)
+
+    def touch(self):
+        self.last_access = time.monotonic()
+
+    @property
+    def has_dataset(self) -> bool:
+        """Indica se há dataset carregado (em memória ou descarregado) sem recarregá-lo."""
+        return bool(self._datasets)
+
+    @property
+    def df(self) -> pd.DataFrame | None:
+        """DataFrame principal (primeiro arquivo enviado)."""
+        with self._lock:
+            self.touch()
+            if not self._datasets:
+                return None
+            df, reloaded = self._datasets[0].view()
+            self.reloads += int(reloaded)
+            return df
+
+    @property
+    def tables(self) -> dict:
+        """Todas as tabelas da sessão (nome da tabela -> DataFrame), na ordem do upload."""
+        with self._lock:
+            self.touch()
+            tables = {}
+            for dataset in self._datasets:
+                df, reloaded = dataset.view()
+                self.reloads += int(reloaded)
+                tables[dataset.table] = df
+            return tables
+
+    @property
+    def table_names(self) -> list:
+        return [dataset.table for dataset in self._datasets]
+
+    def load_dataset(self, file_hash: str, loader, name: str):
+        """Associa à sessão um único dataset (atalho para `load_datasets`)."""
+        self.load_datasets([(file_hash, loader, name)])
+
+    def load_datasets(self, files: list):
+        """
+        Substitui os datasets da sessão por `files`: lista de (hash, loader, nome do arquivo).
+
+        Se outra sessão já carregou o mesmo arquivo, a sessão recebe uma visão do
+        mesmo DataFrame e o `loader()` não é chamado.
+        """
+        registry = get_registry()
+        acquired = []
+        try:
+            for file_hash, loader, name in files:
+                df, info = registry.acquire(file_hash, loader, name)
+                table = table_name_for(name, existing=[d.table for d in acquired])
+                acquired.append(_SessionDataset(self, file_hash, table, df, info))
+        except Exception:
+            for dataset in acquired:
+                dataset.release()
+            raise
+
+        with self._lock:
+            # Os novos datasets são adquiridos antes de liberar os antigos para não descartar os reaproveitados
+            self._release_datasets()
+            self._datasets = acquired
+            self.df_info = acquired[0].info if acquired else None
+            self.touch()
+        get_manager().enforce_budget(current=self)
+
+    def add_figure(self, fig) -> str | None:
+        """
+        Guarda a figura e retorna o id usado nas mensagens do chat.
+
+        A figura é serializada aqui, uma única vez: o JSON é reaproveitado na
+        validação, na persistência e na gravação em disco.
+        """
+        if fig is None:
+            return None
+        fig_id = uuid.uuid4().hex[:12]
+        payload = serialize_figure(fig)
+        with self._lock:
+            self._figures[fig_id] = fig
+            self._figure_bytes[fig_id] = len(payload) if payload is not None else 0
+            if payload is not None:
+                self._figure_json[fig_id] = payload
+            self.touch()
+        get_manager().enforce_budget(current=self)
+        return fig_id
+
+    def figure_is_valid(self, fig_id: str | None) -> bool:
+        """Indica se a figura pôde ser serializada ao ser guardada (verificado uma única vez, em `add_figure`)."""
+        return self._figure_bytes.get(fig_id, 0) > 0
+
+    def figure_json(self, fig_id: str | None) -> str | None:
+        """JSON guardado da figura (lido do disco se ela tiver sido descarregada), sem serializar de novo."""
+        if fig_id is None:
+            return None
+        with self._lock:
+            payload = self._figure_json.get(fig_id)
+            if payload is None and fig_id in self._figure_paths:
+                with open(self._figure_paths[fig_id], encoding="utf-8") as f:
+                    payload = f.read()
+            return payload
+
+    def get_figure(self, fig_id: str | None):
+        """Figura pelo id, recarregada do disco se tiver sido descarregada."""
+        if fig_id is None:
+            return None
+        with self._lock:
+            self.touch()
+            fig = self._figures.get(fig_id)
+            if fig is None and fig_id in self._figure_paths:
+                with open(self._figure_paths[fig_id], encoding="utf-8") as f:
+                    payload = f.read()
+                fig = pio.from_json(payload)
+                self._figures[fig_id] = fig
+                self._figure_json[fig_id] = payload
+                self.reloads += 1
+            return fig
+
+    def clear(self):
+        """Descarta dataset, metadados e figuras da sessão (memória e disco)."""
+        with self._lock:
+            self._release_datasets()
+            self.df_info = None
+            self._figures.clear()
+            self._figure_bytes.clear()
+            self._figure_json.clear()
+            self._figure_paths.clear()
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _release_datasets(self):
+        for dataset in self._datasets:
+            dataset.release()
+        self._datasets = []
+
+    def _figures_in_memory_bytes(self) -> int:
+        # Cada figura em memória conta o objeto (estimado pelo tamanho do JSON) e o JSON guardado
+        return sum(self._figure_bytes.get(i, 0) for i in list(self._figures)) + \
+            sum(len(payload) for payload in list(self._figure_json.values()))
+
+    @property
+    def memory_bytes(self) -> int:
+        """Bytes próprios da sessão em memória (o dataset compartilhado é contado no registro)."""
+        return self._figures_in_memory_bytes()
+
+    @property
+    def holds_memory(self) -> bool:
+        """Há algo a descarregar: uma visão de dataset ativa ou figuras em memória."""
+        return any(d.df is not None for d in self._datasets) or bool(self._figures)
+
+    def footprint(self) -> dict:
+        with self._lock:
+            figures_in_memory = self._figures_in_memory_bytes()
+            return {
+                "df_bytes": sum(get_registry().dataset_bytes(d.file_hash) for d in self._datasets),
+                "df_in_memory": any(d.df is not None for d in self._datasets),
+                "tables": len(self._datasets),
+                "figures": len(self._figure_bytes),
+                "figures_bytes": sum(self._figure_bytes.values()),
+                "figures_in_memory_bytes": figures_in_memory,
+                "memory_bytes": self.memory_bytes,
+            }
+
+    def offload(self, blocking: bool = True) -> int:
+        """Grava DataFrame e figuras no disco e libera a memória; retorna os bytes liberados."""
+        if not self._lock.acquire(blocking=blocking):
+            return 0
+        try:
+            freed = 0
+            os.makedirs(self._dir, exist_ok=True)
+            for dataset in self._datasets:
+                freed += dataset.deactivate()
+            for fig_id in list(self._figures):
+                payload = self._figure_json.pop(fig_id, None)
+                if fig_id not in self._figure_paths:
+                    if payload is None:
+                        continue  # figura que não pôde ser serializada: fica em memória
+                    path = os.path.join(self._dir, f"fig_{fig_id}.json")
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.write(payload)
+                    self._figure_paths[fig_id] = path
+                del self._figures[fig_id]
+                freed += self._figure_bytes.get(fig_id, 0) + len(payload or "")
+            if freed:
+                self.offloads += 1
+            return freed
+        except Exception as e:
+            print(f"Erro ao descarregar dados da sessão para o disco: {e}")
+            return 0
+        finally:
+            self._lock.release()
+
+
+def _release_from_registry(file_hash: str, active: list):
+    get_registry().release(file_hash, active=active[0])
+
+
+class SessionResourceManager:
+    """Registro dos recursos de todas as sessões do processo e aplicação do orçamento."""
+
+    def __init__(self, budget_bytes: int, idle_seconds: float):
+        self.budget_bytes = budget_bytes
+        self.idle_seconds = idle_seconds
+        self._sessions = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def register(self, resources: SessionResources):
+        with self._lock:
+            self._sessions[id(resources)] = resources
+
+    def sessions(self) -> list:
+        with self._lock:
+            return list(self._sessions.values())
+
+    def enforce_budget(self, current: SessionResources | None = None):
+        """Descarrega as sessões ociosas e, se preciso, as menos usadas até caber no orçamento."""
+        now = time.monotonic()
+        others = sorted((s for s in self.sessions() if s is not current), key=lambda s: s.last_access)
+        for resources in others:
+            if now - resources.last_access > self.idle_seconds and resources.holds_memory:
+                resources.offload(blocking=False)
+
+        total = (sum(s.memory_bytes for s in others) + (current.memory_bytes if current is not None else 0)
+                 + get_registry().memory_bytes())
+        for resources in others:
+            if total <= self.budget_bytes:
+                break
+            if resources.holds_memory:
+                # Inclui os bytes do dataset compartilhado quando esta era a última sessão ativa
+                total -= resources.offload(blocking=False)
+        if total > self.budget_bytes:
+            print(f"Aviso: uso de memória das sessões ({total / 1024 / 1024:.0f} MB) acima do orçamento "
+                  f"({self.budget_bytes / 1024 / 1024:.0f} MB).")
+
+    def status(self, limit: int = 10) -> dict:
+        """Totais do processo e as maiores sessões por bytes em memória."""
+        now = time.monotonic()
+        rows = []
+        for resources in self.sessions():
+            footprint = resources.footprint()
+            rows.append({
+                "sessão": f"...{str(resources.session_key)[-6:]}",
+                "memória_mb": round((footprint["memory_bytes"]
+                                     + (footprint["df_bytes"] if footprint["df_in_memory"] else 0)) / 1024 / 1024, 2),
+                "dataset_mb": round(footprint["df_bytes"] / 1024 / 1024, 2),
+                "tabelas": footprint["tables"],
+                "dataset_em_memória": footprint["df_in_memory"],
+                "figuras": footprint["figures"],
+                "figuras_mb": round(footprint["figures_bytes"] / 1024 / 1024, 2),
+                "ociosa_s": round(now - resources.last_access),
+                "descargas": resources.offloads,
+                "recargas": resources.reloads,
+            })
+        rows.sort(key=lambda r: r["memória_mb"], reverse=True)
+        registry = get_registry()
+        own_bytes = sum(s.memory_bytes for s in self.sessions())
+        return {
+            "sessions": len(rows),
+            # Datasets compartilhados contam uma única vez no total
+            "memory_mb": round((own_bytes + registry.memory_bytes()) / 1024 / 1024, 2),
+            "budget_mb": round(self.budget_bytes / 1024 / 1024, 2),
+            "largest": rows[:limit],
+            "datasets": registry.status(),
+        }
+
+
+_manager: SessionResourceManager | None = None
+_manager_lock = threading.Lock()
+
+
+def get_manager() -> SessionResourceManager:
+    """Gerenciador único do processo, criado a partir da configuração."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            config = get_config()
+            _manager = SessionResourceManager(
+                budget_bytes=config["session_memory_budget_mb"] * 1024 * 1024,
+                idle_seconds=config["session_idle_seconds"],
+            )
+    return _manager
+
+
+def get_session_resources(session_state) -> SessionResources:
+    """Recursos da sessão do Streamlit, criados e registrados no primeiro acesso."""
+    resources = session_state.get(SESSION_STATE_KEY)
+    if resources is None:
+        resources = SessionResources(session_state.get("user_id") or uuid.uuid4().hex)
+        session_state[SESSION_STATE_KEY] = resources
+        get_manager().register(resources)
+    resources.touch()
+    # Cada execução do script aproveita para descarregar as sessões ociosas
+    get_manager().enforce_budget(current=resources)
+    return resources
+
+
+def memory_status(limit: int = 10) -> dict:
+    """Resumo do uso de memória das sessões para o painel de debug."""
+    return get_manager().status(limit)
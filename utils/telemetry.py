@@ -0,0 +1,363 @@
+"""
+Contabilidade de tokens e latência das chamadas aos agentes.
+
+Cada invocação de chain registra tokens de prompt/resposta, latência, tempo até
+o primeiro token e tokens servidos pelo cache do provedor. Os números são
+agregados por sessão e por processo e podem ser exportados no formato texto do
+Prometheus ou gravados como JSON Lines em um arquivo local.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Sessão do Streamlit à qual as chamadas do contexto atual pertencem
+current_session = contextvars.ContextVar("insightagent_session", default=None)
+
+# Quantidade máxima de sessões mantidas em memória (LRU)
+MAX_TRACKED_SESSIONS = 1000
+# Amostras mantidas por agente para o cálculo de percentis
+LATENCY_SAMPLES = 500
+
+METRICS_LOG_PATH = os.getenv("INSIGHTAGENT_METRICS_LOG")
+
+_QUANTILES = (0.5, 0.9, 0.99)
+_lock = threading.Lock()
+
+
+def _percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _AgentStats:
+    """Acumuladores de um agente."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.latency_sum = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.ttfts = deque(maxlen=LATENCY_SAMPLES)
+
+    def add(self, event: dict):
+        self.calls += 1
+        self.errors += 0 if event["success"] else 1
+        self.prompt_tokens += event["prompt_tokens"]
+        self.completion_tokens += event["completion_tokens"]
+        self.cached_tokens += event["cached_tokens"]
+        self.latency_sum += event["latency_s"]
+        self.latencies.append(event["latency_s"])
+        if event["ttft_s"] is not None:
+            self.ttfts.append(event["ttft_s"])
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "latency_avg_s": round(self.latency_sum / self.calls, 3) if self.calls else 0.0,
+            "latency_p50_s": round(_percentile(self.latencies, 0.5), 3),
+            "latency_p95_s": round(_percentile(self.latencies, 0.95), 3),
+            "ttft_p50_s": round(_percentile(self.ttfts, 0.5), 3),
+        }
+
+
+class _Aggregate:
+    """Agregado de chamadas (por processo ou por sessão)."""
+
+    def __init__(self):
+        self.agents = {}
+        self.routes = {}
+        self.caches = {}
+        self.parses = {}
+        self.renders = {}  # parte da página -> deque de durações (s)
+        self.repairs = {}  # resultado da correção automática ("repaired"/"failed") -> quantidade
+        self.repair_latencies = {}  # resultado -> deque de latências adicionadas (s)
+        self.repair_attempts = 0
+
+    def add_call(self, event: dict):
+        self.agents.setdefault(event["agent"], _AgentStats()).add(event)
+
+    def add_route(self, agent: str):
+        self.routes[agent] = self.routes.get(agent, 0) + 1
+
+    def add_parse(self, agent: str, outcome: str):
+        counts = self.parses.setdefault(agent, {"direct": 0, "repaired": 0, "failed": 0})
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+    def add_render(self, part: str, seconds: float):
+        self.renders.setdefault(part, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    def add_repair(self, outcome: str, attempts: int, seconds: float):
+        self.repairs[outcome] = self.repairs.get(outcome, 0) + 1
+        self.repair_latencies.setdefault(outcome, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+        self.repair_attempts += attempts
+
+    def add_cache(self, cache: str, hit: bool):
+        counts = self.caches.setdefault(cache, {"hits": 0, "misses": 0})
+        counts["hits" if hit else "misses"] += 1
+
+    def to_dict(self) -> dict:
+        agents = {name: stats.to_dict() for name, stats in self.agents.items()}
+        return {
+            "agents": agents,
+            "totals": {
+                "calls": sum(a["calls"] for a in agents.values()),
+                "prompt_tokens": sum(a["prompt_tokens"] for a in agents.values()),
+                "completion_tokens": sum(a["completion_tokens"] for a in agents.values()),
+                "cached_tokens": sum(a["cached_tokens"] for a in agents.values()),
+            },
+            "routes": dict(self.routes),
+            "caches": {name: dict(counts) for name, counts in self.caches.items()},
+            "parses": {name: dict(counts) for name, counts in self.parses.items()},
+            "renders": {
+                part: {
+                    "runs": len(samples),
+                    "p50_ms": round(_percentile(samples, 0.5) * 1000, 1),
+                    "p95_ms": round(_percentile(samples, 0.95) * 1000, 1),
+                }
+                for part, samples in self.renders.items()
+            },
+            "repairs": self._repairs_dict(),
+        }
+
+    def _repairs_dict(self) -> dict:
+        samples = [seconds for latencies in self.repair_latencies.values() for seconds in latencies]
+        repaired, failed = self.repairs.get("repaired", 0), self.repairs.get("failed", 0)
+        return {
+            "repaired": repaired,
+            "failed": failed,
+            "attempts": self.repair_attempts,
+            "success_rate": round(repaired / (repaired + failed), 3) if repaired + failed else None,
+            "p50_ms": round(_percentile(samples, 0.5) * 1000, 1),
+            "p95_ms": round(_percentile(samples, 0.95) * 1000, 1),
+        }
+
+
+_process = _Aggregate()
+_sessions = OrderedDict()
+
+
+def _session_aggregate(session_id) -> _Aggregate | None:
+    """Agregado da sessão (chamar com `_lock`), descartando as sessões mais antigas."""
+    if session_id is None:
+        return None
+    aggregate = _sessions.get(session_id)
+    if aggregate is None:
+        aggregate = _sessions[session_id] = _Aggregate()
+        while len(_sessions) > MAX_TRACKED_SESSIONS:
+            _sessions.popitem(last=False)
+    else:
+        _sessions.move_to_end(session_id)
+    return aggregate
+
+
+def _write_log(event: dict):
+    if not METRICS_LOG_PATH:
+        return
+    try:
+        with open(METRICS_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Erro ao gravar log de métricas: {e}")
+
+
+def set_current_session(session_id: str | None):
+    """Associa as próximas chamadas do contexto atual à sessão informada."""
+    current_session.set(session_id)
+
+
+def record_llm_call(agent: str, prompt_tokens: int, completion_tokens: int, latency_s: float,
+                    ttft_s: float | None = None, cached_tokens: int = 0, success: bool = True,
+                    estimated: bool = False):
+    """Registra uma invocação de chain."""
+    event = {
+        "type": "llm_call",
+        "ts": time.time(),
+        "session": current_session.get(),
+        "agent": agent,
+        "prompt_tokens": int(prompt_tokens),
+        "completion_tokens": int(completion_tokens),
+        "cached_tokens": int(cached_tokens),
+        "latency_s": round(latency_s, 4),
+        "ttft_s": round(ttft_s, 4) if ttft_s is not None else None,
+        "success": success,
+        "estimated_tokens": estimated,
+    }
+    with _lock:
+        _process.add_call(event)
+        session = _session_aggregate(event["session"])
+        if session is not None:
+            session.add_call(event)
+    _write_log(event)
+
+
+def record_route(agent: str | None):
+    """Registra o agente escolhido pelo coordenador."""
+    agent = agent or "desconhecido"
+    with _lock:
+        _process.add_route(agent)
+        session = _session_aggregate(current_session.get())
+        if session is not None:
+            session.add_route(agent)
+    _write_log({"type": "route", "ts": time.time(), "session": current_session.get(), "agent": agent})
+
+
+def record_parse(agent: str, outcome: str):
+    """Registra a leitura de uma resposta JSON: "direct", "repaired" (reparo local) ou "failed"."""
+    with _lock:
+        _process.add_parse(agent, outcome)
+        session = _session_aggregate(current_session.get())
+        if session is not None:
+            session.add_parse(agent, outcome)
+    _write_log({"type": "parse", "ts": time.time(), "session": current_session.get(), "agent": agent,
+                "outcome": outcome})
+
+
+def record_render(part: str, seconds: float):
+    """Registra o tempo de servidor de uma execução do script ("app") ou de um fragmento da página."""
+    with _lock:
+        _process.add_render(part, seconds)
+        session = _session_aggregate(current_session.get())
+        if session is not None:
+            session.add_render(part, seconds)
+
+
+@contextmanager
+def measure_render(part: str):
+    """Mede o bloco com `record_render` (inclusive quando interrompido por um rerun do Streamlit)."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_render(part, time.perf_counter() - started_at)
+
+
+def record_repair(outcome: str, attempts: int, seconds: float):
+    """Registra uma correção automática de código: "repaired" ou "failed", tentativas e latência adicionada."""
+    with _lock:
+        _process.add_repair(outcome, attempts, seconds)
+        session = _session_aggregate(current_session.get())
+        if session is not None:
+            session.add_repair(outcome, attempts, seconds)
+    _write_log({"type": "repair", "ts": time.time(), "session": current_session.get(), "outcome": outcome,
+                "attempts": attempts, "latency_s": round(seconds, 4)})
+
+
+def record_cache(cache: str, hit: bool):
+    """Registra um acerto ou falta em um cache da aplicação."""
+    with _lock:
+        _process.add_cache(cache, hit)
+        session = _session_aggregate(current_session.get())
+        if session is not None:
+            session.add_cache(cache, hit)
+
+
+def process_snapshot() -> dict:
+    """Métricas agregadas de todo o processo."""
+    with _lock:
+        return _process.to_dict()
+
+
+def session_snapshot(session_id: str | None = None) -> dict:
+    """Métricas agregadas de uma sessão (a atual, por padrão)."""
+    session_id = session_id if session_id is not None else current_session.get()
+    with _lock:
+        aggregate = _sessions.get(session_id)
+        return aggregate.to_dict() if aggregate is not None else _Aggregate().to_dict()
+
+
+def to_prometheus() -> str:
+    """Exporta as métricas do processo no formato texto do Prometheus."""
+    lines = []
+
+    def _metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+
+    with _lock:
+        agents = list(_process.agents.items())
+        routes = dict(_process.routes)
+        caches = {name: dict(counts) for name, counts in _process.caches.items()}
+        parses = {name: dict(counts) for name, counts in _process.parses.items()}
+        latencies = {name: list(stats.latencies) for name, stats in agents}
+        ttfts = {name: list(stats.ttfts) for name, stats in agents}
+        renders = {part: list(samples) for part, samples in _process.renders.items()}
+        repairs = dict(_process.repairs)
+        repair_latencies = {outcome: list(samples) for outcome, samples in _process.repair_latencies.items()}
+        repair_attempts = _process.repair_attempts
+
+    _metric("insightagent_llm_calls_total", "counter", "Invocações de chain por agente.",
+            [({"agent": n}, s.calls) for n, s in agents])
+    _metric("insightagent_llm_errors_total", "counter", "Invocações de chain que falharam.",
+            [({"agent": n}, s.errors) for n, s in agents])
+    _metric("insightagent_llm_tokens_total", "counter", "Tokens por agente e tipo.",
+            [({"agent": n, "type": t}, v) for n, s in agents
+             for t, v in (("prompt", s.prompt_tokens), ("completion", s.completion_tokens), ("cached", s.cached_tokens))])
+
+    for metric, help_text, source, label in (
+        ("insightagent_llm_latency_seconds", "Latência total da invocação.", latencies, "agent"),
+        ("insightagent_llm_ttft_seconds", "Tempo até o primeiro token.", ttfts, "agent"),
+        ("insightagent_render_seconds", "Tempo de servidor por execução do script ou fragmento.", renders, "part"),
+        ("insightagent_chart_repair_seconds", "Latência adicionada pela correção automática de gráficos.",
+         repair_latencies, "outcome"),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} summary")
+        for name, samples in source.items():
+            for q in _QUANTILES:
+                lines.append(f'{metric}{{{label}="{name}",quantile="{q}"}} {_percentile(samples, q):.4f}')
+            lines.append(f'{metric}_sum{{{label}="{name}"}} {sum(samples):.4f}')
+            lines.append(f'{metric}_count{{{label}="{name}"}} {len(samples)}')
+
+    _metric("insightagent_routes_total", "counter", "Perguntas roteadas por agente.",
+            [({"agent": n}, v) for n, v in routes.items()])
+    _metric("insightagent_cache_requests_total", "counter", "Consultas aos caches da aplicação.",
+            [({"cache": n, "result": r}, counts[k]) for n, counts in caches.items()
+             for r, k in (("hit", "hits"), ("miss", "misses"))])
+    _metric("insightagent_chart_repairs_total", "counter", "Correções automáticas de gráficos por resultado.",
+            [({"outcome": o}, v) for o, v in repairs.items()])
+    _metric("insightagent_chart_repair_attempts_total", "counter", "Chamadas ao agente de correção de gráficos.",
+            [({}, repair_attempts)])
+    _metric("insightagent_output_parses_total", "counter", "Respostas JSON lidas por agente e resultado.",
+            [({"agent": n, "outcome": o}, v) for n, counts in parses.items() for o, v in counts.items()])
+    return "\n".join(lines) + "\n"
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Captura o uso de tokens informado pelo modelo ao final da geração."""
+
+    def __init__(self):
+        self.prompt_chars = 0
+        self.usage = None
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompt_chars = sum(len(str(m.content)) for batch in messages for m in batch)
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if usage:
+                    self.usage = usage
+                    return
+        llm_output = response.llm_output or {}
+        if llm_output.get("usage_metadata"):
+            self.usage = llm_output["usage_metadata"]
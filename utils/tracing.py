@@ -0,0 +1,281 @@
+"""
+Tracing por spans de cada turno do chat.
+
+Um turno abre um span raiz e cada etapa (roteamento, chamada ao LLM, execução
+do código, renderização do gráfico, gravação no Supabase) abre um span filho.
+Os spans seguem o modelo do OpenTelemetry (trace_id de 128 bits, span_id de 64
+bits, atributos, status) e, ao final do turno, são exportados em OTLP/JSON para
+um arquivo local (`INSIGHTAGENT_TRACE_FILE`) e/ou enviados a um coletor OTLP/HTTP
+(`INSIGHTAGENT_TRACE_ENDPOINT`). O resumo por etapa fica disponível para o
+painel de debug.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from utils.telemetry import current_session
+
+TRACE_FILE = os.getenv("INSIGHTAGENT_TRACE_FILE")
+TRACE_ENDPOINT = os.getenv("INSIGHTAGENT_TRACE_ENDPOINT")
+SERVICE_NAME = "insightagent-eda"
+
+# Turnos mantidos por sessão para o painel de debug
+RECENT_TURNS_PER_SESSION = 20
+MAX_TRACKED_SESSIONS = 1000
+# Traces aguardando envio ao coletor; acima disso novos traces são descartados
+MAX_PENDING_EXPORTS = 256
+
+_current_span = contextvars.ContextVar("insightagent_span", default=None)
+_lock = threading.Lock()
+_open_traces = {}  # trace_id -> lista de spans finalizados
+_recent_turns = OrderedDict()  # sessão -> deque de resumos de turno
+_file_lock = threading.Lock()
+_export_queue = queue.Queue(maxsize=MAX_PENDING_EXPORTS)
+_exporter_lock = threading.Lock()
+_exporter_thread = None
+_dropped_exports = 0
+
+
+class Span:
+    """Span compatível com o modelo de dados do OpenTelemetry."""
+
+    def __init__(self, name: str, trace_id: str, parent: "Span | None", attributes: dict | None = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.session = current_session.get()
+        self.attributes = dict(attributes or {})
+        self.status = "OK"
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error or ""} if self.status == "ERROR" else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+@contextmanager
+def start_span(name: str, **attributes):
+    """
+    Abre um span filho do span atual (ou um novo trace, se não houver span ativo).
+
+    Funciona tanto em código síncrono quanto dentro de corrotinas, pois o span
+    atual é propagado por `contextvars`.
+    """
+    parent = _current_span.get()
+    trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+    span = Span(name, trace_id, parent, attributes)
+    if parent is None:
+        with _lock:
+            _open_traces[trace_id] = []
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:  # rerun/stop do Streamlit derivam de BaseException e não contam como erro
+        span.status = "ERROR"
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        _finish(span)
+
+
+def current_span() -> Span | None:
+    """Span ativo no contexto atual."""
+    return _current_span.get()
+
+
+def traced(name: str):
+    """Decorador que envolve a função (síncrona ou assíncrona) em um span."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _finish(span: Span):
+    with _lock:
+        spans = _open_traces.get(span.trace_id)
+        if spans is None:
+            return
+        spans.append(span)
+        if span.parent_id is not None:
+            return
+        # Span raiz finalizado: o trace está completo
+        del _open_traces[span.trace_id]
+        if span.session is not None:
+            turns = _recent_turns.get(span.session)
+            if turns is None:
+                turns = _recent_turns[span.session] = deque(maxlen=RECENT_TURNS_PER_SESSION)
+                while len(_recent_turns) > MAX_TRACKED_SESSIONS:
+                    _recent_turns.popitem(last=False)
+            else:
+                _recent_turns.move_to_end(span.session)
+            turns.append(_summarize(span, spans))
+    _export(spans)
+
+
+def _summarize(root: Span, spans: list) -> dict:
+    """Resumo do turno: cada etapa com deslocamento e duração em milissegundos."""
+    ordered = sorted(spans, key=lambda s: s.start_ns)
+    return {
+        "trace_id": root.trace_id,
+        "name": root.name,
+        "started_at": root.start_ns / 1e9,
+        "duration_ms": round(root.duration_ms, 1),
+        "stages": [
+            {
+                "etapa": ("  " * s.depth) + s.name,
+                "início_ms": round((s.start_ns - root.start_ns) / 1e6, 1),
+                "duração_ms": round(s.duration_ms, 1),
+                "status": s.status,
+                "atributos": ", ".join(f"{k}={v}" for k, v in s.attributes.items()),
+            }
+            for s in ordered
+        ],
+    }
+
+
+def _otlp_payload(spans: list) -> dict:
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{
+                "scope": {"name": "insightagent.tracing"},
+                "spans": [s.to_otlp() for s in spans],
+            }],
+        }]
+    }
+
+
+def _export(spans: list):
+    if not TRACE_FILE and not TRACE_ENDPOINT:
+        return
+    payload = _otlp_payload(spans)
+    if TRACE_FILE:
+        line = json.dumps(payload, ensure_ascii=False) + "\n"
+        try:
+            # Vários turnos podem terminar ao mesmo tempo: uma linha por vez no arquivo
+            with _file_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            print(f"Erro ao gravar trace: {e}")
+    if TRACE_ENDPOINT:
+        _enqueue_export(payload)
+
+
+def _enqueue_export(payload: dict):
+    """Entrega o trace à thread exportadora; com a fila cheia o trace é descartado."""
+    global _dropped_exports
+    _ensure_exporter()
+    try:
+        _export_queue.put_nowait(payload)
+    except queue.Full:
+        with _lock:
+            _dropped_exports += 1
+            dropped = _dropped_exports
+        if dropped == 1 or dropped % 100 == 0:
+            print(f"Fila de envio de traces cheia; {dropped} trace(s) descartado(s)")
+
+
+def _ensure_exporter():
+    """Inicia (uma única vez) a thread que envia os traces ao coletor."""
+    global _exporter_thread
+    with _exporter_lock:
+        if _exporter_thread is None or not _exporter_thread.is_alive():
+            _exporter_thread = threading.Thread(target=_exporter_loop, name="insightagent-trace-exporter", daemon=True)
+            _exporter_thread.start()
+
+
+def _exporter_loop():
+    # Envio em segundo plano, um trace por vez, para não atrasar a resposta ao usuário
+    while True:
+        payload = _export_queue.get()
+        try:
+            _post_otlp(payload)
+        finally:
+            _export_queue.task_done()
+
+
+def _post_otlp(payload: dict):
+    request = urllib.request.Request(
+        TRACE_ENDPOINT.rstrip("/") + "/v1/traces",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        urllib.request.urlopen(request, timeout=5).close()
+    except Exception as e:
+        print(f"Erro ao enviar trace para o coletor: {e}")
+
+
+def export_metrics() -> dict:
+    """Traces aguardando envio ao coletor e traces descartados por fila cheia."""
+    with _lock:
+        dropped = _dropped_exports
+    return {"pending": _export_queue.qsize(), "max_pending": MAX_PENDING_EXPORTS, "dropped": dropped}
+
+
+def recent_turns(session_id: str | None = None) -> list:
+    """Resumos dos últimos turnos da sessão (a atual, por padrão), do mais recente ao mais antigo."""
+    session_id = session_id if session_id is not None else current_session.get()
+    with _lock:
+        return list(reversed(_recent_turns.get(session_id, ())))